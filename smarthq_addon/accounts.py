@@ -0,0 +1,208 @@
+"""
+Multi-account registry for the SmartHQ add-on
+
+Merges the devices and services of several SmartHQClient instances, one
+per SmartHQ account, into a single namespaced view with its own version
+and changelog, so the REST API can serve them as if they came from one
+client.
+"""
+
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from smarthq_client import DEFAULT_CHANGELOG_SIZE, SmartHQClient, SmartHQDevice, SmartHQService
+
+# Separates the account name from the entity ID in namespaced IDs
+NAMESPACE_SEPARATOR = "::"
+
+
+def validate_account_name(account: str):
+    """Reject account names that can't be told apart from the IDs they prefix"""
+    if not account:
+        raise ValueError("Account name must not be empty")
+    if NAMESPACE_SEPARATOR in account:
+        raise ValueError(f"Account name {account!r} must not contain {NAMESPACE_SEPARATOR!r}")
+
+
+class AccountRegistry:
+    """
+    Namespaced, merged view over several SmartHQ clients
+
+    Entity IDs are exposed as "<account>::<id>" when namespaced, or as-is
+    for a single unnamed account. The view is refreshed lazily from each
+    client's changelog whenever it is read.
+    """
+
+    def __init__(
+        self,
+        clients: Dict[str, SmartHQClient],
+        namespaced: bool = True,
+        changelog_size: int = DEFAULT_CHANGELOG_SIZE,
+    ):
+        for account in clients:
+            validate_account_name(account)
+        self.clients = clients
+        self.namespaced = namespaced
+
+        self._devices: Dict[str, SmartHQDevice] = {}
+        self._services: Dict[str, SmartHQService] = {}
+
+        self.state_epoch = uuid.uuid4().hex[:8]
+        self._state_version = 0
+        self._changelog: Deque[Tuple[int, str, str]] = deque(maxlen=changelog_size)
+
+        # (client epoch, client version) merged so far, per account
+        self._cursors: Dict[str, Tuple[str, int]] = {}
+
+    def add_client(self, account: str, client: SmartHQClient):
+        """Register the client of an account"""
+        validate_account_name(account)
+        if account in self.clients:
+            raise ValueError(f"Duplicate account name: {account!r}")
+        self.clients[account] = client
+
+    def qualify(self, account: str, entity_id: str) -> str:
+        """Namespace an entity ID of an account"""
+        if not self.namespaced:
+            return entity_id
+        return f"{account}{NAMESPACE_SEPARATOR}{entity_id}"
+
+    def split(self, qualified_id: str) -> Tuple[Optional[str], str]:
+        """Split a namespaced ID into (account, entity ID); account is None if unknown"""
+        if not self.namespaced:
+            return (next(iter(self.clients), None), qualified_id)
+        account, separator, entity_id = qualified_id.partition(NAMESPACE_SEPARATOR)
+        if not separator or account not in self.clients:
+            return None, qualified_id
+        return account, entity_id
+
+    def resolve(self, qualified_id: str) -> Tuple[Optional[SmartHQClient], str]:
+        """Get the client owning a namespaced ID and the ID within that client"""
+        account, entity_id = self.split(qualified_id)
+        return self.clients.get(account), entity_id
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.clients) and all(client.connected for client in self.clients.values())
+
+    @property
+    def devices(self) -> Dict[str, SmartHQDevice]:
+        self.refresh()
+        return self._devices
+
+    @property
+    def services(self) -> Dict[str, SmartHQService]:
+        self.refresh()
+        return self._services
+
+    @property
+    def state_version(self) -> int:
+        self.refresh()
+        return self._state_version
+
+    @property
+    def state_etag(self) -> str:
+        """Entity tag identifying the current merged version"""
+        version = self.state_version  # refreshes, possibly starting a new epoch
+        return f'"{self.state_epoch}-{version}"'
+
+    def get_device(self, device_id: str) -> Optional[SmartHQDevice]:
+        """Get a device by namespaced ID"""
+        return self.devices.get(device_id)
+
+    def get_service(self, service_id: str) -> Optional[SmartHQService]:
+        """Get a service by namespaced ID"""
+        return self.services.get(service_id)
+
+    def get_device_services(self, device_id: str) -> List[Tuple[str, SmartHQService]]:
+        """Get (namespaced ID, service) pairs for all services of a device"""
+        account, entity_id = self.split(device_id)
+        client = self.clients.get(account)
+        if client is None:
+            return []
+        return [
+            (self.qualify(account, service.service_id), service)
+            for service in client.get_device_services(entity_id)
+        ]
+
+    def service_device_id(self, service_id: str) -> Optional[str]:
+        """Namespaced ID of the device owning a service"""
+        service = self.get_service(service_id)
+        if service is None:
+            return None
+        account, _ = self.split(service_id)
+        return self.qualify(account, service.device_id)
+
+    def refresh(self):
+        """Merge every client change made since the last refresh"""
+        for account, client in self.clients.items():
+            cursor = self._cursors.get(account)
+            if cursor == (client.state_epoch, client.state_version):
+                continue
+
+            changes = None
+            if cursor and cursor[0] == client.state_epoch:
+                changes = client.get_changes_since(cursor[1])
+            if changes is None:
+                # Client restarted or its changelog moved on: rebuild everything
+                self._rebuild()
+                return
+
+            device_ids, service_ids = changes
+            for device_id in device_ids:
+                self._merge(self._devices, "device", self.qualify(account, device_id), client.get_device(device_id))
+            for service_id in service_ids:
+                self._merge(self._services, "service", self.qualify(account, service_id), client.get_service(service_id))
+            self._cursors[account] = (client.state_epoch, client.state_version)
+
+    def _merge(self, entities: Dict, entity_kind: str, qualified_id: str, entity):
+        """Apply one changed (or removed, if None) entity and log it"""
+        if entity is None:
+            entities.pop(qualified_id, None)
+        else:
+            entities[qualified_id] = entity
+        self._state_version += 1
+        self._changelog.append((self._state_version, entity_kind, qualified_id))
+
+    def _rebuild(self):
+        """Reload the merged view from scratch under a new epoch"""
+        self._devices.clear()
+        self._services.clear()
+        self._changelog.clear()
+        for account, client in self.clients.items():
+            for device_id, device in client.devices.items():
+                self._devices[self.qualify(account, device_id)] = device
+            for service_id, service in client.services.items():
+                self._services[self.qualify(account, service_id)] = service
+            self._cursors[account] = (client.state_epoch, client.state_version)
+        self.state_epoch = uuid.uuid4().hex[:8]
+        self._state_version += 1
+
+    def get_changes_since(self, version: int) -> Optional[Tuple[Set[str], Set[str]]]:
+        """
+        Get the namespaced device and service IDs changed after a merged version
+
+        Returns None when the changelog no longer reaches back to the given
+        version, in which case callers need a full snapshot instead.
+        """
+        current = self.state_version
+        if version > current:
+            return None
+
+        device_ids: Set[str] = set()
+        service_ids: Set[str] = set()
+        if version == current:
+            return device_ids, service_ids
+
+        if not self._changelog or self._changelog[0][0] > version + 1:
+            return None
+
+        for entry_version, entity_kind, entity_id in reversed(self._changelog):
+            if entry_version <= version:
+                break
+            if entity_kind == "device":
+                device_ids.add(entity_id)
+            else:
+                service_ids.add(entity_id)
+        return device_ids, service_ids
@@ -0,0 +1,451 @@
+"""
+Load-test benchmark for the SmartHQ add-on
+
+Runs the add-on (SmartHQ client and REST API, as main.py does) against a
+SmartHQSimulator in a separate process and measures:
+
+- initial sync and burst ingest throughput (frames per second, counted once
+  handled), and frames the burst dropped from full ingest queues
+- steady-state throughput under a configured update rate
+- event-to-REST visibility latency (cloud update until GET /services shows it)
+- REST latency per route while updates are flowing: as seen by a load
+  generator in its own process ("rest", including queueing at the server
+  and CPU shared with it) and as timed inside the add-on ("rest_server")
+- resident memory of the add-on process
+
+Results are written as JSON with fixed seeds and parameters, so runs on
+different commits can be compared:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from simulator import SmartHQSimulator
+
+logger = logging.getLogger(__name__)
+
+# Results where a larger value is better (throughputs); everything else is better smaller
+HIGHER_IS_BETTER_SUFFIX = "_per_sec"
+
+# REST routes exercised during the steady phase ({device}/{service} are filled in)
+REST_ROUTES = ("/devices", "/devices/{device}", "/services/{service}", "/devices/{device}/services", "/health")
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0-100)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize_ms(samples: List[float]) -> Dict[str, Any]:
+    """Count, p50, p99 and max of latencies given in seconds, in milliseconds"""
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 3) if value is not None else None
+    return {
+        "count": len(samples),
+        "p50_ms": ms(percentile(samples, 50)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(max(samples) if samples else None),
+    }
+
+
+def rss_mb() -> Tuple[float, float]:
+    """(current, peak) resident memory of this process in MiB"""
+    current = 0.0
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    return round(current, 1), round(peak, 1)
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _simulator_process(connection, options: Dict[str, Any]):
+    """Child process: run a simulator and carry out the parent's commands"""
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_simulator_main(connection, options))
+
+
+async def _simulator_main(connection, options: Dict[str, Any]):
+    simulator = SmartHQSimulator(port=0, **options)
+    await simulator.start()
+    connection.send(simulator.port)
+
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    loop.add_reader(connection.fileno(), readable.set)
+    while True:
+        await readable.wait()
+        readable.clear()
+        while connection.poll():
+            command, args = connection.recv()
+            if command == "stop":
+                await simulator.stop()
+                connection.send(None)
+                return
+            if command == "set_rate":
+                simulator.rate = args[0]
+                result = None
+            elif command == "update":
+                service = await simulator.update(*args)
+                result = service.service_id
+            else:
+                result = await getattr(simulator, command)(*args)
+            connection.send(result)
+
+
+def _rest_load_process(connection, base_url: str, paths: Dict[str, str], concurrency: int, duration: float):
+    """Child process: GET the routes from concurrent workers and send back the latencies"""
+    try:
+        connection.send(asyncio.run(_rest_load(base_url, paths, concurrency, duration)))
+    except Exception as e:
+        connection.send(e)
+
+
+async def _rest_load(base_url: str, paths: Dict[str, str], concurrency: int, duration: float) -> Tuple[Dict[str, List[float]], float]:
+    """(latencies per route, elapsed seconds) of GETs cycling through paths (route -> path)"""
+    routes = list(paths)
+    latencies: Dict[str, List[float]] = {route: [] for route in routes}
+    started = time.perf_counter()
+    deadline = time.monotonic() + duration
+
+    async with aiohttp.ClientSession() as session:
+        async def worker(offset: int):
+            index = offset
+            while time.monotonic() < deadline:
+                route = routes[index % len(routes)]
+                index += 1
+                request_started = time.perf_counter()
+                async with session.get(base_url + paths[route]) as response:
+                    await response.read()
+                    if response.status != 200:
+                        raise RuntimeError(f"GET {paths[route]} returned {response.status}")
+                latencies[route].append(time.perf_counter() - request_started)
+
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+class SimulatorProcess:
+    """A SmartHQSimulator in a child process, so it does not compete with the add-on for the GIL"""
+
+    def __init__(self, **options):
+        self.options = options
+        self._connection = None
+        self._process = None
+        self.port = 0
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self._connection, child = context.Pipe()
+        self._process = context.Process(target=_simulator_process, args=(child, self.options), daemon=True)
+        self._process.start()
+        self.port = self._connection.recv()
+
+    async def call(self, command: str, *args) -> Any:
+        """Run a simulator command and wait for it to finish"""
+        self._connection.send((command, args))
+        return await asyncio.get_running_loop().run_in_executor(None, self._connection.recv)
+
+    def stop(self):
+        if self._process is None:
+            return
+        try:
+            self._connection.send(("stop", ()))
+            self._connection.recv()
+        except (OSError, EOFError):
+            pass
+        self._process.join(timeout=5)
+        self._process = None
+
+
+class Benchmark:
+    """Drives the add-on against the simulator and collects the results"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.addon = None
+        self.client = None
+        self.base_url = ""
+        self.results: Dict[str, Any] = {}
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        simulator = SimulatorProcess(devices=args.devices, rate=0, seed=args.seed)
+        simulator.start()
+        server = None
+        try:
+            server = await self._start_addon(simulator.port)
+            await self._initial_sync()
+            await self._ingest(simulator)
+            await self._steady(simulator)
+            async with aiohttp.ClientSession() as session:
+                await self._visibility(simulator, session)
+            current, peak = rss_mb()
+            self.results["rss_mb"] = current
+            self.results["peak_rss_mb"] = peak
+        finally:
+            if server:
+                server.should_exit = True
+                await self._server_task
+            if self.addon:
+                await self.addon.stop_client()
+            simulator.stop()
+        return {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "parameters": {
+                "devices": args.devices,
+                "burst": args.burst,
+                "rate": args.rate,
+                "duration": args.duration,
+                "concurrency": args.concurrency,
+                "probes": args.probes,
+                "seed": args.seed,
+            },
+            "results": self.results,
+        }
+
+    async def _start_addon(self, simulator_port: int):
+        """Start the add-on's clients and REST server, configured for the simulator"""
+        # Imported here so the simulator process does not load the add-on
+        import uvicorn
+
+        port = _free_port()
+        os.environ.update({
+            "USERNAME": "benchmark",
+            "PASSWORD": "benchmark",
+            "WEBSOCKET_URL": f"ws://127.0.0.1:{simulator_port}",
+            "SNAPSHOT_PATH": "",
+            "PORT": str(port),
+        })
+        import main
+        logging.getLogger().setLevel(logging.WARNING)
+
+        self.addon = main.SmartHQAddon()
+        self._sync_started = time.perf_counter()
+        if not await self.addon.start_client():
+            raise RuntimeError("The add-on could not connect to the simulator")
+        self.client = next(iter(self.addon.clients.values()))
+
+        server = uvicorn.Server(uvicorn.Config(
+            self.addon.app, host="127.0.0.1", port=port, log_level="warning", access_log=False,
+        ))
+        self._server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        self.base_url = f"http://127.0.0.1:{port}"
+        return server
+
+    def _frames_received(self) -> int:
+        return sum(self.client.messages_received.values())
+
+    async def _wait_for_frames(self, target: int, timeout: float = 120.0):
+        """Wait until the client has received target frames in total and handled them"""
+        deadline = time.monotonic() + timeout
+        while self._frames_received() < target:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Timed out waiting for frames ({self._frames_received()}/{target})")
+            await asyncio.sleep(0.001)
+        # Received frames may still be queued for the ingest workers
+        await asyncio.wait_for(self.client.drain_ingest(), max(deadline - time.monotonic(), 0))
+        await self.client.dispatcher.drain()
+
+    async def _initial_sync(self):
+        """Time until the whole simulated fleet is in the registry"""
+        expected = self.args.devices * 3
+        deadline = time.monotonic() + 120
+        while len(self.client.services) < expected:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Timed out waiting for the initial sync")
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - self._sync_started
+        frames = self._frames_received()
+        self.results["initial_sync_seconds"] = round(elapsed, 3)
+        self.results["initial_sync_frames_per_sec"] = round(frames / elapsed, 1)
+
+    async def _ingest(self, simulator: SimulatorProcess):
+        """Burst throughput: frames pushed back to back until all are handled"""
+        target = self._frames_received() + self.args.burst
+        dropped = self.client.ingest_stats()["dropped"]
+        started = time.perf_counter()
+        await simulator.call("burst", self.args.burst)
+        await self._wait_for_frames(target)
+        elapsed = time.perf_counter() - started
+        self.results["ingest_msgs_per_sec"] = round(self.args.burst / elapsed, 1)
+        # Frames shed by a DROP_OLDEST policy count as handled above
+        self.results["ingest_dropped_count"] = self.client.ingest_stats()["dropped"] - dropped
+
+    async def _steady(self, simulator: SimulatorProcess):
+        """REST latency per route while the simulator pushes updates at a steady rate"""
+        device_id = next(iter(self.addon.registry.devices))
+        service_id = next(iter(self.addon.registry.services))
+        paths = {route: route.format(device=device_id, service=service_id) for route in REST_ROUTES}
+
+        # The load generator gets its own process and event loop, so latencies are the server's
+        context = multiprocessing.get_context("spawn")
+        connection, child = context.Pipe()
+        load = context.Process(
+            target=_rest_load_process,
+            args=(child, self.base_url, paths, self.args.concurrency, self.args.duration),
+            daemon=True,
+        )
+
+        await simulator.call("set_rate", self.args.rate)
+        received = self._frames_received()
+        started = time.perf_counter()
+        load.start()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, connection.recv)
+        finally:
+            load.join(timeout=5)
+        elapsed = time.perf_counter() - started
+        await simulator.call("set_rate", 0)
+        if isinstance(result, Exception):
+            raise RuntimeError(f"REST load generator failed: {result!r}")
+        latencies, load_elapsed = result
+
+        self.results["steady_msgs_per_sec"] = round((self._frames_received() - received) / elapsed, 1)
+        self.results["rest"] = {route: summarize_ms(samples) for route, samples in latencies.items()}
+        self.results["rest_p99_ms"] = summarize_ms([sample for samples in latencies.values() for sample in samples])["p99_ms"]
+        self.results["rest_requests_per_sec"] = round(sum(len(samples) for samples in latencies.values()) / load_elapsed, 1)
+        self.results["rest_server"] = {route: self._server_latency(route) for route in REST_ROUTES}
+
+    def _server_latency(self, route: str) -> Dict[str, Any]:
+        """Mean and p99 of a route as timed by the add-on's request metrics, in milliseconds"""
+        template = route.format(device="{device_id}", service="{service_id}")
+        histogram = self.addon._request_latency.get(("GET", template))
+        if histogram is None or not histogram.count:
+            return {"count": 0, "mean_ms": None, "p99_ms": None}
+        return {
+            "count": histogram.count,
+            "mean_ms": round(histogram.sum / histogram.count * 1000, 3),
+            "p99_ms": round(histogram.percentile(99) * 1000, 3),
+        }
+
+    async def _visibility(self, simulator: SimulatorProcess, session: aiohttp.ClientSession):
+        """Time from a cloud update until GET /services/{id} returns the new value"""
+        temperature_ids = [
+            service_id for service_id, service in self.addon.registry.services.items()
+            if service.service_type.value.endswith(".temperature")
+        ]
+        samples = []
+        for probe in range(self.args.probes):
+            service_id = temperature_ids[probe % len(temperature_ids)]
+            value = 10000.0 + probe
+            started = time.perf_counter()
+            update = asyncio.ensure_future(simulator.call("update", service_id, value))
+            while True:
+                async with session.get(f"{self.base_url}/services/{service_id}") as response:
+                    body = await response.json()
+                if body.get("state", {}).get("celsius") == value:
+                    break
+            samples.append(time.perf_counter() - started)
+            await update
+        self.results["visibility"] = summarize_ms(samples)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Print the change of every numeric result; return the names of regressions beyond threshold (percent)"""
+    def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+        flat = {}
+        for key, value in results.items():
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                flat.update(flatten(value, name + "."))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and not name.endswith("count"):
+                flat[name] = value
+        return flat
+
+    before = flatten(baseline.get("results", {}))
+    after = flatten(current.get("results", {}))
+    if baseline.get("parameters") != current.get("parameters"):
+        print("warning: parameters differ from the baseline; results are not comparable")
+
+    regressions = []
+    print(f"{'metric':<44}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if name.endswith(HIGHER_IS_BETTER_SUFFIX) else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<44}{old:>12}{new:>12}{change:>+9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SmartHQ add-on against a local simulator")
+    parser.add_argument("--devices", type=int, default=2000, help="simulated appliances (3 services each)")
+    parser.add_argument("--burst", type=int, default=20000, help="updates in the ingest burst")
+    parser.add_argument("--rate", type=float, default=500.0, help="updates per second during the steady phase")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of the steady phase")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent REST clients during the steady phase")
+    parser.add_argument("--probes", type=int, default=200, help="visibility latency probes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change reported as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    report = asyncio.run(Benchmark(args).run())
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
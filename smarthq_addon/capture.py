@@ -0,0 +1,193 @@
+"""
+Capture and replay of SmartHQ WebSocket traffic
+
+FrameRecorder appends every raw inbound frame, with its monotonic receive
+time, to a compact binary file. replay() feeds such a capture back through
+a client's decoder and message handlers at the recorded pace, N times
+faster, or as fast as possible, so event storms from a real fleet can be
+reproduced and profiled offline:
+
+    python capture.py info storm.cap
+    python capture.py replay storm.cap --speed 0 --profile
+"""
+
+import argparse
+import asyncio
+import os
+import struct
+import time
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple, Union
+
+# File header, then one record per frame: receive time, text flag, payload length, payload
+MAGIC = b"SHQCAP1\n"
+RECORD = struct.Struct("<dBI")
+
+# Longest pause replayed between two frames, e.g. across add-on restarts appended to one file
+DEFAULT_MAX_GAP = 5.0
+
+Frame = Union[str, bytes]
+
+
+class FrameRecorder:
+    """Append-only recorder of raw inbound frames"""
+
+    def __init__(self, path: str, buffer_size: int = 64 * 1024):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.frames = 0
+        self.bytes = 0
+        self._file: Optional[BinaryIO] = None
+
+    def record(self, frame: Frame, timestamp: Optional[float] = None):
+        """Append one frame, opening the file on first use"""
+        if self._file is None:
+            self._open()
+        is_text = isinstance(frame, str)
+        payload = frame.encode() if is_text else frame
+        self._file.write(RECORD.pack(time.monotonic() if timestamp is None else timestamp, is_text, len(payload)))
+        self._file.write(payload)
+        self.frames += 1
+        self.bytes += RECORD.size + len(payload)
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=self.buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, Frame]]:
+    """Yield (monotonic receive time, frame) from a capture; a truncated last record is skipped"""
+    with open(path, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a SmartHQ frame capture")
+        while True:
+            header = capture.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, is_text, length = RECORD.unpack(header)
+            payload = capture.read(length)
+            if len(payload) < length:
+                return
+            yield timestamp, payload.decode() if is_text else payload
+
+
+async def replay(client: Any, path: str, speed: float = 1.0, max_gap: float = DEFAULT_MAX_GAP) -> Dict[str, Any]:
+    """
+    Feed a capture through a client's decoder and _handle_message
+
+    speed 1 replays at the recorded pace, N at N times that, and 0 as fast
+    as possible. Returns frame counts and the achieved throughput.
+    """
+    # Imported lazily: the client module imports this one for recording
+    from smarthq_client import DECODE_ERRORS
+
+    frames = 0
+    decode_errors = 0
+    handler_errors = 0
+    previous: Optional[float] = None
+    schedule = 0.0  # capture time elapsed so far, gaps capped, in replay seconds
+    started = time.perf_counter()
+    for timestamp, frame in read_capture(path):
+        if speed > 0:
+            if previous is not None:
+                schedule += min(max(timestamp - previous, 0.0), max_gap) / speed
+            delay = schedule - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        previous = timestamp
+
+        frames += 1
+        try:
+            data = client.decoder(frame)
+        except DECODE_ERRORS:
+            decode_errors += 1
+            continue
+        try:
+            await client._handle_message(data)
+        except Exception:
+            handler_errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "frames": frames,
+        "decode_errors": decode_errors,
+        "handler_errors": handler_errors,
+        "seconds": round(elapsed, 3),
+        "frames_per_sec": round(frames / elapsed, 1) if elapsed else None,
+    }
+
+
+def capture_info(path: str) -> Dict[str, Any]:
+    """Frame count, size and recorded duration of a capture"""
+    frames = 0
+    payload_bytes = 0
+    first = last = None
+    for timestamp, frame in read_capture(path):
+        frames += 1
+        payload_bytes += len(frame)
+        first = timestamp if first is None else first
+        last = timestamp
+    duration = (last - first) if frames else 0.0
+    return {
+        "frames": frames,
+        "payload_bytes": payload_bytes,
+        "file_bytes": os.path.getsize(path),
+        "duration_seconds": round(duration, 3),
+        "frames_per_sec": round(frames / duration, 1) if duration > 0 else None,
+    }
+
+
+async def _replay_command(args: argparse.Namespace) -> Dict[str, Any]:
+    from smarthq_client import SmartHQClient
+
+    client = SmartHQClient("replay", "replay")
+    result = await replay(client, args.path, args.speed, args.max_gap)
+    await client.dispatcher.aclose()
+    result["devices"] = len(client.devices)
+    result["services"] = len(client.services)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a SmartHQ frame capture")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="summarize a capture")
+    info.add_argument("path")
+    replay_parser = commands.add_parser("replay", help="feed a capture through a fresh client")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="1 for the recorded pace, N for N times faster, 0 for max")
+    replay_parser.add_argument("--max-gap", type=float, default=DEFAULT_MAX_GAP, help="longest pause replayed, in recorded seconds")
+    replay_parser.add_argument("--profile", action="store_true", help="print a cProfile report of the replay")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(capture_info(args.path))
+        return
+
+    if args.profile:
+        import cProfile
+        import pstats
+
+        import smarthq_client  # loaded up front so the import stays out of the profile
+
+        profiler = cProfile.Profile()
+        result = profiler.runcall(asyncio.run, _replay_command(args))
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+    else:
+        result = asyncio.run(_replay_command(args))
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Home Assistant Integration for SmartHQ
+
+Provides sensor and switch entities for SmartHQ appliances through the
+add-on's REST API.
+"""
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.config_entries import SOURCE_IMPORT, ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.typing import ConfigType
+
+from .const import CONF_ADDON_URL, DOMAIN
+from .coordinator import SmartHQCoordinator
+from .manager import PLATFORMS, SmartHQEntityManager
+
+# configuration.yaml is imported into a config entry
+CONFIG_SCHEMA = vol.Schema(
+    {
+        DOMAIN: vol.Schema(
+            {
+                vol.Required(CONF_ADDON_URL): cv.url,
+                # Credentials belong to the add-on; accepted for older configurations
+                vol.Optional("username"): cv.string,
+                vol.Optional("password"): cv.string,
+            }
+        )
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Import the YAML configuration, if any."""
+    if DOMAIN in config:
+        hass.async_create_task(
+            hass.config_entries.flow.async_init(
+                DOMAIN,
+                context={"source": SOURCE_IMPORT},
+                data={CONF_ADDON_URL: config[DOMAIN][CONF_ADDON_URL]},
+            )
+        )
+    return True
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Set up SmartHQ from a config entry."""
+    coordinator = SmartHQCoordinator(hass, entry.data[CONF_ADDON_URL])
+    
+    # Fetch initial data
+    await coordinator.async_config_entry_first_refresh()
+
+    # Switch to push updates from the add-on
+    coordinator.async_start_stream()
+    
+    # Entities follow the devices and services in coordinator data from here on
+    manager = SmartHQEntityManager(hass, coordinator, entry)
+    manager.async_setup()
+    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = manager
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    
+    return True
+
+
+async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Unload a config entry."""
+    if not await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        return False
+    
+    manager = hass.data[DOMAIN].pop(entry.entry_id)
+    manager.async_unload()
+    # The shared session belongs to HA and stays open
+    await manager.coordinator.async_stop_stream()
+    
+    return True
@@ -0,0 +1,32 @@
+"""Config flow for the SmartHQ integration."""
+
+from typing import Any, Dict, Optional
+
+import voluptuous as vol
+from homeassistant import config_entries
+from homeassistant.data_entry_flow import FlowResult
+
+from .const import CONF_ADDON_URL, DEFAULT_ADDON_URL, DEFAULT_NAME, DOMAIN
+
+
+class SmartHQConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
+    """Set up a connection to a SmartHQ add-on."""
+
+    VERSION = 1
+
+    async def async_step_user(self, user_input: Optional[Dict[str, Any]] = None) -> FlowResult:
+        """Ask for the add-on's URL."""
+        if user_input is not None:
+            addon_url = user_input[CONF_ADDON_URL].rstrip("/")
+            await self.async_set_unique_id(addon_url)
+            self._abort_if_unique_id_configured()
+            return self.async_create_entry(title=DEFAULT_NAME, data={CONF_ADDON_URL: addon_url})
+
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema({vol.Required(CONF_ADDON_URL, default=DEFAULT_ADDON_URL): str}),
+        )
+
+    async def async_step_import(self, import_config: Dict[str, Any]) -> FlowResult:
+        """Create an entry from configuration.yaml."""
+        return await self.async_step_user(import_config)
@@ -0,0 +1,28 @@
+"""Constants for the SmartHQ integration."""
+
+DOMAIN = "smarthq_addon"
+DEFAULT_NAME = "SmartHQ"
+DEFAULT_ADDON_URL = "http://localhost:8080"
+CONF_ADDON_URL = "addon_url"
+DEFAULT_TIMEOUT = 10
+DEFAULT_SCAN_INTERVAL = 30
+# Extra time a waited command batch may take: the add-on's default ack timeout
+COMMAND_WAIT_TIMEOUT = 10
+REQUEST_RETRIES = 2
+REQUEST_RETRY_DELAY = 0.5
+STREAM_HEARTBEAT = 30
+STREAM_RETRY_MIN = 5
+STREAM_RETRY_MAX = 300
+
+# SmartHQ meter units and their display symbols
+METER_UNITS = {
+    "cloud.smarthq.type.meterunits.kwh": "kWh",
+    "cloud.smarthq.type.meterunits.kw": "kW",
+    "cloud.smarthq.type.meterunits.amps": "A",
+    "cloud.smarthq.type.meterunits.volts": "V",
+    "cloud.smarthq.type.meterunits.gallons": "gal",
+    "cloud.smarthq.type.meterunits.liters": "L",
+}
+
+# Service payload fields that entities render; changes elsewhere don't write state
+FINGERPRINT_FIELDS = ("state", "config", "supported_commands", "unit", "stale")
@@ -0,0 +1,347 @@
+"""Data update coordinator for the SmartHQ add-on's REST API."""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+
+import aiohttp
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+from .const import (
+    COMMAND_WAIT_TIMEOUT,
+    DEFAULT_SCAN_INTERVAL,
+    DEFAULT_TIMEOUT,
+    DOMAIN,
+    FINGERPRINT_FIELDS,
+    REQUEST_RETRIES,
+    REQUEST_RETRY_DELAY,
+    STREAM_HEARTBEAT,
+    STREAM_RETRY_MAX,
+    STREAM_RETRY_MIN,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def service_fingerprint(service: Dict[str, Any]) -> int:
+    """Hash the fields of a service payload that entities render."""
+    return hash(json.dumps([service.get(field) for field in FINGERPRINT_FIELDS], sort_keys=True, default=str))
+
+
+class SmartHQCoordinator(DataUpdateCoordinator):
+    """Coordinator for SmartHQ add-on data."""
+
+    def __init__(self, hass: HomeAssistant, addon_url: str):
+        """Initialize the coordinator."""
+        super().__init__(
+            hass,
+            logger,
+            name=DOMAIN,
+            update_interval=timedelta(seconds=DEFAULT_SCAN_INTERVAL),
+        )
+        self.addon_url = addon_url.rstrip("/")
+        # HA's shared session: one keep-alive connection pool for every config entry
+        self.session = async_get_clientsession(hass)
+        self._timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+        self._wait_timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT + COMMAND_WAIT_TIMEOUT)
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._services: Dict[str, Dict[str, Any]] = {}
+        self._stream_task: Optional[asyncio.Task] = None
+        self._etag_cache: Dict[str, Tuple[str, Any]] = {}
+        self._cursor: Optional[Tuple[str, int]] = None
+        self._changes_supported = True
+        # Hash of the rendered fields per service_id, refreshed for dirty ids on each update
+        self.fingerprints: Dict[str, int] = {}
+        self._dirty: set = set()
+
+    async def _async_update_data(self) -> Dict[str, Any]:
+        """Update data from SmartHQ add-on."""
+        try:
+            # Prefer an incremental delta since the last version we saw
+            changes = await self._async_get_changes()
+            if changes is not None:
+                self._apply_changes(changes)
+                return self._build_data()
+
+            # Get devices and services concurrently
+            devices, services = await asyncio.gather(
+                self._async_get_cached("/devices"), self._async_get_cached("/services")
+            )
+            if devices is None:
+                return {}
+            if services is None:
+                services = []
+
+            self._load_snapshot(devices, services)
+            return self._build_data()
+        except Exception as e:
+            logger.error(f"Error updating SmartHQ data: {e}")
+            return {}
+
+    async def _async_get_changes(self) -> Optional[Dict[str, Any]]:
+        """Query /changes since the last seen version, or None if unsupported."""
+        if not self._changes_supported:
+            return None
+
+        params = {}
+        if self._cursor:
+            params = {"epoch": self._cursor[0], "since": self._cursor[1]}
+
+        status, _, body = await self._async_get("/changes", params=params)
+        if status == 200:
+            return body
+        if status == 404:
+            # Older add-on without delta support
+            self._changes_supported = False
+        else:
+            logger.error(f"Failed to get changes: {status}")
+        return None
+
+    def _apply_changes(self, changes: Dict[str, Any]):
+        """Apply a /changes response to the local registry."""
+        if changes["full"]:
+            self._load_snapshot(changes["devices"], changes["services"])
+        else:
+            for device in changes["devices"]:
+                self._devices[device["device_id"]] = device
+            for service in changes["services"]:
+                self._services[service["service_id"]] = service
+                self._dirty.add(service["service_id"])
+            for device_id in changes["removed_devices"]:
+                self._devices.pop(device_id, None)
+            for service_id in changes["removed_services"]:
+                self._services.pop(service_id, None)
+                self._dirty.add(service_id)
+
+        self._cursor = (changes["epoch"], changes["version"])
+
+    async def _async_get_cached(self, path: str) -> Optional[Any]:
+        """GET a collection, reusing the last body when the add-on answers 304."""
+        headers = {}
+        cached = self._etag_cache.get(path)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        status, response_headers, body = await self._async_get(path, headers=headers)
+        if status == 304 and cached:
+            return cached[1]
+        if status == 200:
+            etag = response_headers.get("ETag")
+            if etag:
+                self._etag_cache[path] = (etag, body)
+            return body
+
+        logger.error(f"Failed to get {path.lstrip('/')}: {status}")
+        return None
+
+    async def _async_get(
+        self, path: str, headers: Optional[Dict[str, str]] = None, params: Optional[Dict[str, Any]] = None
+    ) -> Tuple[int, Any, Optional[Any]]:
+        """GET from the add-on, retrying connection errors, timeouts and 5xx responses.
+
+        Returns the status, the response headers and the JSON body of a 200.
+        """
+        delay = REQUEST_RETRY_DELAY
+        for attempt in range(REQUEST_RETRIES + 1):
+            last_attempt = attempt == REQUEST_RETRIES
+            try:
+                async with self.session.get(
+                    f"{self.addon_url}{path}", headers=headers, params=params, timeout=self._timeout
+                ) as response:
+                    if response.status < 500 or last_attempt:
+                        body = await response.json() if response.status == 200 else None
+                        return response.status, response.headers, body
+                    logger.warning(f"GET {path} returned {response.status}, retrying in {delay} seconds")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise
+                logger.warning(f"GET {path} failed ({e!r}), retrying in {delay} seconds")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    def _load_snapshot(self, devices: List[Dict[str, Any]], services: List[Dict[str, Any]]):
+        """Replace the local registry with a full snapshot."""
+        # Shallow copies keep streamed mutations out of the ETag cache
+        self._devices = {device["device_id"]: dict(device) for device in devices}
+        self._services = {service["service_id"]: dict(service) for service in services}
+        self._dirty.update(self.fingerprints)
+        self._dirty.update(self._services)
+
+    def _build_data(self) -> Dict[str, Any]:
+        """Build coordinator data from the local registry."""
+        self._refresh_fingerprints()
+        return {
+            "devices": list(self._devices.values()),
+            "services": list(self._services.values()),
+            "last_update": datetime.now(),
+        }
+
+    def _refresh_fingerprints(self):
+        """Recompute the fingerprints of the services touched since the last update."""
+        for service_id in self._dirty:
+            service = self._services.get(service_id)
+            if service is None:
+                self.fingerprints.pop(service_id, None)
+            else:
+                self.fingerprints[service_id] = service_fingerprint(service)
+        self._dirty.clear()
+
+    def entity_fingerprint(self, device_id: str, service_id: Optional[str]) -> Tuple[Any, Optional[int]]:
+        """Fingerprint of what an entity renders: its device's availability and its service."""
+        device = self._devices.get(device_id)
+        return (device.get("online") if device else None, self.fingerprints.get(service_id))
+
+    def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Latest payload of a device."""
+        return self._devices.get(device_id)
+
+    def get_service(self, service_id: str) -> Optional[Dict[str, Any]]:
+        """Latest payload of a service."""
+        return self._services.get(service_id)
+
+    def async_start_stream(self):
+        """Start consuming the add-on's /ws update stream."""
+        if self._stream_task is None or self._stream_task.done():
+            # A background task: it runs for the life of the entry, so HA must not wait on it
+            self._stream_task = self.hass.async_create_background_task(
+                self._stream_loop(), f"{DOMAIN} update stream"
+            )
+
+    async def async_stop_stream(self):
+        """Stop consuming the update stream."""
+        if self._stream_task:
+            self._stream_task.cancel()
+            try:
+                await self._stream_task
+            except asyncio.CancelledError:
+                pass
+            self._stream_task = None
+
+    async def _stream_loop(self):
+        """Apply streamed deltas, falling back to polling while disconnected."""
+        delay = STREAM_RETRY_MIN
+
+        while True:
+            try:
+                async with self.session.ws_connect(
+                    f"{self.addon_url}/ws", heartbeat=STREAM_HEARTBEAT
+                ) as ws:
+                    logger.info("Connected to SmartHQ add-on update stream")
+                    # Deltas are pushed as they happen, so stop the periodic poll
+                    self.update_interval = None
+                    delay = STREAM_RETRY_MIN
+
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            self._apply_stream_message(message.json())
+                        elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"SmartHQ update stream failed: {e}")
+
+            # Poll until the stream is back
+            self.update_interval = timedelta(seconds=DEFAULT_SCAN_INTERVAL)
+            logger.info(f"Reconnecting to update stream in {delay} seconds...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_RETRY_MAX)
+
+    def _apply_stream_message(self, message: Dict[str, Any]):
+        """Apply one streamed delta to the local registry."""
+        event = message.get("event")
+
+        if event == "snapshot":
+            self._load_snapshot(message.get("devices", []), message.get("services", []))
+        elif event in ("device_added", "device_updated"):
+            device = message["device"]
+            self._devices[device["device_id"]] = device
+        elif event == "device_removed":
+            device_id = message["device_id"]
+            self._devices.pop(device_id, None)
+            removed = [
+                service_id
+                for service_id, service in self._services.items()
+                if service["device_id"] == device_id
+            ]
+            for service_id in removed:
+                del self._services[service_id]
+            self._dirty.update(removed)
+        elif event == "service_updated":
+            service = message["service"]
+            self._services[service["service_id"]] = service
+            self._dirty.add(service["service_id"])
+        elif event == "service_removed":
+            self._services.pop(message["service_id"], None)
+            self._dirty.add(message["service_id"])
+        elif event == "presence_changed":
+            device = self._devices.get(message["device_id"])
+            if device is None:
+                return
+            device["online"] = message.get("online", False)
+            device["last_seen"] = message.get("last_seen")
+        else:
+            # Alerts and unknown events carry no registry state
+            return
+
+        self.async_set_updated_data(self._build_data())
+
+    async def send_command(self, device_id: str, command: str, data: List[Any] = None) -> bool:
+        """Send a command to a device."""
+        try:
+            payload = {
+                "command": command,
+                "data": data or []
+            }
+            async with self.session.post(
+                f"{self.addon_url}/devices/{device_id}/command",
+                json=payload,
+                timeout=self._timeout
+            ) as response:
+                if response.status == 200:
+                    logger.info(f"Command {command} sent to device {device_id}")
+                    return True
+                else:
+                    logger.error(f"Failed to send command: {response.status}")
+                    return False
+        except Exception as e:
+            logger.error(f"Error sending command: {e}")
+            return False
+
+    async def send_commands(self, commands: List[Dict[str, Any]], wait: bool = False) -> List[Dict[str, Any]]:
+        """Send several commands in one request.
+
+        Each command is a dict with device_id, command and optional data.
+        Returns the per-command results, or an empty list on failure.
+        """
+        try:
+            payload = {
+                "commands": [
+                    {
+                        "device_id": command["device_id"],
+                        "command": command["command"],
+                        "data": command.get("data") or []
+                    }
+                    for command in commands
+                ]
+            }
+            async with self.session.post(
+                f"{self.addon_url}/commands/batch",
+                params={"wait": "true"} if wait else None,
+                json=payload,
+                timeout=self._wait_timeout if wait else self._timeout
+            ) as response:
+                if response.status == 200:
+                    results = (await response.json())["results"]
+                    logger.info(f"Sent {len(results)} commands")
+                    return results
+                else:
+                    logger.error(f"Failed to send commands: {response.status}")
+                    return []
+        except Exception as e:
+            logger.error(f"Error sending commands: {e}")
+            return []
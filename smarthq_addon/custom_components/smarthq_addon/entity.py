@@ -0,0 +1,66 @@
+"""Base entity for SmartHQ appliances."""
+
+from typing import Any, Dict, Optional
+
+from homeassistant.core import callback
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .const import DOMAIN
+from .coordinator import SmartHQCoordinator
+
+
+class SmartHQDeviceEntity(CoordinatorEntity, Entity):
+    """Base class for SmartHQ device entities."""
+
+    def __init__(self, coordinator: SmartHQCoordinator, device: Dict[str, Any]):
+        """Initialize the entity."""
+        super().__init__(coordinator)
+        self.device = device
+        self.device_id = device["device_id"]
+        self.service: Dict[str, Any] = {}
+        self.service_id: Optional[str] = None
+        self._state: Dict[str, Any] = {}
+        self._config: Dict[str, Any] = {}
+        self._fingerprint = coordinator.entity_fingerprint(self.device_id, None)
+        self._attr_name = device.get("name", device["device_id"])
+        self._attr_unique_id = f"smarthq_{self.device_id}"
+
+    def _set_service(self, service: Dict[str, Any]):
+        """Track a service, caching its state and config for the properties."""
+        self.service = service
+        self.service_id = service["service_id"]
+        self._state = service.get("state") or {}
+        self._config = service.get("config") or {}
+        self._fingerprint = self.coordinator.entity_fingerprint(self.device_id, self.service_id)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write state only when the device or service this entity renders changed."""
+        fingerprint = self.coordinator.entity_fingerprint(self.device_id, self.service_id)
+        if fingerprint == self._fingerprint:
+            return
+        self.device = self.coordinator.get_device(self.device_id) or self.device
+        if self.service_id:
+            service = self.coordinator.get_service(self.service_id)
+            if service is None:
+                # The entity manager retires entities whose service is gone
+                return
+            self._set_service(service)
+        self._fingerprint = fingerprint
+        self.async_write_ha_state()
+
+    @property
+    def available(self) -> bool:
+        """Return True if entity is available."""
+        return self.device.get("online", False)
+
+    @property
+    def device_info(self) -> Dict[str, Any]:
+        """Return device info."""
+        return {
+            "identifiers": {(DOMAIN, self.device_id)},
+            "name": self.device.get("name", self.device_id),
+            "manufacturer": "SmartHQ",
+            "model": self.device.get("device_type", "Unknown"),
+        }
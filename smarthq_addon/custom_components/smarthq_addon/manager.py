@@ -0,0 +1,128 @@
+"""Keeps the SmartHQ entities in step with the devices and services of the add-on."""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .coordinator import SmartHQCoordinator
+from .sensor import SmartHQMeterSensor, SmartHQModeSelect, SmartHQTemperatureSensor
+from .switch import SmartHQToggleSwitch
+
+logger = logging.getLogger(__name__)
+
+
+# Service type -> (platform, entity class)
+ENTITY_TYPES: Dict[str, Tuple[str, type]] = {
+    "cloud.smarthq.service.temperature": ("sensor", SmartHQTemperatureSensor),
+    "cloud.smarthq.service.toggle": ("switch", SmartHQToggleSwitch),
+    "cloud.smarthq.service.mode": ("sensor", SmartHQModeSelect),
+    "cloud.smarthq.service.meter": ("sensor", SmartHQMeterSensor),
+}
+
+PLATFORMS = sorted({platform for platform, _ in ENTITY_TYPES.values()})
+
+
+def create_service_entity(
+    coordinator: SmartHQCoordinator, device: Dict[str, Any], service: Dict[str, Any]
+) -> Optional[Tuple[str, Entity]]:
+    """Create the entity for a service, with its platform, or None if the type is unsupported."""
+    route = ENTITY_TYPES.get(service.get("service_type", ""))
+    if route is None:
+        return None
+    platform, entity_class = route
+    return platform, entity_class(coordinator, device, service)
+
+
+class SmartHQEntityManager:
+    """Keeps the entities of a config entry in step with the coordinator's services."""
+
+    def __init__(self, hass: HomeAssistant, coordinator: SmartHQCoordinator, entry: ConfigEntry):
+        """Initialize the entity manager."""
+        self.hass = hass
+        self.coordinator = coordinator
+        self.entry = entry
+        self.entities: Dict[str, Entity] = {}
+        self._add_entities: Dict[str, AddEntitiesCallback] = {}
+        # Entities created before their platform finished loading
+        self._pending: Dict[str, List[Entity]] = {platform: [] for platform in PLATFORMS}
+        self._unsubscribe = None
+
+    @callback
+    def async_setup(self):
+        """Create the current entities and follow coordinator updates.
+
+        The entities are handed to HA as each platform is set up.
+        """
+        self._sync()
+        self._unsubscribe = self.coordinator.async_add_listener(self._sync)
+
+    @callback
+    def async_unload(self):
+        """Stop syncing; unloading the platforms removes the entities."""
+        if self._unsubscribe:
+            self._unsubscribe()
+            self._unsubscribe = None
+        self.entities.clear()
+        self._add_entities.clear()
+
+    @callback
+    def async_add_platform(self, platform: str, async_add_entities: AddEntitiesCallback):
+        """Register a loaded platform and add the entities waiting for it."""
+        self._add_entities[platform] = async_add_entities
+        self._flush(platform)
+
+    @callback
+    def _sync(self):
+        """Create entities for new services and retire those whose service is gone."""
+        data = self.coordinator.data
+        if not data or "services" not in data:
+            # Failed refresh: keep the entities until the add-on answers again
+            return
+
+        devices = {device["device_id"]: device for device in data["devices"]}
+        current = set()
+        for service in data["services"]:
+            device = devices.get(service["device_id"])
+            if device is None or service.get("service_type") not in ENTITY_TYPES:
+                continue
+            service_id = service["service_id"]
+            current.add(service_id)
+            if service_id in self.entities:
+                continue
+            platform, entity = create_service_entity(self.coordinator, device, service)
+            self.entities[service_id] = entity
+            self._pending[platform].append(entity)
+
+        for service_id in self.entities.keys() - current:
+            self._retire(self.entities.pop(service_id))
+
+        for platform in PLATFORMS:
+            self._flush(platform)
+
+    def _flush(self, platform: str):
+        """Hand the pending entities of a platform to HA once it is loaded."""
+        async_add_entities = self._add_entities.get(platform)
+        if async_add_entities and self._pending[platform]:
+            entities, self._pending[platform] = self._pending[platform], []
+            logger.info(f"Adding {len(entities)} SmartHQ {platform} entities")
+            async_add_entities(entities)
+
+    def _retire(self, entity: Entity):
+        """Remove an entity whose service disappeared, along with its registry entry."""
+        for pending in self._pending.values():
+            if entity in pending:
+                pending.remove(entity)
+                return
+        if entity.hass is None:
+            return
+        logger.info(f"Removing SmartHQ entity {entity.entity_id}")
+        if entity.registry_entry is not None:
+            # Removing the registry entry also removes the entity from HA
+            er.async_get(self.hass).async_remove(entity.entity_id)
+        else:
+            self.hass.async_create_task(entity.async_remove())
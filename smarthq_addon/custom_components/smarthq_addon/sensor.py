@@ -0,0 +1,122 @@
+"""Sensor platform for SmartHQ appliances."""
+
+from typing import Any, Dict, Optional
+
+from homeassistant.components.sensor import SensorEntity
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN, METER_UNITS
+from .coordinator import SmartHQCoordinator
+from .entity import SmartHQDeviceEntity
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
+) -> None:
+    """Hand the sensor platform to the entry's entity manager."""
+    hass.data[DOMAIN][entry.entry_id].async_add_platform("sensor", async_add_entities)
+
+
+class SmartHQTemperatureSensor(SmartHQDeviceEntity, SensorEntity):
+    """SmartHQ temperature sensor."""
+
+    def __init__(self, coordinator: SmartHQCoordinator, device: Dict[str, Any], service: Dict[str, Any]):
+        """Initialize the temperature sensor."""
+        super().__init__(coordinator, device)
+        self._set_service(service)
+        self._attr_name = f"{self._attr_name} Temperature"
+        self._attr_unique_id = f"smarthq_{self.device_id}_{self.service_id}_temp"
+        self._attr_device_class = "temperature"
+        self._attr_native_unit_of_measurement = "°C"
+
+    @property
+    def native_value(self) -> Optional[float]:
+        """Return the temperature value."""
+        state = self._state
+        # Try Celsius first, then Fahrenheit converted
+        temp = state.get("celsius") or state.get("celsiusConverted")
+        if temp is not None:
+            return float(temp)
+        return None
+
+    @property
+    def extra_state_attributes(self) -> Dict[str, Any]:
+        """Return extra state attributes."""
+        state = self._state
+        return {
+            "fahrenheit": state.get("fahrenheit"),
+            "fahrenheit_converted": state.get("fahrenheitConverted"),
+            "celsius_converted": state.get("celsiusConverted"),
+            "disabled": state.get("disabled", False),
+        }
+
+
+class SmartHQModeSelect(SmartHQDeviceEntity, SensorEntity):
+    """SmartHQ mode select sensor."""
+
+    def __init__(self, coordinator: SmartHQCoordinator, device: Dict[str, Any], service: Dict[str, Any]):
+        """Initialize the mode select sensor."""
+        super().__init__(coordinator, device)
+        self._set_service(service)
+        self._attr_name = f"{self._attr_name} Mode"
+        self._attr_unique_id = f"smarthq_{self.device_id}_{self.service_id}_mode"
+
+    @property
+    def native_value(self) -> Optional[str]:
+        """Return the current mode."""
+        state = self._state
+        mode = state.get("mode")
+        if mode:
+            # Extract the last part of the mode string for display
+            return mode.split(".")[-1].replace("_", " ").title()
+        return None
+
+    @property
+    def extra_state_attributes(self) -> Dict[str, Any]:
+        """Return extra state attributes."""
+        config = self._config
+        return {
+            "supported_modes": config.get("supportedModes", []),
+            "disabled": self._state.get("disabled", False),
+        }
+
+
+class SmartHQMeterSensor(SmartHQDeviceEntity, SensorEntity):
+    """SmartHQ meter sensor."""
+
+    def __init__(self, coordinator: SmartHQCoordinator, device: Dict[str, Any], service: Dict[str, Any]):
+        """Initialize the meter sensor."""
+        super().__init__(coordinator, device)
+        self._set_service(service)
+        self._attr_name = f"{self._attr_name} Meter"
+        self._attr_unique_id = f"smarthq_{self.device_id}_{self.service_id}_meter"
+
+    @property
+    def native_value(self) -> Optional[float]:
+        """Return the meter value."""
+        state = self._state
+        return state.get("meterValue")
+
+    @property
+    def native_unit_of_measurement(self) -> Optional[str]:
+        """Return the unit of measurement."""
+        # Normalized by the add-on; older add-ons only send the raw config
+        if self.service.get("unit"):
+            return self.service["unit"]
+        units = self._config.get("meterUnits", "")
+        return METER_UNITS.get(units, units.split(".")[-1] if units else None)
+
+    @property
+    def extra_state_attributes(self) -> Dict[str, Any]:
+        """Return extra state attributes."""
+        state = self._state
+        config = self._config
+        return {
+            "meter_value_delta": state.get("meterValueDelta"),
+            "update_frequency_seconds": state.get("updateFrequencySeconds"),
+            "disabled": state.get("disabled", False),
+            "reading_type": config.get("reading"),
+            "measurement_type": config.get("measurement"),
+        }
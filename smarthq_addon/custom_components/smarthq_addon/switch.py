@@ -0,0 +1,46 @@
+"""Switch platform for SmartHQ appliances."""
+
+from typing import Any, Dict
+
+from homeassistant.components.switch import SwitchEntity
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN
+from .coordinator import SmartHQCoordinator
+from .entity import SmartHQDeviceEntity
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
+) -> None:
+    """Hand the switch platform to the entry's entity manager."""
+    hass.data[DOMAIN][entry.entry_id].async_add_platform("switch", async_add_entities)
+
+
+class SmartHQToggleSwitch(SmartHQDeviceEntity, SwitchEntity):
+    """SmartHQ toggle switch."""
+
+    def __init__(self, coordinator: SmartHQCoordinator, device: Dict[str, Any], service: Dict[str, Any]):
+        """Initialize the toggle switch."""
+        super().__init__(coordinator, device)
+        self._set_service(service)
+        self._attr_name = f"{self._attr_name} {service.get('domain_type', 'Toggle').split('.')[-1].title()}"
+        self._attr_unique_id = f"smarthq_{self.device_id}_{self.service_id}"
+
+    @property
+    def is_on(self) -> bool:
+        """Return True if entity is on."""
+        state = self._state
+        return state.get("on", False)
+
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        """Turn the entity on."""
+        if "set" in self.service.get("supported_commands", []):
+            await self.coordinator.send_command(self.device_id, "set", [{"on": True}])
+
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        """Turn the entity off."""
+        if "set" in self.service.get("supported_commands", []):
+            await self.coordinator.send_command(self.device_id, "set", [{"on": False}])
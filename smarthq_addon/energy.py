@@ -0,0 +1,192 @@
+"""
+Energy aggregation over SmartHQ meter services
+
+Keeps the energy readings of every kWh and kW meter in NumPy ring buffers,
+one row per meter, so fleet-wide rollups (per device type, per hour, per
+appliance) are computed with vectorized operations instead of Python loops.
+"""
+
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Readings kept per meter
+DEFAULT_RING_SIZE = 4096
+
+SECONDS_PER_HOUR = 3600.0
+
+# Shortest interval the power of a cumulative (kWh) meter is averaged over
+MIN_POWER_WINDOW = 60.0
+
+
+class EnergyAggregator:
+    """Ring buffers of energy increments (kWh) per meter service"""
+
+    def __init__(self, ring_size: int = DEFAULT_RING_SIZE):
+        self.ring_size = ring_size
+        # One row per meter: reading times (NaN when unused) and kWh consumed since the previous reading
+        self.times = np.full((0, ring_size), np.nan)
+        self.energy = np.zeros((0, ring_size))
+        self._cursor = np.zeros(0, dtype=np.int64)
+
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self.row_devices: List[Optional[str]] = []
+        # Previous (timestamp, value) per row, to derive increments
+        self._previous: List[Optional[Tuple[float, float]]] = []
+        # (start, kWh since start) of the open power window per kWh row
+        self._power_window: List[Optional[Tuple[float, float]]] = []
+        # Latest power (kW) per row
+        self.power = np.full(0, np.nan)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def record(
+        self,
+        service_id: str,
+        device_id: str,
+        unit: Optional[str],
+        value: Optional[float],
+        delta: Optional[float] = None,
+        timestamp: Optional[float] = None,
+        period: Optional[float] = None,
+    ):
+        """
+        Add a meter reading; only kWh (energy) and kW (power) meters are tracked
+
+        kWh increments come from the cumulative value, so readings that were
+        dropped or coalesced on the way lose no energy; delta is only used
+        across a meter reset. The power of a kWh meter is averaged over at
+        least MIN_POWER_WINDOW seconds, or period (the meter's reporting
+        interval) if longer.
+        """
+        if value is None or unit not in ("kWh", "kW"):
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        row = self._row(service_id, device_id)
+        previous = self._previous[row]
+        self._previous[row] = (timestamp, value)
+
+        increment = 0.0
+        if previous is not None:
+            elapsed = timestamp - previous[0]
+            if unit == "kW":
+                # Power held since the previous reading
+                increment = previous[1] * max(elapsed, 0.0) / SECONDS_PER_HOUR
+                self.power[row] = value
+            else:
+                if value >= previous[1]:
+                    increment = value - previous[1]
+                elif delta is not None:
+                    increment = delta  # the cumulative value was reset
+                self._update_power(row, timestamp, increment, max(MIN_POWER_WINDOW, period or 0.0))
+        elif unit == "kW":
+            self.power[row] = value
+        else:
+            self._power_window[row] = (timestamp, 0.0)
+
+        slot = self._cursor[row]
+        self.times[row, slot] = timestamp
+        self.energy[row, slot] = increment
+        self._cursor[row] = (slot + 1) % self.ring_size
+
+    def _update_power(self, row: int, timestamp: float, increment: float, window: float):
+        """Accumulate a kWh increment, deriving the power once the window is long enough"""
+        start, energy = self._power_window[row] or (timestamp, 0.0)
+        energy += increment
+        elapsed = timestamp - start
+        if elapsed >= window:
+            self.power[row] = energy * SECONDS_PER_HOUR / elapsed
+            self._power_window[row] = (timestamp, 0.0)
+        else:
+            self._power_window[row] = (start, energy)
+
+    def discard(self, service_id: str):
+        """Stop tracking a removed meter"""
+        row = self._rows.pop(service_id, None)
+        if row is None:
+            return
+        self.times[row] = np.nan
+        self.energy[row] = 0.0
+        self.power[row] = np.nan
+        self.row_devices[row] = None
+        self._previous[row] = None
+        self._power_window[row] = None
+        self._free.append(row)
+
+    def _row(self, service_id: str, device_id: str) -> int:
+        """Row of a meter, allocating (and growing the buffers) on first sight"""
+        row = self._rows.get(service_id)
+        if row is not None:
+            return row
+
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = len(self.row_devices)
+            if row == self.times.shape[0]:
+                self._grow(max(8, row * 2))
+            self.row_devices.append(None)
+            self._previous.append(None)
+            self._power_window.append(None)
+        self._rows[service_id] = row
+        self.row_devices[row] = device_id
+        self._previous[row] = None
+        self._power_window[row] = None
+        self._cursor[row] = 0
+        return row
+
+    def _grow(self, rows: int):
+        """Resize the buffers to hold rows meters"""
+        extra = rows - self.times.shape[0]
+        self.times = np.vstack([self.times, np.full((extra, self.ring_size), np.nan)])
+        self.energy = np.vstack([self.energy, np.zeros((extra, self.ring_size))])
+        self._cursor = np.concatenate([self._cursor, np.zeros(extra, dtype=np.int64)])
+        self.power = np.concatenate([self.power, np.full(extra, np.nan)])
+
+    def _window(self, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(times, energy) of the used rows with readings outside [start, end) zeroed"""
+        used = len(self.row_devices)
+        times = self.times[:used]
+        mask = (times >= start) & (times < end)  # NaN compares False
+        return times, np.where(mask, self.energy[:used], 0.0)
+
+    def hourly_by_group(self, groups: np.ndarray, group_count: int, start: float, hours: int) -> np.ndarray:
+        """
+        kWh per (group, hour) over the hours from start
+
+        groups gives the group index of every row (-1 to exclude it).
+        """
+        end = start + hours * SECONDS_PER_HOUR
+        times, energy = self._window(start, end)
+        if not times.size:
+            return np.zeros((group_count, hours))
+        hour = np.clip(np.nan_to_num((times - start) // SECONDS_PER_HOUR), 0, hours - 1).astype(np.int64)
+        group = np.broadcast_to(groups[:, None], times.shape)
+        keep = group >= 0
+        keys = group[keep] * hours + hour[keep]
+        totals = np.bincount(keys, weights=energy[keep], minlength=group_count * hours)
+        return totals.reshape(group_count, hours)
+
+    def totals_by_row(self, start: float, end: float) -> np.ndarray:
+        """kWh per row within [start, end)"""
+        _, energy = self._window(start, end)
+        return energy.sum(axis=1)
+
+    def retained_since(self) -> float:
+        """Time from which every meter's readings are still held (-inf until a ring wraps)"""
+        used = len(self.row_devices)
+        # The slot under the cursor holds the oldest reading of a full ring, NaN otherwise
+        oldest = self.times[np.arange(used), self._cursor[:used]]
+        if np.isnan(oldest).all():
+            return -math.inf
+        return float(np.nanmax(oldest))
+
+
+def hour_range(hours: int, now: Optional[float] = None) -> float:
+    """Start of the hour-aligned range of the given number of hours ending with the current hour"""
+    now = time.time() if now is None else now
+    return math.floor(now / SECONDS_PER_HOUR) * SECONDS_PER_HOUR - (hours - 1) * SECONDS_PER_HOUR
@@ -0,0 +1,167 @@
+"""
+Time-series history for SmartHQ services
+
+An embedded, append-only store of the primary value (e.g. celsius or
+meterValue) of selected services. Each service keeps a raw series and a
+set of downsampled series, all column arrays, each pruned by its own
+retention period.
+"""
+
+import bisect
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# (bucket start, count, sum, min, max, last)
+Bucket = Tuple[float, int, float, float, float, float]
+
+# Pruned entries are only compacted away once this many have accumulated
+COMPACT_THRESHOLD = 1024
+
+
+@dataclass(frozen=True)
+class RetentionTier:
+    """Keep samples downsampled to step seconds (0 for raw) for retention seconds"""
+    step: float
+    retention: float
+
+
+# Raw samples for 6 hours, 1-minute buckets for 7 days, hourly buckets for a year
+DEFAULT_RETENTION_TIERS = (
+    RetentionTier(step=0, retention=6 * 3600),
+    RetentionTier(step=60, retention=7 * 86400),
+    RetentionTier(step=3600, retention=365 * 86400),
+)
+
+
+class _Series:
+    """Column arrays of buckets ordered by start time"""
+
+    def __init__(self, step: float):
+        self.step = step
+        self.starts = array("d")
+        self.counts = array("L")
+        self.sums = array("d")
+        self.mins = array("d")
+        self.maxs = array("d")
+        self.lasts = array("d")
+        self._head = 0  # index of the oldest retained bucket
+
+    def append(self, timestamp: float, value: float):
+        """Add a sample, merging it into the open bucket where it falls"""
+        start = timestamp - timestamp % self.step if self.step else timestamp
+        if len(self.starts) > self._head and start < self.starts[-1]:
+            start = self.starts[-1]  # clock stepped back; keep the columns ordered
+        if self.step and len(self.starts) > self._head and self.starts[-1] == start:
+            self.counts[-1] += 1
+            self.sums[-1] += value
+            self.mins[-1] = min(self.mins[-1], value)
+            self.maxs[-1] = max(self.maxs[-1], value)
+            self.lasts[-1] = value
+            return
+        self.starts.append(start)
+        self.counts.append(1)
+        self.sums.append(value)
+        self.mins.append(value)
+        self.maxs.append(value)
+        self.lasts.append(value)
+
+    def oldest(self) -> Optional[float]:
+        """Start of the oldest retained bucket"""
+        return self.starts[self._head] if len(self.starts) > self._head else None
+
+    def prune(self, cutoff: float):
+        """Drop buckets starting before cutoff"""
+        self._head = max(self._head, bisect.bisect_left(self.starts, cutoff, self._head))
+        if self._head >= COMPACT_THRESHOLD and self._head * 2 >= len(self.starts):
+            for column in (self.starts, self.counts, self.sums, self.mins, self.maxs, self.lasts):
+                del column[:self._head]
+            self._head = 0
+
+    def buckets(self, start: float, end: float) -> Iterator[Bucket]:
+        """Buckets starting within [start, end)"""
+        low = bisect.bisect_left(self.starts, start, self._head)
+        high = bisect.bisect_left(self.starts, end, low)
+        for index in range(low, high):
+            yield (
+                self.starts[index], self.counts[index], self.sums[index],
+                self.mins[index], self.maxs[index], self.lasts[index],
+            )
+
+
+class ServiceHistory:
+    """Raw and downsampled series of one service"""
+
+    def __init__(self, tiers: Sequence[RetentionTier]):
+        self.tiers = tiers
+        self.series = [_Series(tier.step) for tier in tiers]
+
+    def append(self, timestamp: float, value: float):
+        for series, tier in zip(self.series, self.tiers):
+            series.append(timestamp, value)
+            series.prune(timestamp - tier.retention)
+
+    def select(self, start: float, step: float) -> _Series:
+        """Pick the coarsest series fine enough for step that still reaches back to start"""
+        candidates = [series for series in self.series if series.step <= step] or self.series[:1]
+        for series in sorted(candidates, key=lambda series: series.step, reverse=True):
+            oldest = series.oldest()
+            if oldest is not None and oldest <= start:
+                return series
+        # Nothing reaches back far enough: use the one that reaches furthest
+        return min(candidates, key=lambda series: series.oldest() or float("inf"))
+
+
+class HistoryStore:
+    """Per-service history of primary values, queried as aggregated buckets"""
+
+    def __init__(self, tiers: Sequence[RetentionTier] = DEFAULT_RETENTION_TIERS):
+        self.tiers = tuple(sorted(tiers, key=lambda tier: tier.step))
+        self._services: Dict[str, ServiceHistory] = {}
+
+    def __contains__(self, service_id: str) -> bool:
+        return service_id in self._services
+
+    def record(self, service_id: str, value: float, timestamp: Optional[float] = None):
+        """Append a sample (timestamp in epoch seconds, default now)"""
+        history = self._services.get(service_id)
+        if history is None:
+            history = self._services[service_id] = ServiceHistory(self.tiers)
+        history.append(time.time() if timestamp is None else timestamp, float(value))
+
+    def discard(self, service_id: str):
+        """Forget the history of a removed service"""
+        self._services.pop(service_id, None)
+
+    def query(self, service_id: str, start: float, end: float, step: float) -> List[Dict[str, float]]:
+        """
+        Aggregate the samples in [start, end) into step-second buckets
+
+        Buckets are aligned to multiples of step (like GROUP BY time), and
+        the resolution at the edges is that of the tier the samples come from.
+        """
+        history = self._services.get(service_id)
+        if history is None:
+            return []
+
+        series = history.select(start, step)
+        if series.step:
+            start -= start % series.step
+
+        result: List[Dict[str, float]] = []
+        current: Optional[Dict[str, float]] = None
+        for bucket_start, count, total, low, high, last in series.buckets(start, end):
+            start_of = bucket_start - bucket_start % step
+            if current is None or current["start"] != start_of:
+                current = {"start": start_of, "count": 0, "sum": 0.0, "min": low, "max": high, "last": last}
+                result.append(current)
+            current["count"] += count
+            current["sum"] += total
+            current["min"] = min(current["min"], low)
+            current["max"] = max(current["max"], high)
+            current["last"] = last
+
+        for bucket in result:
+            bucket["mean"] = bucket.pop("sum") / bucket["count"]
+        return result
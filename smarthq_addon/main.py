@@ -11,17 +11,43 @@ import json
 import logging
 import os
 import signal
+import sqlite3
 import sys
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional, Set, Tuple
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from functools import partial
 
+import numpy as np
+import orjson
 import uvicorn
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, BaseSettings
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
-from smarthq_client import SmartHQClient, SmartHQDevice, SmartHQService, ServiceType
+from accounts import AccountRegistry
+from energy import SECONDS_PER_HOUR, EnergyAggregator, hour_range
+from history import DEFAULT_RETENTION_TIERS, HistoryStore, RetentionTier
+from metrics import LatencyHistogram, MetricsWriter, labelled
+from snapshot_store import SnapshotStore
+from smarthq_client import (
+    DEFAULT_ACK_TIMEOUT,
+    CoalescePolicy,
+    CommandResult,
+    CommandStatus,
+    DeviceCommand,
+    HandlerMode,
+    SmartHQClient,
+    SmartHQDevice,
+    SmartHQService,
+    ServiceType,
+    format_timestamp,
+    meter_unit,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -30,20 +56,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maximum number of undelivered events buffered per /ws subscriber
+STREAM_QUEUE_SIZE = 1000
 
-class Settings(BaseSettings):
-    """Application settings from environment variables."""
+# Largest number of buckets a history query may return
+MAX_HISTORY_BUCKETS = 10000
+
+# Longest energy summary, in hours
+MAX_ENERGY_HOURS = 24 * 31
+
+# Responses at least this large are gzip-compressed for clients that accept it
+GZIP_MINIMUM_SIZE = 1024
+# Fastest level: most of the size reduction of level 9 for a fraction of its CPU time
+GZIP_LEVEL = 1
+
+# Options of config.yaml, as written by the Supervisor when running as an add-on
+ADDON_OPTIONS_PATH = "/data/options.json"
+
+# HTTP status returned by ?wait=true for commands that were not acknowledged
+COMMAND_ERROR_STATUS = {
+    CommandStatus.FAILED: 502,
+    CommandStatus.TIMEOUT: 504,
+    CommandStatus.CANCELLED: 503,
+}
+
+
+class AccountSettings(BaseModel):
+    """Credentials and endpoint of one SmartHQ account."""
+    name: str
     username: str
     password: str
     region: str = "US"
-    websocket_url: str = "wss://ws-us-west-2mysmarthq.com"
+    websocket_url: str = "wss://ws-us-west-2.mysmarthq.com"
+
+
+class Settings(BaseSettings):
+    """Application settings from environment variables."""
+    username: str = ""
+    password: str = ""
+    region: str = "US"
+    websocket_url: str = "wss://ws-us-west-2.mysmarthq.com"
+    # Several accounts, each with its own connection; entity IDs become "<name>::<id>"
+    accounts: List[AccountSettings] = []
     enable_alerts: bool = True
     enable_services: bool = True
     enable_presence: bool = True
     enable_commands: bool = True
     log_level: str = "INFO"
     reconnect_interval: int = 30
+    # Seconds of silence before the connection is pinged, and unanswered pings before reconnecting
     heartbeat_interval: int = 60
+    missed_pong_limit: int = 2
+    # Keep the registry across reconnects and fetch only what changed meanwhile
+    reconcile_on_reconnect: bool = True
+    changelog_size: int = 10000
+    # Per service type, e.g. {"cloud.smarthq.service.meter": {"window": 10, "threshold": 0.5}}
+    coalesce_policies: Dict[str, Dict[str, float]] = {}
+    handler_mode: str = "inline"
+    handler_lanes: int = 4
+    handler_queue_size: int = 1000
+    offload_sync_handlers: bool = False
+    ingest_workers: int = 1
+    ingest_queue_size: int = 1000
+    # Outbound frames per second (0 disables limiting) and burst allowance
+    send_rate: float = 10.0
+    send_burst: int = 20
+    command_queue_timeout: float = 60.0
+    # Registry snapshot for warm restarts; an empty path disables it
+    snapshot_path: str = "/config/smarthq_snapshot.db"
+    snapshot_interval: float = 30.0
+    # Time series of temperature and meter values, e.g. [{"step": 0, "retention": 21600}, ...]
+    history_enabled: bool = True
+    history_tiers: List[Dict[str, float]] = []
+    # Energy rollups over kWh/kW meters, keeping this many readings per meter
+    energy_enabled: bool = True
+    energy_ring_size: int = 4096
+    # Record raw inbound frames to this file (one per account, suffixed with its name) for replay
+    capture_path: str = ""
     host: str = "0.0.0.0"
     port: int = 8080
 
@@ -51,10 +140,36 @@ class Settings(BaseSettings):
         env_file = ".env"
 
 
+def load_addon_options(path: str = ADDON_OPTIONS_PATH) -> Dict[str, Any]:
+    """Read the add-on options as Settings fields; empty when not running as an add-on."""
+    try:
+        with open(path) as f:
+            options = json.load(f)
+    except FileNotFoundError:
+        return {}
+    
+    # The add-on schema has no free-form maps, so coalesce policies are a list keyed by service type
+    options["coalesce_policies"] = {
+        policy.pop("service_type"): policy for policy in options.get("coalesce_policies", [])
+    }
+    return {key: value for key, value in options.items() if key in Settings.model_fields}
+
+
 class CommandRequest(BaseModel):
     """Request model for sending commands to devices."""
     command: str
     data: List[Any] = []
+    ack_timeout: int = DEFAULT_ACK_TIMEOUT
+
+
+class BatchCommand(CommandRequest):
+    """A command addressed to a device within a batch."""
+    device_id: str
+
+
+class BatchCommandRequest(BaseModel):
+    """Request model for sending several commands at once."""
+    commands: List[BatchCommand]
 
 
 class DeviceResponse(BaseModel):
@@ -65,6 +180,7 @@ class DeviceResponse(BaseModel):
     online: bool
     last_seen: Optional[str] = None
     services: Dict[str, Dict[str, Any]] = {}
+    stale: bool = False
 
 
 class ServiceResponse(BaseModel):
@@ -76,23 +192,137 @@ class ServiceResponse(BaseModel):
     state: Dict[str, Any]
     config: Dict[str, Any]
     supported_commands: List[str]
-    last_sync_time: str
-    last_state_time: str
+    last_sync_time: Optional[str] = None
+    last_state_time: Optional[str] = None
+    unit: Optional[str] = None
+    stale: bool = False
+
+
+class HistoryBucket(BaseModel):
+    """Aggregated samples of one history bucket."""
+    start: str
+    count: int
+    mean: float
+    min: float
+    max: float
+    last: float
+
+
+class HistoryResponse(BaseModel):
+    """Response model for service history queries."""
+    service_id: str
+    step: float
+    buckets: List[HistoryBucket]
+
+
+class ChangesResponse(BaseModel):
+    """Response model for delta queries."""
+    epoch: str
+    version: int
+    full: bool
+    devices: List[DeviceResponse] = []
+    services: List[ServiceResponse] = []
+    removed_devices: List[str] = []
+    removed_services: List[str] = []
+
+
+class ResponseCache:
+    """Pre-encoded JSON bodies for the read endpoints, kept in step with the client's changelog."""
+    def __init__(self):
+        self.devices: Dict[str, bytes] = {}
+        self.services: Dict[str, bytes] = {}
+        self.collections: Dict[str, bytes] = {}
+        self.epoch: Optional[str] = None
+        self.version = 0
+    
+    def sync(self, registry: AccountRegistry):
+        """Drop every entry changed since the last sync."""
+        version = registry.state_version
+        if registry.state_epoch == self.epoch and version == self.version:
+            return
+        
+        changes = None
+        if registry.state_epoch == self.epoch:
+            changes = registry.get_changes_since(self.version)
+        
+        if changes is None:
+            self.clear()
+        else:
+            device_ids, service_ids = changes
+            for device_id in device_ids:
+                self.devices.pop(device_id, None)
+            for service_id in service_ids:
+                self.services.pop(service_id, None)
+                # Device bodies embed their service messages
+                device_id = registry.service_device_id(service_id)
+                if device_id:
+                    self.devices.pop(device_id, None)
+                else:
+                    # Removed service, owning device unknown
+                    self.devices.clear()
+            self.collections.clear()
+        
+        self.epoch = registry.state_epoch
+        self.version = version
+    
+    def clear(self):
+        """Drop everything."""
+        self.devices.clear()
+        self.services.clear()
+        self.collections.clear()
+
+
+class RequestMetrics:
+    """ASGI middleware timing every HTTP request, per method and route template."""
+    def __init__(self, app, latency: Dict[Tuple[str, str], LatencyHistogram], responses: Dict[Tuple[str, str, int], int]):
+        self.app = app
+        self.latency = latency
+        self.responses = responses
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Set by the router once matched; templates keep the label set small
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            labelled(self.latency, (scope["method"], path)).observe(time.perf_counter() - started)
+            key = (scope["method"], path, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
 
 
 class SmartHQAddon:
     """SmartHQ add-on application."""
     def __init__(self):
-        self.settings = Settings()
-        self.client: SmartHQClient = None
+        self.settings = Settings(**load_addon_options())
+        self.clients: Dict[str, SmartHQClient] = {}
+        self.registry = AccountRegistry(self.clients, namespaced=False)
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._cache = ResponseCache()
+        self._snapshots: Optional[SnapshotStore] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._request_latency: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._request_responses: Dict[Tuple[str, str, int], int] = {}
         self.app = FastAPI(
             title="SmartHQ Appliance Control",
             description="REST API for SmartHQ appliance control and monitoring",
-            version=1.0.0
+            version="1.0.0"
         )
         self._setup_routes()
         self._setup_middleware()
-        self._setup_event_handlers()
     
     def _setup_middleware(self):
         """Set up CORS and other middleware."""
@@ -103,6 +333,12 @@ class SmartHQAddon:
             allow_methods=["*"],
             allow_headers=["*"],
         )
+        self.app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
+        self.app.add_middleware(
+            RequestMetrics,
+            latency=self._request_latency,
+            responses=self._request_responses,
+        )
     
     def _setup_routes(self):
         """Set up API routes."""
@@ -113,232 +349,780 @@ class SmartHQAddon:
                 "name": "SmartHQ Appliance Control",
                 "version": "1.0.0",
                 "status": "running",
-                "connected": self.client.connected if self.client else False
+                "connected": self.registry.connected
             }
         
+        @self.app.get("/metrics")
+        async def metrics():
+            """Prometheus metrics."""
+            return Response(content=self._metrics_text(), media_type=MetricsWriter.CONTENT_TYPE)
+        
         @self.app.get("/health")
         async def health():
             """Health check endpoint."""
             return {
                 "status": "healthy",
-                "connected": self.client.connected if self.client else False,
-                "device_count": len(self.client.devices) if self.client else 0
+                "connected": self.registry.connected,
+                "device_count": len(self.registry.devices),
+                "accounts": {
+                    account: {
+                        "connected": client.connected,
+                        "device_count": len(client.devices),
+                        "handlers": client.dispatcher.stats(),
+                        "ingest": client.ingest_stats(),
+                        "commands": client.command_stats(),
+                        "send": client.send_stats(),
+                        "liveness": client.liveness_stats(),
+                    }
+                    for account, client in self.clients.items()
+                },
             }
         
         @self.app.get("/devices", response_model=List[DeviceResponse])
-        async def get_devices():
+        async def get_devices(request: Request):
             """Get all devices."""
-            if not self.client:
+            if not self.clients:
                 raise HTTPException(status_code=503, detail="Client not initialized")
             
-            devices = []
-            for device in self.client.devices.values():
-                devices.append(DeviceResponse(
-                    device_id=device.device_id,
-                    device_type=device.device_type,
-                    name=device.name,
-                    online=device.online,
-                    last_seen=device.last_seen.isoformat() if device.last_seen else None,
-                    services=device.services
-                ))
-            return devices
+            etag = self.registry.state_etag
+            if self._etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            
+            body = self._collection_json(
+                "/devices",
+                lambda: (self._device_json(device_id, device) for device_id, device in self.registry.devices.items())
+            )
+            return self._json_response(body, headers={"ETag": etag})
         
         @self.app.get("/devices/{device_id}", response_model=DeviceResponse)
         async def get_device(device_id: str):
             """Get a specific device."""
-            if not self.client:
+            if not self.clients:
                 raise HTTPException(status_code=503, detail="Client not initialized")
             
-            device = self.client.get_device(device_id)
+            device = self.registry.get_device(device_id)
             if not device:
                 raise HTTPException(status_code=404, detail="Device not found")
             
-            return DeviceResponse(
-                device_id=device.device_id,
-                device_type=device.device_type,
-                name=device.name,
-                online=device.online,
-                last_seen=device.last_seen.isoformat() if device.last_seen else None,
-                services=device.services
-            )
+            return self._json_response(self._device_json(device_id, device))
         
         @self.app.get("/services", response_model=List[ServiceResponse])
-        async def get_services():
+        async def get_services(request: Request):
             """Get all services."""
-            if not self.client:
+            if not self.clients:
                 raise HTTPException(status_code=503, detail="Client not initialized")
             
-            services = []
-            for service in self.client.services.values():
-                services.append(ServiceResponse(
-                    service_id=service.service_id,
-                    service_type=service.service_type.value,
-                    domain_type=service.domain_type,
-                    device_id=service.device_id,
-                    state=service.state,
-                    config=service.config,
-                    supported_commands=service.supported_commands,
-                    last_sync_time=service.last_sync_time.isoformat(),
-                    last_state_time=service.last_state_time.isoformat()
-                ))
-            return services
+            etag = self.registry.state_etag
+            if self._etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            
+            body = self._collection_json(
+                "/services",
+                lambda: (self._service_json(service_id, service) for service_id, service in self.registry.services.items())
+            )
+            return self._json_response(body, headers={"ETag": etag})
         
         @self.app.get("/services/{service_id}", response_model=ServiceResponse)
         async def get_service(service_id: str):
             """Get a specific service."""
-            if not self.client:
+            if not self.clients:
                 raise HTTPException(status_code=503, detail="Client not initialized")
             
-            service = self.client.get_service(service_id)
+            service = self.registry.get_service(service_id)
             if not service:
                 raise HTTPException(status_code=404, detail="Service not found")
             
-            return ServiceResponse(
-                service_id=service.service_id,
-                service_type=service.service_type.value,
-                domain_type=service.domain_type,
-                device_id=service.device_id,
-                state=service.state,
-                config=service.config,
-                supported_commands=service.supported_commands,
-                last_sync_time=service.last_sync_time.isoformat(),
-                last_state_time=service.last_state_time.isoformat()
-            )
+            return self._json_response(self._service_json(service_id, service))
         
-        @self.app.post("/devices/{device_id}/command")
-        async def send_command(device_id: str, command_request: CommandRequest, background_tasks: BackgroundTasks):
-            """Send a command to a device."""
-            if not self.client:
+        @self.app.get("/services/{service_id}/history", response_model=HistoryResponse)
+        async def get_service_history(
+            service_id: str,
+            start: Optional[datetime] = Query(None, alias="from"),
+            end: Optional[datetime] = Query(None, alias="to"),
+            step: float = 60,
+        ):
+            """Get the value history of a service, aggregated into step-second buckets."""
+            if not self.clients:
                 raise HTTPException(status_code=503, detail="Client not initialized")
             
-            if not self.client.connected:
-                raise HTTPException(status_code=503, detail="Not connected to SmartHQ")
+            if not self.registry.get_service(service_id):
+                raise HTTPException(status_code=404, detail="Service not found")
             
-            device = self.client.get_device(device_id)
-            if not device:
+            client, client_service_id = self.registry.resolve(service_id)
+            if client.history is None:
+                raise HTTPException(status_code=404, detail="History is disabled")
+            
+            end = _as_utc(end) if end else datetime.now(timezone.utc)
+            start = _as_utc(start) if start else end - timedelta(hours=1)
+            if step <= 0 or start >= end:
+                raise HTTPException(status_code=400, detail="Invalid time range or step")
+            if (end - start).total_seconds() / step > MAX_HISTORY_BUCKETS:
+                raise HTTPException(status_code=400, detail=f"More than {MAX_HISTORY_BUCKETS} buckets requested")
+            
+            buckets = client.history.query(client_service_id, start.timestamp(), end.timestamp(), step)
+            for bucket in buckets:
+                bucket["start"] = datetime.fromtimestamp(bucket["start"], timezone.utc).isoformat()
+            return self._json_response(orjson.dumps({
+                "service_id": service_id,
+                "step": step,
+                "buckets": buckets,
+            }))
+        
+        @self.app.get("/energy/summary")
+        async def get_energy_summary(hours: int = 24):
+            """Get kWh consumed per device type and per hour over the last hours."""
+            if not self.clients:
+                raise HTTPException(status_code=503, detail="Client not initialized")
+            
+            if not 1 <= hours <= MAX_ENERGY_HOURS:
+                raise HTTPException(status_code=400, detail=f"hours must be between 1 and {MAX_ENERGY_HOURS}")
+            
+            return self._json_response(orjson.dumps(self._energy_summary(hours)))
+        
+        @self.app.get("/energy/by-device")
+        async def get_energy_by_device(window: float = 3600):
+            """Get kWh and average power per appliance over the last window seconds."""
+            if not self.clients:
+                raise HTTPException(status_code=503, detail="Client not initialized")
+            
+            if window <= 0:
+                raise HTTPException(status_code=400, detail="window must be positive")
+            
+            return self._json_response(orjson.dumps(self._energy_by_device(window)))
+        
+        @self.app.get("/changes", response_model=ChangesResponse)
+        async def get_changes(since: Optional[int] = None, epoch: Optional[str] = None):
+            """Get devices and services changed since a registry version."""
+            if not self.clients:
+                raise HTTPException(status_code=503, detail="Client not initialized")
+            
+            self.registry.refresh()
+            changes = None
+            if since is not None and epoch in (None, self.registry.state_epoch):
+                changes = self.registry.get_changes_since(since)
+            
+            if changes is None:
+                # Unknown or evicted version: fall back to a full snapshot
+                return self._json_response(self._changes_json(
+                    full=True,
+                    devices=[self._device_json(device_id, device) for device_id, device in self.registry.devices.items()],
+                    services=[self._service_json(service_id, service) for service_id, service in self.registry.services.items()],
+                ))
+            
+            device_ids, service_ids = changes
+            devices, services, removed_devices, removed_services = [], [], [], []
+            for device_id in device_ids:
+                device = self.registry.get_device(device_id)
+                if device:
+                    devices.append(self._device_json(device_id, device))
+                else:
+                    removed_devices.append(device_id)
+            for service_id in service_ids:
+                service = self.registry.get_service(service_id)
+                if service:
+                    services.append(self._service_json(service_id, service))
+                else:
+                    removed_services.append(service_id)
+            return self._json_response(self._changes_json(
+                full=False,
+                devices=devices,
+                services=services,
+                removed_devices=removed_devices,
+                removed_services=removed_services,
+            ))
+        
+        @self.app.post("/devices/{device_id}/command")
+        async def send_command(device_id: str, command_request: CommandRequest, wait: bool = False):
+            """Send a command to a device, optionally waiting for its result."""
+            if not self.clients:
+                raise HTTPException(status_code=503, detail="Client not initialized")
+            
+            if not self.registry.get_device(device_id):
                 raise HTTPException(status_code=404, detail="Device not found")
             
+            client, client_device_id = self.registry.resolve(device_id)
+            if not client.connected:
+                raise HTTPException(status_code=503, detail="Not connected to SmartHQ")
+            
+            command = DeviceCommand(
+                client_device_id,
+                command_request.command,
+                command_request.data,
+                command_request.ack_timeout
+            )
             try:
-                # Send command in background to avoid blocking
-                background_tasks.add_task(
-                    self.client.send_command,
-                    device_id,
-                    command_request.command,
-                    command_request.data
-                )
-                
-                return {
-                    "status": "command_sent",
-                    "device_id": device_id,
-                    "command": command_request.command,
-                    "data": command_request.data
-                }
+                if wait:
+                    result = await client.execute_command(
+                        command.device_id, command.command, command.data, command.ack_timeout
+                    )
+                else:
+                    command_id = await client.send_command(
+                        command.device_id, command.command, command.data, command.ack_timeout
+                    )
             except Exception as e:
                 logger.error(f"Failed to send command: {e}")
                 raise HTTPException(status_code=500, detail=f"Failed to send command: {str(e)}")
+            
+            if not wait:
+                return self._command_body(device_id, command, command_id)
+            
+            body = self._command_body(device_id, command, result.command_id, result)
+            if result.status is CommandStatus.ACKNOWLEDGED:
+                return body
+            return JSONResponse(status_code=COMMAND_ERROR_STATUS[result.status], content=body)
         
-        @self.app.get("/devices/{device_id}/services")
+        @self.app.post("/commands/batch")
+        async def send_commands(batch_request: BatchCommandRequest, wait: bool = False):
+            """Send several commands in one burst, optionally waiting for all results."""
+            if not self.clients:
+                raise HTTPException(status_code=503, detail="Client not initialized")
+            
+            unknown = sorted({
+                item.device_id for item in batch_request.commands
+                if not self.registry.get_device(item.device_id)
+            })
+            if unknown:
+                raise HTTPException(status_code=404, detail=f"Devices not found: {', '.join(unknown)}")
+            
+            # Split the batch per account, remembering each command's position
+            batches: Dict[str, List[int]] = {}
+            commands: List[DeviceCommand] = []
+            for index, item in enumerate(batch_request.commands):
+                account, client_device_id = self.registry.split(item.device_id)
+                batches.setdefault(account, []).append(index)
+                commands.append(DeviceCommand(client_device_id, item.command, item.data, item.ack_timeout))
+            
+            if not all(self.clients[account].connected for account in batches):
+                raise HTTPException(status_code=503, detail="Not connected to SmartHQ")
+            
+            async def send_batch(account: str, indexes: List[int]) -> list:
+                client = self.clients[account]
+                batch = [commands[index] for index in indexes]
+                if wait:
+                    return await client.execute_commands(batch)
+                return await client.send_commands(batch)
+            
+            try:
+                outcomes = await asyncio.gather(*(
+                    send_batch(account, indexes) for account, indexes in batches.items()
+                ))
+            except Exception as e:
+                logger.error(f"Failed to send commands: {e}")
+                raise HTTPException(status_code=500, detail=f"Failed to send commands: {str(e)}")
+            
+            bodies: List[Optional[Dict[str, Any]]] = [None] * len(commands)
+            for indexes, outcome in zip(batches.values(), outcomes):
+                for index, sent in zip(indexes, outcome):
+                    device_id = batch_request.commands[index].device_id
+                    if wait:
+                        bodies[index] = self._command_body(device_id, commands[index], sent.command_id, sent)
+                    else:
+                        bodies[index] = self._command_body(device_id, commands[index], sent)
+            return {"results": bodies}
+        
+        @self.app.get("/devices/{device_id}/services", response_model=List[ServiceResponse])
         async def get_device_services(device_id: str):
             """Get all services for a specific device."""
-            if not self.client:
+            if not self.clients:
                 raise HTTPException(status_code=503, detail="Client not initialized")
             
-            device = self.client.get_device(device_id)
+            device = self.registry.get_device(device_id)
             if not device:
                 raise HTTPException(status_code=404, detail="Device not found")
             
-            services = []
-            for service in self.client.services.values():
-                if service.device_id == device_id:
-                    services.append(ServiceResponse(
-                        service_id=service.service_id,
-                        service_type=service.service_type.value,
-                        domain_type=service.domain_type,
-                        device_id=service.device_id,
-                        state=service.state,
-                        config=service.config,
-                        supported_commands=service.supported_commands,
-                        last_sync_time=service.last_sync_time.isoformat(),
-                        last_state_time=service.last_state_time.isoformat()
-                    ))
-            return services
-    
-    def _setup_event_handlers(self):
-        """Set up SmartHQ client event handlers."""
+            body = self._collection_json(
+                f"/devices/{device_id}/services",
+                lambda: (
+                    self._service_json(service_id, service)
+                    for service_id, service in self.registry.get_device_services(device_id)
+                )
+            )
+            return self._json_response(body)
+        
+        @self.app.websocket("/ws")
+        async def stream(websocket: WebSocket):
+            """Stream incremental device and service updates."""
+            await websocket.accept()
+            
+            # Subscribe before taking the snapshot so no delta is missed
+            queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+            self._subscribers.add(queue)
+            try:
+                await websocket.send_text(self._snapshot_message())
+                while True:
+                    message = await queue.get()
+                    if message is None:
+                        # Subscriber fell behind; make it resync from a fresh snapshot
+                        await websocket.close(code=1013)
+                        break
+                    await websocket.send_text(message)
+            except WebSocketDisconnect:
+                logger.debug("Stream subscriber disconnected")
+            finally:
+                self._subscribers.discard(queue)
+    
+    def _etag_matches(self, request: Request, etag: str) -> bool:
+        """Check whether If-None-Match already names the current ETag."""
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+    
+    def _device_payload(self, device_id: str, device: SmartHQDevice) -> Dict[str, Any]:
+        """Build the DeviceResponse-shaped payload for a device."""
+        services = {}
+        for service_id, service in self.registry.get_device_services(device_id):
+            message = service.to_message()
+            if self.registry.namespaced:
+                message["serviceId"] = service_id
+                message["deviceId"] = device_id
+            services[service_id] = message
+        return {
+            "device_id": device_id,
+            "device_type": device.device_type,
+            "name": device.name,
+            "online": device.online,
+            "last_seen": device.last_seen.isoformat() if device.last_seen else None,
+            "stale": device.stale,
+            "services": services,
+        }
+    
+    def _service_payload(self, service_id: str, service: SmartHQService) -> Dict[str, Any]:
+        """Build the ServiceResponse-shaped payload for a service."""
+        return {
+            "service_id": service_id,
+            "service_type": service.service_type.value,
+            "domain_type": service.domain_type,
+            "device_id": self.registry.service_device_id(service_id),
+            "state": service.state,
+            "config": service.config,
+            "supported_commands": service.supported_commands,
+            "last_sync_time": format_timestamp(service.last_sync_raw),
+            "last_state_time": format_timestamp(service.last_state_raw),
+            "unit": meter_unit(service.config) if service.service_type is ServiceType.METER else None,
+            "stale": service.stale,
+        }
+    
+    def _device_json(self, device_id: str, device: SmartHQDevice) -> bytes:
+        """Get the encoded body of a device, serializing it on a cache miss."""
+        self._cache.sync(self.registry)
+        body = self._cache.devices.get(device_id)
+        if body is None:
+            body = orjson.dumps(self._device_payload(device_id, device))
+            self._cache.devices[device_id] = body
+        return body
+    
+    def _service_json(self, service_id: str, service: SmartHQService) -> bytes:
+        """Get the encoded body of a service, serializing it on a cache miss."""
+        self._cache.sync(self.registry)
+        body = self._cache.services.get(service_id)
+        if body is None:
+            body = orjson.dumps(self._service_payload(service_id, service))
+            self._cache.services[service_id] = body
+        return body
+    
+    def _collection_json(self, key: str, bodies: Callable[[], Iterable[bytes]]) -> bytes:
+        """Get an encoded JSON array, joining the cached entity bodies on a miss."""
+        self._cache.sync(self.registry)
+        body = self._cache.collections.get(key)
+        if body is None:
+            body = b"[" + b",".join(bodies()) + b"]"
+            self._cache.collections[key] = body
+        return body
+    
+    def _changes_json(
+        self,
+        full: bool,
+        devices: List[bytes],
+        services: List[bytes],
+        removed_devices: Optional[List[str]] = None,
+        removed_services: Optional[List[str]] = None,
+    ) -> bytes:
+        """Encode a ChangesResponse body around the cached entity bodies."""
+        version = self.registry.state_version
+        header = orjson.dumps({
+            "epoch": self.registry.state_epoch,
+            "version": version,
+            "full": full,
+            "removed_devices": removed_devices or [],
+            "removed_services": removed_services or [],
+        })
+        return (
+            header[:-1]
+            + b',"devices":[' + b",".join(devices)
+            + b'],"services":[' + b",".join(services)
+            + b"]}"
+        )
+    
+    def _energy_summary(self, hours: int) -> Dict[str, Any]:
+        """Roll up every account's meters into kWh per device type and hour."""
+        now = time.time()
+        start = hour_range(hours, now)
+        
+        # Group index of every meter row, per account
+        type_index: Dict[str, int] = {}
+        row_groups = []
+        for client in self.clients.values():
+            if client.energy is None:
+                continue
+            groups = np.full(len(client.energy.row_devices), -1, dtype=np.int64)
+            for row, device_id in enumerate(client.energy.row_devices):
+                if device_id is not None:
+                    device = client.get_device(device_id)
+                    device_type = device.device_type if device and device.device_type else "unknown"
+                    groups[row] = type_index.setdefault(device_type, len(type_index))
+            row_groups.append((client.energy, groups))
+        
+        hourly = np.zeros((len(type_index), hours))
+        covered = start
+        for aggregator, groups in row_groups:
+            hourly += aggregator.hourly_by_group(groups, len(type_index), start, hours)
+            # Meters whose ring wrapped no longer hold the start of the range
+            covered = max(covered, aggregator.retained_since())
+        
+        return {
+            "from": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+            "to": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            "covered_from": datetime.fromtimestamp(min(covered, now), timezone.utc).isoformat(),
+            "hours": [
+                datetime.fromtimestamp(start + hour * SECONDS_PER_HOUR, timezone.utc).isoformat()
+                for hour in range(hours)
+            ],
+            "total_kwh": float(hourly.sum()),
+            "by_device_type": {
+                device_type: {"kwh": float(hourly[index].sum()), "hourly_kwh": hourly[index].tolist()}
+                for device_type, index in type_index.items()
+            },
+        }
+    
+    def _energy_by_device(self, window: float) -> List[Dict[str, Any]]:
+        """Sum every account's meters into kWh and average power per device."""
+        now = time.time()
+        devices = []
+        for account, client in self.clients.items():
+            aggregator = client.energy
+            if aggregator is None or not len(aggregator):
+                continue
+            
+            # Device index of every meter row, then one vectorized sum per device
+            device_ids: List[str] = []
+            device_index: Dict[str, int] = {}
+            rows = np.full(len(aggregator.row_devices), -1, dtype=np.int64)
+            for row, device_id in enumerate(aggregator.row_devices):
+                if device_id is not None:
+                    if device_id not in device_index:
+                        device_index[device_id] = len(device_ids)
+                        device_ids.append(device_id)
+                    rows[row] = device_index[device_id]
+            
+            used = rows >= 0
+            totals = aggregator.totals_by_row(now - window, now)
+            kwh = np.bincount(rows[used], weights=totals[used], minlength=len(device_ids))
+            power = aggregator.power[:len(rows)]
+            has_power = used & ~np.isnan(power)
+            power_kw = np.bincount(rows[has_power], weights=power[has_power], minlength=len(device_ids))
+            reporting = np.bincount(rows[has_power], minlength=len(device_ids))
+            
+            for index, device_id in enumerate(device_ids):
+                device = client.get_device(device_id)
+                devices.append({
+                    "device_id": self.registry.qualify(account, device_id),
+                    "device_type": device.device_type if device else None,
+                    "name": device.name if device else None,
+                    "kwh": float(kwh[index]),
+                    "average_kw": float(kwh[index] * SECONDS_PER_HOUR / window),
+                    "power_kw": float(power_kw[index]) if reporting[index] else None,
+                })
+        return devices
+    
+    def _metrics_text(self) -> str:
+        """Render the add-on and client metrics in the Prometheus text format."""
+        writer = MetricsWriter("smarthq")
+        for account, client in self.clients.items():
+            client.write_metrics(writer, {"account": account})
+        
+        for (method, route), histogram in self._request_latency.items():
+            writer.histogram(
+                "http_request_seconds", "REST request latency, per route",
+                histogram, {"method": method, "route": route},
+            )
+        for (method, route, status), count in self._request_responses.items():
+            writer.counter(
+                "http_responses", "REST responses, per route and status",
+                count, {"method": method, "route": route, "status": str(status)},
+            )
+        writer.gauge("stream_subscribers", "Connected /ws stream clients", len(self._subscribers))
+        writer.gauge("registry_version", "Merged registry version", self.registry.state_version)
+        return writer.render()
+    
+    def _json_response(self, body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+        """Wrap a pre-encoded JSON body without re-validating it."""
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    def _command_body(
+        self,
+        device_id: str,
+        command: DeviceCommand,
+        command_id: str,
+        result: Optional[CommandResult] = None
+    ) -> Dict[str, Any]:
+        """Build the response body for a sent command, with its result if awaited."""
+        body = {
+            "status": result.status.value if result else "command_sent",
+            "command_id": command_id,
+            "device_id": device_id,
+            "command": command.command,
+            "data": command.data
+        }
+        if result:
+            body["latency_ms"] = round(result.latency * 1000, 3) if result.latency is not None else None
+            body["response"] = result.response
+        return body
+    
+    def _snapshot_message(self) -> str:
+        """Build the full-state message sent to new stream subscribers."""
+        devices = self.registry.devices.items()
+        services = self.registry.services.items()
+        return (
+            b'{"event":"snapshot","devices":['
+            + b",".join(self._device_json(device_id, device) for device_id, device in devices)
+            + b'],"services":['
+            + b",".join(self._service_json(service_id, service) for service_id, service in services)
+            + b"]}"
+        ).decode()
+    
+    def _publish(self, event: str, **fields: Any):
+        """Encode a delta once and forward it to every stream subscriber."""
+        if self._subscribers:
+            self._broadcast(orjson.dumps({"event": event, **fields}))
+    
+    def _publish_entity(self, event: str, key: str, body: Callable[[], bytes]):
+        """Forward an entity delta, reusing the entity's cached encoding."""
+        if self._subscribers:
+            self._broadcast(b'{"event":"' + event.encode() + b'","' + key.encode() + b'":' + body() + b"}")
+    
+    def _broadcast(self, payload: bytes):
+        """Queue an encoded message on every stream subscriber."""
+        message = payload.decode()
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning("Stream subscriber is too slow, forcing resync")
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+    
+    def _event_handlers_for(self, account: str) -> Dict[str, Callable]:
+        """Build the SmartHQ client event handlers for one account."""
+        qualify = partial(self.registry.qualify, account)
+        
         async def on_device_added(device: SmartHQDevice):
             """Handle device added event."""
             logger.info(f"Device added: {device.device_id} ({device.device_type})")
+            device_id = qualify(device.device_id)
+            self._publish_entity("device_added", "device", lambda: self._device_json(device_id, device))
         
         async def on_device_updated(device: SmartHQDevice):
             """Handle device updated event."""
             logger.debug(f"Device updated: {device.device_id}")
+            device_id = qualify(device.device_id)
+            self._publish_entity("device_updated", "device", lambda: self._device_json(device_id, device))
+        
+        async def on_device_removed(device: SmartHQDevice):
+            """Handle device removed event."""
+            logger.info(f"Device removed: {device.device_id}")
+            self._publish("device_removed", device_id=qualify(device.device_id))
         
         async def on_service_updated(service: SmartHQService):
             """Handle service updated event."""
             logger.debug(f"Service updated: {service.service_id} ({service.service_type.value})")
+            service_id = qualify(service.service_id)
+            self._publish_entity("service_updated", "service", lambda: self._service_json(service_id, service))
+        
+        async def on_service_removed(service: SmartHQService):
+            """Handle service removed event."""
+            logger.debug(f"Service removed: {service.service_id}")
+            self._publish("service_removed", service_id=qualify(service.service_id))
         
         async def on_alert_received(alert_data: Dict[str, Any]):
             """Handle alert received event."""
             logger.info(f"Alert received: {alert_data}")
+            self._publish("alert_received", account=account, alert=alert_data)
         
         async def on_presence_changed(device_id: str, presence: Dict[str, Any]):
             """Handle presence changed event."""
             logger.info(f"Presence changed for {device_id}: {presence}")
+            device = self.clients[account].get_device(device_id)
+            self._publish(
+                "presence_changed",
+                device_id=qualify(device_id),
+                online=device.online if device else presence.get("online", False),
+                last_seen=device.last_seen.isoformat() if device and device.last_seen else None,
+            )
         
         async def on_connected():
             """Handle connected event."""
-            logger.info("Connected to SmartHQ")
+            logger.info(f"Connected to SmartHQ ({account})")
         
         async def on_disconnected():
             """Handle disconnected event."""
-            logger.warning("Disconnected from SmartHQ")
+            logger.warning(f"Disconnected from SmartHQ ({account})")
         
-        # Store handlers for later assignment
-        self._event_handlers = {
+        return {
             "device_added": on_device_added,
             "device_updated": on_device_updated,
+            "device_removed": on_device_removed,
             "service_updated": on_service_updated,
+            "service_removed": on_service_removed,
             "alert_received": on_alert_received,
             "presence_changed": on_presence_changed,
             "connected": on_connected,
             "disconnected": on_disconnected,
         }
     
-    async def start_client(self):
-        """Start the SmartHQ client."""
-        logger.info("Starting SmartHQ client...")
-        
-        self.client = SmartHQClient(
+    def _account_settings(self) -> List[AccountSettings]:
+        """The configured accounts, or the single top-level account."""
+        if self.settings.accounts:
+            return self.settings.accounts
+        return [AccountSettings(
+            name="default",
             username=self.settings.username,
             password=self.settings.password,
             region=self.settings.region,
             websocket_url=self.settings.websocket_url,
+        )]
+    
+    def _create_client(self, account: AccountSettings) -> SmartHQClient:
+        """Create the SmartHQ client of one account."""
+        return SmartHQClient(
+            username=account.username,
+            password=account.password,
+            region=account.region,
+            websocket_url=account.websocket_url,
             enable_alerts=self.settings.enable_alerts,
             enable_services=self.settings.enable_services,
             enable_presence=self.settings.enable_presence,
             enable_commands=self.settings.enable_commands,
+            changelog_size=self.settings.changelog_size,
+            coalesce_policies={
+                ServiceType(service_type): CoalescePolicy(**policy)
+                for service_type, policy in self.settings.coalesce_policies.items()
+            },
+            handler_mode=HandlerMode(self.settings.handler_mode),
+            handler_lanes=self.settings.handler_lanes,
+            handler_queue_size=self.settings.handler_queue_size,
+            offload_sync_handlers=self.settings.offload_sync_handlers,
+            ingest_workers=self.settings.ingest_workers,
+            ingest_queue_size=self.settings.ingest_queue_size,
+            send_rate=self.settings.send_rate,
+            send_burst=self.settings.send_burst,
+            command_queue_timeout=self.settings.command_queue_timeout,
+            history=self._create_history(),
+            energy=EnergyAggregator(self.settings.energy_ring_size) if self.settings.energy_enabled else None,
+            heartbeat_interval=self.settings.heartbeat_interval,
+            missed_pong_limit=self.settings.missed_pong_limit,
+            reconnect_interval=self.settings.reconnect_interval,
+            reconcile_on_reconnect=self.settings.reconcile_on_reconnect,
+            capture_path=self._capture_path(account),
+        )
+    
+    def _capture_path(self, account: AccountSettings) -> Optional[str]:
+        """Frame capture file of one account, if capturing is enabled."""
+        if not self.settings.capture_path:
+            return None
+        if not self.settings.accounts:
+            return self.settings.capture_path
+        root, extension = os.path.splitext(self.settings.capture_path)
+        return f"{root}-{account.name}{extension}"
+    
+    def _create_history(self) -> Optional[HistoryStore]:
+        """Create a history store with the configured retention tiers."""
+        if not self.settings.history_enabled:
+            return None
+        tiers = [RetentionTier(**tier) for tier in self.settings.history_tiers] or DEFAULT_RETENTION_TIERS
+        return HistoryStore(tiers)
+    
+    async def start_client(self):
+        """Start one SmartHQ client per account."""
+        logger.info("Starting SmartHQ client...")
+        
+        accounts = self._account_settings()
+        self.clients.clear()
+        self.registry = AccountRegistry(
+            self.clients,
+            namespaced=bool(self.settings.accounts),
+            changelog_size=self.settings.changelog_size,
         )
+        self._cache.clear()
+        
+        for account in accounts:
+            client = self._create_client(account)
+            for event, handler in self._event_handlers_for(account.name).items():
+                client.add_event_handler(event, handler)
+            self.registry.add_client(account.name, client)
         
-        # Add event handlers
-        for event, handler in self._event_handlers.items():
-            self.client.add_event_handler(event, handler)
+        # Serve the last known state while the cloud re-sends everything
+        self._open_snapshots()
+        if self._snapshots:
+            for name, client in self.clients.items():
+                self._snapshots.restore(name, client)
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
         
-        # Connect to SmartHQ
-        if not await self.client.connect():
-            logger.error("Failed to connect to SmartHQ")
+        # Connect every account concurrently
+        results = await asyncio.gather(*(client.connect() for client in self.clients.values()))
+        for name, connected in zip(self.clients, results):
+            if not connected:
+                logger.error(f"Failed to connect to SmartHQ ({name})")
+        if not any(results):
             return False
         
         logger.info("SmartHQ client started successfully")
         return True
     
     async def stop_client(self):
-        """Stop the SmartHQ client."""
-        if self.client:
+        """Stop the SmartHQ clients."""
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        if self._snapshots:
+            await self._save_snapshots()
+            self._snapshots.close()
+            self._snapshots = None
+        
+        if self.clients:
             logger.info("Stopping SmartHQ client...")
-            await self.client.disconnect()
-            self.client = None
+            await asyncio.gather(*(client.disconnect() for client in self.clients.values()))
+            self.clients.clear()
             logger.info("SmartHQ client stopped")
     
+    def _open_snapshots(self):
+        """Open the snapshot store, if enabled and usable."""
+        if not self.settings.snapshot_path:
+            return
+        store = SnapshotStore(self.settings.snapshot_path)
+        try:
+            store.open()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Snapshots disabled, cannot open {self.settings.snapshot_path}: {e}")
+            return
+        self._snapshots = store
+    
+    async def _save_snapshots(self):
+        """Write the changes of every account to the snapshot store."""
+        for name, client in self.clients.items():
+            try:
+                await self._snapshots.save(name, client)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to save snapshot for {name}: {e}")
+    
+    async def _snapshot_loop(self):
+        """Periodically save registry changes."""
+        while True:
+            await asyncio.sleep(self.settings.snapshot_interval)
+            await self._save_snapshots()
+    
     async def run(self):
         """Run the application."""
         logger.info("Starting SmartHQ Appliance Control Add-on...")
@@ -367,6 +1151,11 @@ class SmartHQAddon:
             logger.info("SmartHQ Appliance Control Add-on stopped")
 
 
+def _as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes as UTC."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
 async def main():
     """Entry point."""
     addon = SmartHQAddon()
@@ -387,4 +1176,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+"""
+Metrics primitives for the SmartHQ add-on
+
+Lightweight, dependency-free counters and histograms used to instrument
+the client and the REST API, and their Prometheus text exposition.
+"""
+
+import bisect
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+# Upper bounds (seconds) for in-process work such as decoding and handling one frame
+FAST_LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0,
+)
+
+# Label names and values of one sample
+Labels = Optional[Dict[str, str]]
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with interpolated percentiles"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        """Record one observation"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Estimate the q-th percentile (0-100) in seconds"""
+        if not self.count:
+            return None
+
+        rank = q / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    # Open-ended bucket: report its lower bound
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def cumulative(self) -> List[int]:
+        """Cumulative counts per bucket, ending with +Inf"""
+        result = []
+        total = 0
+        for bucket_count in self.counts:
+            total += bucket_count
+            result.append(total)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Summary suitable for JSON status endpoints (milliseconds)"""
+        p50 = self.percentile(50)
+        p99 = self.percentile(99)
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count * 1000, 3) if self.count else None,
+            "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+        }
+
+
+def labelled(histograms: Dict[Any, LatencyHistogram], key: Any, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> LatencyHistogram:
+    """Get the histogram of one label value, creating it on first use"""
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = LatencyHistogram(buckets)
+    return histogram
+
+
+class MetricsWriter:
+    """
+    Builds a Prometheus text exposition (format 0.0.4)
+    
+    Samples can be added in any order; each metric family is written once,
+    with its HELP and TYPE lines, in the order it was first seen.
+    """
+    
+    CONTENT_TYPE = "text/plain; version=0.0.4"
+    
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._families: Dict[str, Tuple[str, str, List[str]]] = {}
+    
+    def counter(self, name: str, help_text: str, value: float, labels: Labels = None):
+        """Add a counter sample (name without the _total suffix)"""
+        self._family(name + "_total", "counter", help_text).append(self._sample(name + "_total", labels, value))
+    
+    def gauge(self, name: str, help_text: str, value: Optional[float], labels: Labels = None):
+        """Add a gauge sample; None is skipped"""
+        samples = self._family(name, "gauge", help_text)
+        if value is not None:
+            samples.append(self._sample(name, labels, value))
+    
+    def histogram(self, name: str, help_text: str, histogram: LatencyHistogram, labels: Labels = None):
+        """Add the buckets, sum and count of a histogram"""
+        samples = self._family(name, "histogram", help_text)
+        bounds = [_format_value(bound) for bound in histogram.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, histogram.cumulative()):
+            samples.append(self._sample(name + "_bucket", {**(labels or {}), "le": bound}, count))
+        samples.append(self._sample(name + "_sum", labels, histogram.sum))
+        samples.append(self._sample(name + "_count", labels, histogram.count))
+    
+    def render(self) -> str:
+        """The exposition text"""
+        lines = []
+        for name, (metric_type, help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {_escape_help(help_text)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+    
+    def _family(self, name: str, metric_type: str, help_text: str) -> List[str]:
+        """Sample lines of a metric family, declaring it on first use"""
+        name = self._name(name)
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (metric_type, help_text, [])
+        return family[2]
+    
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+    
+    def _sample(self, name: str, labels: Labels, value: float) -> str:
+        """One sample line"""
+        name = self._name(name)
+        if labels:
+            pairs = ",".join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+            name = f"{name}{{{pairs}}}"
+        return f"{name} {_format_value(value)}"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value as Prometheus expects"""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
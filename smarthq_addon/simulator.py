@@ -0,0 +1,422 @@
+"""
+Local SmartHQ cloud simulator
+
+A stand-in for the SmartHQ Event Stream endpoint that speaks the frames
+SmartHQClient expects (websocket#connection, device, presence,
+pubsub#service, alert, pong, websocket#api replies and command results)
+for a scripted fleet of fake appliances. Used by benchmark.py, and handy
+for trying the add-on without real appliances:
+
+    python simulator.py --devices 2000 --rate 500
+    WEBSOCKET_URL=ws://127.0.0.1:8765 python main.py
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+# (device type, service types) of the simulated appliances, picked round-robin
+APPLIANCE_PROFILES = (
+    ("cloud.smarthq.device.oven", (
+        "cloud.smarthq.service.temperature",
+        "cloud.smarthq.service.mode",
+        "cloud.smarthq.service.cycletimer",
+    )),
+    ("cloud.smarthq.device.refrigerator", (
+        "cloud.smarthq.service.temperature",
+        "cloud.smarthq.service.temperature",
+        "cloud.smarthq.service.toggle",
+    )),
+    ("cloud.smarthq.device.washer", (
+        "cloud.smarthq.service.mode",
+        "cloud.smarthq.service.cycletimer",
+        "cloud.smarthq.service.meter",
+    )),
+    ("cloud.smarthq.device.waterheater", (
+        "cloud.smarthq.service.temperature",
+        "cloud.smarthq.service.meter",
+        "cloud.smarthq.service.toggle",
+    )),
+)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class SimulatedService:
+    """One service of a simulated appliance"""
+    service_id: str
+    service_type: str
+    device_id: str
+    value: float = 0.0
+    config: Dict[str, Any] = field(default_factory=dict)
+    last_state_time: str = field(default_factory=_now)
+
+    def state(self) -> Dict[str, Any]:
+        """State payload for the current value"""
+        if self.service_type.endswith(".temperature"):
+            return {"celsius": self.value, "fahrenheit": round(self.value * 9 / 5 + 32, 1)}
+        if self.service_type.endswith(".toggle"):
+            return {"on": bool(int(self.value) % 2)}
+        if self.service_type.endswith(".mode"):
+            return {"mode": f"cloud.smarthq.type.mode.mode{int(self.value) % 4}"}
+        if self.service_type.endswith(".meter"):
+            return {"meterValue": self.value, "meterValueDelta": 0.01}
+        return {"secondsRemaining": int(self.value), "secondsInitial": 3600}
+
+    def to_message(self) -> Dict[str, Any]:
+        """The pubsub#service frame announcing this service"""
+        return {
+            "kind": "pubsub#service",
+            "serviceId": self.service_id,
+            "serviceType": self.service_type,
+            "domainType": "cloud.smarthq.domain.simulated",
+            "deviceId": self.device_id,
+            "state": self.state(),
+            "config": self.config,
+            "supportedCommands": [],
+            "lastSyncTime": self.last_state_time,
+            "lastStateTime": self.last_state_time,
+        }
+
+
+@dataclass
+class SimulatedDevice:
+    """A simulated appliance and its services"""
+    device_id: str
+    device_type: str
+    name: str
+    services: List[SimulatedService]
+    online: bool = True
+    last_sync_time: str = field(default_factory=_now)
+
+    def to_message(self) -> Dict[str, Any]:
+        return {"kind": "device", "deviceId": self.device_id, "deviceType": self.device_type, "name": self.name}
+
+    def presence_message(self) -> Dict[str, Any]:
+        return {
+            "kind": "presence",
+            "deviceId": self.device_id,
+            "presence": {"online": self.online, "lastSeen": _now()},
+        }
+
+    def to_listing(self) -> Dict[str, Any]:
+        """Entry of the GET /v2/device reply"""
+        return {
+            "deviceId": self.device_id,
+            "deviceType": self.device_type,
+            "name": self.name,
+            "lastSyncTime": self.last_sync_time,
+            "presence": {"online": self.online},
+        }
+
+
+class SmartHQSimulator:
+    """
+    Scriptable fake SmartHQ cloud
+
+    Every connected client receives the whole fleet once it subscribes,
+    then service updates at `rate` per second (0 for none) with an extra
+    burst of `burst_size` updates every `burst_interval` seconds. Tests
+    and benchmarks drive it further through update(), burst(),
+    add_device(), remove_device() and drop_connections().
+    """
+
+    def __init__(
+        self,
+        devices: int = 100,
+        rate: float = 10.0,
+        burst_size: int = 0,
+        burst_interval: float = 0.0,
+        alert_rate: float = 0.0,
+        ack_delay: float = 0.05,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+    ):
+        self.rate = rate
+        self.burst_size = burst_size
+        self.burst_interval = burst_interval
+        self.alert_rate = alert_rate
+        self.ack_delay = ack_delay
+        self.host = host
+        self.port = port
+        self.user_id = "simulated-user"
+        self._random = random.Random(seed)
+
+        self.devices: Dict[str, SimulatedDevice] = {}
+        self.services: Dict[str, SimulatedService] = {}
+        self._service_ids: List[str] = []
+        for _ in range(devices):
+            self.add_device()
+
+        self._server = None
+        self._connections: Set[Any] = set()
+        self._subscribed: Set[Any] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.frames_sent = 0
+        self.commands_received = 0
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self):
+        """Start serving (port 0 picks a free port)"""
+        self._server = await websockets.serve(
+            self._handle_connection, self.host, self.port, ping_interval=None, max_size=None
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tasks = [asyncio.create_task(self._update_loop())]
+        if self.burst_size and self.burst_interval > 0:
+            self._tasks.append(asyncio.create_task(self._burst_loop()))
+        if self.alert_rate > 0:
+            self._tasks.append(asyncio.create_task(self._alert_loop()))
+        logger.info(f"Simulating {len(self.devices)} devices with {len(self.services)} services on {self.url}")
+
+    async def stop(self):
+        """Stop serving and close every connection"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def add_device(self, device_type: Optional[str] = None) -> SimulatedDevice:
+        """Add an appliance; announce() sends it to clients already subscribed"""
+        index = len(self.devices)
+        profile_type, service_types = APPLIANCE_PROFILES[index % len(APPLIANCE_PROFILES)]
+        device_id = f"SIM{uuid.UUID(int=self._random.getrandbits(128)).hex[:12].upper()}"
+        device = SimulatedDevice(
+            device_id=device_id,
+            device_type=device_type or profile_type,
+            name=f"Simulated appliance {index + 1}",
+            services=[],
+        )
+        for position, service_type in enumerate(service_types):
+            service = SimulatedService(
+                service_id=f"{device_id}-{position}",
+                service_type=service_type,
+                device_id=device_id,
+                value=round(self._random.uniform(0, 200), 1),
+                config={"meterUnits": "cloud.smarthq.type.meterunits.kwh"} if service_type.endswith(".meter") else {},
+            )
+            device.services.append(service)
+            self.services[service.service_id] = service
+            self._service_ids.append(service.service_id)
+        # A device's lastSyncTime is that of its most recently synced service
+        device.last_sync_time = max(service.last_state_time for service in device.services)
+        self.devices[device_id] = device
+        return device
+
+    async def announce(self, device: SimulatedDevice):
+        """Send a device, its presence and its services to subscribed clients"""
+        await self._broadcast([device.to_message(), device.presence_message()])
+        await self._broadcast([service.to_message() for service in device.services])
+
+    def remove_device(self, device_id: str):
+        """Remove an appliance; clients learn about it only by reconciling"""
+        device = self.devices.pop(device_id)
+        for service in device.services:
+            del self.services[service.service_id]
+        removed = {service.service_id for service in device.services}
+        self._service_ids = [service_id for service_id in self._service_ids if service_id not in removed]
+
+    async def update(self, service_id: Optional[str] = None, value: Optional[float] = None) -> SimulatedService:
+        """Change one service (a random one by default) and push it to subscribed clients"""
+        service = self.services[service_id] if service_id else self.services[self._random.choice(self._service_ids)]
+        service.value = value if value is not None else round(service.value + self._random.uniform(-1, 1), 2)
+        service.last_state_time = _now()
+        self.devices[service.device_id].last_sync_time = service.last_state_time
+        await self._broadcast([service.to_message()])
+        return service
+
+    async def burst(self, count: int):
+        """Push count updates back to back"""
+        messages = []
+        for _ in range(count):
+            service = self.services[self._random.choice(self._service_ids)]
+            service.value = round(service.value + self._random.uniform(-1, 1), 2)
+            service.last_state_time = _now()
+            messages.append(service.to_message())
+        await self._broadcast(messages)
+
+    async def drop_connections(self):
+        """Close every client connection, as a cloud-side restart would"""
+        for websocket in list(self._connections):
+            await websocket.close()
+
+    async def _broadcast(self, messages: List[Dict[str, Any]]):
+        """Send frames to every subscribed client"""
+        if not self._subscribed or not messages:
+            return
+        frames = [json.dumps(message) for message in messages]
+        for websocket in list(self._subscribed):
+            try:
+                for frame in frames:
+                    await websocket.send(frame)
+                self.frames_sent += len(frames)
+            except websockets.exceptions.ConnectionClosed:
+                self._subscribed.discard(websocket)
+
+    async def _handle_connection(self, websocket, path: str = ""):
+        """Serve one client connection"""
+        self._connections.add(websocket)
+        try:
+            await websocket.send(json.dumps({"kind": "websocket#connection", "userId": self.user_id}))
+            async for frame in websocket:
+                try:
+                    message = json.loads(frame)
+                except ValueError:
+                    continue
+                await self._handle_frame(websocket, message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._connections.discard(websocket)
+            self._subscribed.discard(websocket)
+
+    async def _handle_frame(self, websocket, message: Dict[str, Any]):
+        """Answer one client frame"""
+        kind = message.get("kind")
+        if kind == "websocket#ping":
+            await websocket.send(json.dumps({"kind": "websocket#pong", "id": message.get("id")}))
+        elif kind == "websocket#pubsub":
+            await self._send_fleet(websocket)
+            self._subscribed.add(websocket)
+        elif kind == "websocket#api":
+            await self._handle_api(websocket, message)
+
+    async def _send_fleet(self, websocket):
+        """Send every device, its presence and its services to a new subscriber"""
+        for device in list(self.devices.values()):
+            frames = [device.to_message(), device.presence_message()]
+            frames += [service.to_message() for service in device.services]
+            for frame in frames:
+                await websocket.send(json.dumps(frame))
+            self.frames_sent += len(frames)
+
+    async def _handle_api(self, websocket, message: Dict[str, Any]):
+        """Answer a digital twin API request"""
+        request_id = message.get("id")
+        path = message.get("path", "")
+        if message.get("method") == "GET" and path == "/v2/device":
+            body = {"devices": [device.to_listing() for device in self.devices.values()]}
+            await self._reply(websocket, request_id, 200, body)
+        elif message.get("method") == "GET" and path.startswith("/v2/device/"):
+            device = self.devices.get(path.rsplit("/", 1)[1])
+            if device is None:
+                await self._reply(websocket, request_id, 404, {})
+            else:
+                await self._reply(websocket, request_id, 200, {
+                    **device.to_listing(),
+                    "services": [service.to_message() for service in device.services],
+                })
+        elif message.get("method") == "POST" and "/control/" in path:
+            self.commands_received += 1
+            device_id = message.get("body", {}).get("applianceId")
+            if device_id not in self.devices:
+                await self._reply(websocket, request_id, 404, {})
+                return
+            await self._reply(websocket, request_id, 200, {})
+            asyncio.get_running_loop().call_later(
+                self.ack_delay, lambda: asyncio.ensure_future(self._acknowledge(websocket, request_id))
+            )
+        else:
+            await self._reply(websocket, request_id, 404, {})
+
+    async def _reply(self, websocket, request_id: str, code: int, body: Dict[str, Any]):
+        await websocket.send(json.dumps({"kind": "websocket#api", "id": request_id, "code": code, "body": body}))
+
+    async def _acknowledge(self, websocket, request_id: str):
+        """Report a command as carried out"""
+        try:
+            await websocket.send(json.dumps({"kind": "command", "id": request_id, "outcome": "success"}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _update_loop(self):
+        """Push random service updates at the configured rate"""
+        while True:
+            if self.rate <= 0 or not self._subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            # Send in small batches so high rates do not depend on sleep() precision
+            batch = max(1, int(self.rate / 100))
+            await self.burst(batch)
+            await asyncio.sleep(batch / self.rate)
+
+    async def _burst_loop(self):
+        """Push a burst of updates every burst_interval seconds"""
+        while True:
+            await asyncio.sleep(self.burst_interval)
+            await self.burst(self.burst_size)
+
+    async def _alert_loop(self):
+        """Raise random appliance alerts at alert_rate per second"""
+        while True:
+            await asyncio.sleep(1 / self.alert_rate)
+            device_id = self._random.choice(list(self.devices))
+            await self._broadcast([{
+                "kind": "alert",
+                "deviceId": device_id,
+                "alertType": "cloud.smarthq.alert.simulated",
+                "time": _now(),
+            }])
+
+
+async def _serve(args: argparse.Namespace):
+    simulator = SmartHQSimulator(
+        devices=args.devices,
+        rate=args.rate,
+        burst_size=args.burst_size,
+        burst_interval=args.burst_interval,
+        alert_rate=args.alert_rate,
+        seed=args.seed,
+        host=args.host,
+        port=args.port,
+    )
+    await simulator.start()
+    try:
+        await asyncio.Future()
+    finally:
+        await simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local SmartHQ cloud simulator")
+    parser.add_argument("--devices", type=int, default=100, help="number of simulated appliances")
+    parser.add_argument("--rate", type=float, default=10.0, help="service updates per second")
+    parser.add_argument("--burst-size", type=int, default=0, help="updates per burst")
+    parser.add_argument("--burst-interval", type=float, default=0.0, help="seconds between bursts")
+    parser.add_argument("--alert-rate", type=float, default=0.0, help="alerts per second")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for device IDs and values")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,957 @@
-artHQ Event Stream API Client
+"""
+SmartHQ Event Stream API Client
 
-Implements the SmartHQ Event Stream API (AsyncAPI 2.60 for real-time
+Implements the SmartHQ Event Stream API (AsyncAPI 2.6.0) for real-time
 appliance control and monitoring.
-"
+"""
 
 import asyncio
 import json
 import logging
 import ssl
+import sys
+import time
 import websockets
-from typing import Any, Dict, List, Optional, Callable, Set
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Deque, Dict, Iterable, List, Optional, Callable, Set, Tuple, Type, Union
 from dataclasses import dataclass, field
-from enum import Enum
+from enum import Enum, IntEnum
 import uuid
 from datetime import datetime, timedelta
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional speedup
+    msgspec = None
+
+from capture import FrameRecorder
+from energy import EnergyAggregator
+from history import HistoryStore
+from metrics import FAST_LATENCY_BUCKETS, LatencyHistogram, MetricsWriter, labelled
+
 logger = logging.getLogger(__name__)
 
+# Default number of (version, entity) entries kept for delta queries
+DEFAULT_CHANGELOG_SIZE = 10000
+
+# Seconds the appliance is given to acknowledge a command (the ackTimeout field)
+DEFAULT_ACK_TIMEOUT = 10
+
+# Extra seconds allowed on top of ackTimeout for the result to reach us
+ACK_GRACE_PERIOD = 2.0
+
+# Seconds a command may wait in the send queue (e.g. across a reconnect) before timing out
+DEFAULT_COMMAND_QUEUE_TIMEOUT = 60.0
+
+# Seconds without any inbound frame before the connection is probed with a ping
+DEFAULT_HEARTBEAT_INTERVAL = 60.0
+
+# Consecutive unanswered pings after which the connection is considered dead
+DEFAULT_MISSED_PONG_LIMIT = 2
+
+# Bounds (seconds) of the pong timeout, which otherwise follows the measured RTT
+MIN_PONG_TIMEOUT = 2.0
+MAX_PONG_TIMEOUT = 15.0
+
+# Backoff (seconds) between reconnection attempts after the first, immediate one
+DEFAULT_RECONNECT_INTERVAL = 5.0
+MAX_RECONNECT_INTERVAL = 300.0
+
+# Seconds allowed for the closing handshake of a dead connection
+CLOSE_TIMEOUT = 2.0
+
+# Seconds to wait for the reply to an API request sent over the WebSocket
+API_REQUEST_TIMEOUT = 30.0
+
+# Digital twin API paths used to reconcile the registry after a reconnect
+DEVICE_LIST_PATH = "/v2/device"
+DEVICE_PATH = "/v2/device/{device_id}"
+
+# Decodes one WebSocket frame (str or bytes) into a message dict
+Decoder = Callable[[Union[str, bytes]], Any]
+
+# Exceptions raised by the available decoders for malformed frames
+DECODE_ERRORS: Tuple[Type[Exception], ...] = (ValueError,)
+if msgspec is not None:
+    DECODE_ERRORS += (msgspec.DecodeError,)
+
+# Encodes one outbound message dict into a text WebSocket frame
+Encoder = Callable[[Dict[str, Any]], str]
+
+# An ISO 8601 string as received, or the datetime it parses to once read
+Timestamp = Union[str, datetime, None]
+
+
+def default_decoder() -> Decoder:
+    """Pick the fastest available JSON decoder (orjson, msgspec, then json)"""
+    if orjson is not None:
+        return orjson.loads
+    if msgspec is not None:
+        return msgspec.json.Decoder().decode
+    return json.loads
+
+
+def default_encoder() -> Encoder:
+    """Pick the fastest available JSON encoder producing text frames"""
+    if orjson is not None:
+        return lambda message: orjson.dumps(message).decode()
+    return json.dumps
+
+
+def parse_timestamp(value: Timestamp) -> Optional[datetime]:
+    """Parse an ISO 8601 timestamp, accepting a trailing Z"""
+    if value is None or isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning(f"Invalid timestamp: {value}")
+        return None
+
+
+def format_timestamp(value: Timestamp) -> Optional[str]:
+    """Format a timestamp as ISO 8601 without parsing it if still a string"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value or None
+
 
 class ServiceType(Enum):
-    rtHQ service types from the AsyncAPI spec"
+    """SmartHQ service types from the AsyncAPI spec"""
     TEMPERATURE = "cloud.smarthq.service.temperature"
     TOGGLE = "cloud.smarthq.service.toggle"
     MODE = "cloud.smarthq.service.mode"
     METER = "cloud.smarthq.service.meter"
     CYCLE_TIMER = "cloud.smarthq.service.cycletimer"
     INTEGER = "cloud.smarthq.service.integer"
-    STRING = "cloud.smarthq.service.string PROVIDER = "cloud.smarthq.service.provider"
+    STRING = "cloud.smarthq.service.string"
+    PROVIDER = "cloud.smarthq.service.provider"
     COLOR = "cloud.smarthq.service.color"
     TRIGGER = "cloud.smarthq.service.trigger"
-    COOKING_STATE_V1ud.smarthq.service.cooking.state.v1    COOKING_MODE_V1ud.smarthq.service.cooking.mode.v1   COOKING_HISTORY = "cloud.smarthq.service.cooking.history    COOKING_BURNER_STATUS_V1ud.smarthq.service.cooking.burner.status.v1
-    THERMOSTAT_V1ud.smarthq.service.thermostat.v1
-    FIRMWARE_V1ud.smarthq.service.firmware.v1    LAUNDRY_COMMERCIAL_V1ud.smarthq.service.laundry.commercial.v1
+    COOKING_STATE_V1 = "cloud.smarthq.service.cooking.state.v1"
+    COOKING_MODE_V1 = "cloud.smarthq.service.cooking.mode.v1"
+    COOKING_HISTORY = "cloud.smarthq.service.cooking.history"
+    COOKING_BURNER_STATUS_V1 = "cloud.smarthq.service.cooking.burner.status.v1"
+    THERMOSTAT_V1 = "cloud.smarthq.service.thermostat.v1"
+    FIRMWARE_V1 = "cloud.smarthq.service.firmware.v1"
+    LAUNDRY_COMMERCIAL_V1 = "cloud.smarthq.service.laundry.commercial.v1"
+
+
 class MessageKind(Enum):
-  Message kinds from the AsyncAPI spec"    WEBSOCKET_PONG =websocket#pong"
+    """Message kinds from the AsyncAPI spec"""
+    WEBSOCKET_PONG = "websocket#pong"
     WEBSOCKET_CONNECTION = "websocket#connection"
-    COMMAND = command  PRESENCE = presence"
-    DEVICE = device"
+    COMMAND = "command"
+    WEBSOCKET_API = "websocket#api"
+    PRESENCE = "presence"
+    DEVICE = "device"
     ALERT = "alert"
-    SERVICE =pubsub#service"
-    WEBSOCKET_PING =websocket#ping"
-    WEBSOCKET_PUBSUB =websocket#pubsub"
-    USER_PUBSUB =user#pubsub"
+    SERVICE = "pubsub#service"
+    WEBSOCKET_PING = "websocket#ping"
+    WEBSOCKET_PUBSUB = "websocket#pubsub"
+    USER_PUBSUB = "user#pubsub"
 
 
-@dataclass
+def _intern_keys(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a dict with interned keys so repeated payloads share key strings"""
+    return {sys.intern(key): value for key, value in data.items()}
+
+
+def _intern_config(value: Any) -> Any:
+    """Recursively intern keys and string values of a (mostly static) config payload"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(key): _intern_config(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_intern_config(item) for item in value]
+    return value
+
+
+class ServiceState:
+    """
+    Typed service state
+    
+    Subclasses map well-known state keys of one ServiceType onto slotted
+    attributes; keys they do not model are kept in ``extra``. The base class
+    is used as-is for service types without a typed model.
+    """
+    __slots__ = ("extra",)
+    FIELDS: Tuple[Tuple[str, str], ...] = ()  # (attribute, wire key)
+    PRIMARY: Optional[str] = None  # attribute holding the headline numeric value
+    
+    extra: Optional[Dict[str, Any]]
+    
+    def primary_value(self) -> Optional[float]:
+        """Headline numeric value of the state, if the model has one"""
+        if self.PRIMARY is None:
+            return None
+        value = getattr(self, self.PRIMARY)
+        return value if isinstance(value, (int, float)) else None
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ServiceState":
+        """Parse a raw state payload"""
+        state = cls.__new__(cls)
+        for attribute, key in cls.FIELDS:
+            setattr(state, attribute, data.get(key))
+        
+        known = _STATE_KEYS[cls]
+        extra = {sys.intern(key): value for key, value in data.items() if key not in known}
+        state.extra = extra or None
+        return state
+    
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.extra == other.extra and all(
+            getattr(self, attribute) == getattr(other, attribute) for attribute, _ in self.FIELDS
+        )
+    
+    __hash__ = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Rebuild the raw state payload"""
+        result = {}
+        for attribute, key in self.FIELDS:
+            value = getattr(self, attribute)
+            if value is not None:
+                result[key] = value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+
+class TemperatureState(ServiceState):
+    """State of a cloud.smarthq.service.temperature service"""
+    __slots__ = ("celsius", "fahrenheit", "celsius_converted", "fahrenheit_converted", "disabled")
+    FIELDS = (
+        ("celsius", "celsius"),
+        ("fahrenheit", "fahrenheit"),
+        ("celsius_converted", "celsiusConverted"),
+        ("fahrenheit_converted", "fahrenheitConverted"),
+        ("disabled", "disabled"),
+    )
+    PRIMARY = "celsius"
+    
+    celsius: Optional[float]
+    fahrenheit: Optional[float]
+    celsius_converted: Optional[float]
+    fahrenheit_converted: Optional[float]
+    disabled: Optional[bool]
+
+
+class ToggleState(ServiceState):
+    """State of a cloud.smarthq.service.toggle service"""
+    __slots__ = ("on", "disabled")
+    FIELDS = (
+        ("on", "on"),
+        ("disabled", "disabled"),
+    )
+    
+    on: Optional[bool]
+    disabled: Optional[bool]
+
+
+class ModeState(ServiceState):
+    """State of a cloud.smarthq.service.mode service"""
+    __slots__ = ("mode", "disabled")
+    FIELDS = (
+        ("mode", "mode"),
+        ("disabled", "disabled"),
+    )
+    
+    mode: Optional[str]
+    disabled: Optional[bool]
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ModeState":
+        """Parse a raw state payload, interning the (enumerated) mode string"""
+        state = super().from_dict(data)
+        if isinstance(state.mode, str):
+            state.mode = sys.intern(state.mode)
+        return state
+
+
+class MeterState(ServiceState):
+    """State of a cloud.smarthq.service.meter service"""
+    __slots__ = ("meter_value", "meter_value_delta", "update_frequency_seconds", "disabled")
+    FIELDS = (
+        ("meter_value", "meterValue"),
+        ("meter_value_delta", "meterValueDelta"),
+        ("update_frequency_seconds", "updateFrequencySeconds"),
+        ("disabled", "disabled"),
+    )
+    PRIMARY = "meter_value"
+    
+    meter_value: Optional[float]
+    meter_value_delta: Optional[float]
+    update_frequency_seconds: Optional[int]
+    disabled: Optional[bool]
+
+
+class CycleTimerState(ServiceState):
+    """State of a cloud.smarthq.service.cycletimer service"""
+    __slots__ = ("seconds_remaining", "seconds_initial", "paused", "disabled")
+    FIELDS = (
+        ("seconds_remaining", "secondsRemaining"),
+        ("seconds_initial", "secondsInitial"),
+        ("paused", "paused"),
+        ("disabled", "disabled"),
+    )
+    PRIMARY = "seconds_remaining"
+    
+    seconds_remaining: Optional[int]
+    seconds_initial: Optional[int]
+    paused: Optional[bool]
+    disabled: Optional[bool]
+
+
+# Normalized unit of each meterUnits value of a meter service's config
+METER_UNITS: Dict[str, str] = {
+    "cloud.smarthq.type.meterunits.kwh": "kWh",
+    "cloud.smarthq.type.meterunits.kw": "kW",
+    "cloud.smarthq.type.meterunits.amps": "A",
+    "cloud.smarthq.type.meterunits.volts": "V",
+    "cloud.smarthq.type.meterunits.gallons": "gal",
+    "cloud.smarthq.type.meterunits.liters": "L",
+}
+
+
+def meter_unit(config: Dict[str, Any]) -> Optional[str]:
+    """Normalized unit of a meter service, from its config"""
+    units = config.get("meterUnits")
+    if not units:
+        return None
+    return METER_UNITS.get(units, units.split(".")[-1])
+
+
+# Service types whose primary value is recorded in the history store by default
+DEFAULT_HISTORY_TYPES = frozenset({ServiceType.TEMPERATURE, ServiceType.METER})
+
+# Typed state model per service type; anything else uses the generic ServiceState
+STATE_TYPES: Dict[ServiceType, Type[ServiceState]] = {
+    ServiceType.TEMPERATURE: TemperatureState,
+    ServiceType.TOGGLE: ToggleState,
+    ServiceType.MODE: ModeState,
+    ServiceType.METER: MeterState,
+    ServiceType.CYCLE_TIMER: CycleTimerState,
+}
+
+_STATE_KEYS: Dict[Type[ServiceState], frozenset] = {
+    state_type: frozenset(key for _, key in state_type.FIELDS)
+    for state_type in (ServiceState, *STATE_TYPES.values())
+}
+
+
+def parse_service_state(service_type: ServiceType, data: Dict[str, Any]) -> ServiceState:
+    """Parse a raw state payload into the typed model for its service type"""
+    return STATE_TYPES.get(service_type, ServiceState).from_dict(data)
+
+
+@dataclass(slots=True)
 class SmartHQDevice:
- Represents a SmartHQ device/appliance    device_id: str
+    """Represents a SmartHQ device/appliance"""
+    device_id: str
     device_type: str
     name: str
-    services: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    service_ids: Set[str] = field(default_factory=set)  # shared with the client's device index
     online: bool = False
     last_seen: Optional[datetime] = None
+    stale: bool = False  # restored from a snapshot, not yet confirmed by the cloud
+    last_sync: Optional[str] = None  # cloud lastSyncTime the services were last reconciled at
+    
+    def to_message(self) -> Dict[str, Any]:
+        """Rebuild the device message for this device, with its presence"""
+        return {
+            "kind": MessageKind.DEVICE.value,
+            "deviceId": self.device_id,
+            "deviceType": self.device_type,
+            "name": self.name,
+            "online": self.online,
+            "lastSeen": format_timestamp(self.last_seen),
+            "lastSyncTime": self.last_sync,
+        }
 
 
-@dataclass
+@dataclass(slots=True)
 class SmartHQService:
- Represents a SmartHQ service   service_id: str
+    """Represents a SmartHQ service"""
+    service_id: str
     service_type: ServiceType
     domain_type: str
     device_id: str
-    state: Dict[str, Any]
+    typed_state: ServiceState
     config: Dict[str, Any]
-    supported_commands: List[str]
-    last_sync_time: datetime
-    last_state_time: datetime
+    supported_commands: Tuple[str, ...]
+    last_sync_raw: Timestamp  # parsed lazily by last_sync_time
+    last_state_raw: Timestamp  # parsed lazily by last_state_time
+    stale: bool = False  # restored from a snapshot, not yet confirmed by the cloud
+    
+    @property
+    def last_sync_time(self) -> Optional[datetime]:
+        """Time of the last cloud sync, parsed on first read"""
+        if isinstance(self.last_sync_raw, str):
+            self.last_sync_raw = parse_timestamp(self.last_sync_raw)
+        return self.last_sync_raw
+    
+    @property
+    def last_state_time(self) -> Optional[datetime]:
+        """Time of the last state change, parsed on first read"""
+        if isinstance(self.last_state_raw, str):
+            self.last_state_raw = parse_timestamp(self.last_state_raw)
+        return self.last_state_raw
+    
+    @property
+    def state(self) -> Dict[str, Any]:
+        """Raw state payload, rebuilt from the typed state"""
+        return self.typed_state.to_dict()
+    
+    def to_message(self) -> Dict[str, Any]:
+        """Rebuild the pubsub#service message for this service"""
+        return {
+            "kind": MessageKind.SERVICE.value,
+            "serviceId": self.service_id,
+            "serviceType": self.service_type.value,
+            "domainType": self.domain_type,
+            "deviceId": self.device_id,
+            "state": self.state,
+            "config": self.config,
+            "supportedCommands": list(self.supported_commands),
+            "lastSyncTime": format_timestamp(self.last_sync_raw),
+            "lastStateTime": format_timestamp(self.last_state_raw),
+        }
+
+
+@dataclass
+class CoalescePolicy:
+    """How service_updated events of one ServiceType are coalesced"""
+    window: float  # seconds between deliveries for the same service
+    threshold: Optional[float] = None  # primary value change that bypasses the window
+
+
+class ServiceUpdateCoalescer:
+    """
+    Collapses bursts of service updates into at most one event per window
+    
+    The first update of a burst is delivered immediately. Later updates for
+    the same service within the window are held back, and only the latest
+    state is delivered when the window closes. An update whose primary value
+    moved by at least the policy threshold since the last delivery bypasses
+    the window. Service types without a policy are always delivered at once.
+    """
+    
+    def __init__(
+        self,
+        policies: Dict[ServiceType, CoalescePolicy],
+        lookup: Callable[[str], Optional["SmartHQService"]],
+        deliver: Callable[["SmartHQService"], Awaitable[None]],
+    ):
+        self.policies = policies
+        self._lookup = lookup
+        self._deliver = deliver
+        self._last_delivery: Dict[str, Tuple[float, Optional[float]]] = {}  # service id -> (time, value)
+        self._pending: Dict[str, asyncio.TimerHandle] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.delivered = 0
+        self.coalesced = 0
+    
+    async def submit(self, service: "SmartHQService"):
+        """Deliver a service update now or hold it for the end of its window"""
+        policy = self.policies.get(service.service_type)
+        if policy is None or policy.window <= 0:
+            await self._deliver_now(service)
+            return
+        
+        service_id = service.service_id
+        now = time.monotonic()
+        last = self._last_delivery.get(service_id)
+        
+        if (
+            last is None
+            or (service_id not in self._pending and now - last[0] >= policy.window)
+            or self._exceeds_threshold(policy, service, last[1])
+        ):
+            await self._deliver_now(service)
+            return
+        
+        self.coalesced += 1
+        if service_id not in self._pending:
+            delay = max(last[0] + policy.window - now, 0)
+            self._pending[service_id] = asyncio.get_running_loop().call_later(
+                delay, self._schedule_flush, service_id
+            )
+    
+    def discard(self, service_id: str):
+        """Forget a service, dropping any held update"""
+        handle = self._pending.pop(service_id, None)
+        if handle:
+            handle.cancel()
+        self._last_delivery.pop(service_id, None)
+    
+    def close(self):
+        """Drop all held updates"""
+        for handle in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
+        for task in self._flush_tasks:
+            task.cancel()
+    
+    @staticmethod
+    def _exceeds_threshold(policy: CoalescePolicy, service: "SmartHQService", last_value: Optional[float]) -> bool:
+        """Check whether the primary value moved far enough to skip the window"""
+        if policy.threshold is None:
+            return False
+        value = service.typed_state.primary_value()
+        if value is None or last_value is None:
+            return value is not last_value
+        return abs(value - last_value) >= policy.threshold
+    
+    async def _deliver_now(self, service: "SmartHQService"):
+        """Deliver an update and restart its window"""
+        handle = self._pending.pop(service.service_id, None)
+        if handle:
+            handle.cancel()
+        self._last_delivery[service.service_id] = (time.monotonic(), service.typed_state.primary_value())
+        self.delivered += 1
+        await self._deliver(service)
+    
+    def _schedule_flush(self, service_id: str):
+        """Timer callback delivering the latest state at the end of a window"""
+        self._pending.pop(service_id, None)
+        service = self._lookup(service_id)
+        if service is None:
+            return
+        task = asyncio.create_task(self._deliver_now(service))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+
+class HandlerMode(Enum):
+    """How SmartHQClient runs event handlers"""
+    INLINE = "inline"  # awaited one by one inside the receive loop
+    CONCURRENT = "concurrent"  # queued per handler, run by background workers
+
+
+class EventDispatcher:
+    """
+    Runs event handlers for SmartHQClient
+    
+    In inline mode handlers are awaited one after another, as before. In
+    concurrent mode every handler gets its own set of bounded lanes, each
+    drained by a worker task, so a slow handler only delays itself. Events
+    are assigned to a lane by ordering key (the device ID), which keeps each
+    handler's view of a single device in order. When a lane is full the
+    caller waits, pushing backpressure onto the receive loop instead of
+    buffering without limit. Sync handlers can be offloaded to a thread pool
+    in either mode.
+    """
+    
+    def __init__(
+        self,
+        mode: HandlerMode = HandlerMode.INLINE,
+        lanes: int = 4,
+        queue_size: int = 1000,
+        offload_sync: bool = False,
+    ):
+        self.mode = mode
+        self.lanes = max(lanes, 1)
+        self.queue_size = queue_size
+        self.offload_sync = offload_sync
+        self._queues: Dict[Tuple[Callable, int], asyncio.Queue] = {}
+        self._workers: Dict[Tuple[Callable, int], asyncio.Task] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        
+        # Backpressure metrics
+        self.dispatched = 0
+        self.failed = 0
+        self.latency: Dict[str, LatencyHistogram] = {}  # handler run time, per event
+        self.max_depth = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+    
+    async def dispatch(self, event: str, handlers: List[Callable], args: Tuple, kwargs: Dict[str, Any], key: Optional[str] = None):
+        """Run or enqueue every handler for one event"""
+        if self.mode is HandlerMode.INLINE:
+            for handler in handlers:
+                await self._run(event, handler, args, kwargs)
+            return
+        
+        lane = hash(key) % self.lanes if key is not None else 0
+        for handler in handlers:
+            queue = self._lane_queue(handler, lane)
+            item = (event, handler, args, kwargs)
+            if queue.full():
+                self.blocked_puts += 1
+                started = time.monotonic()
+                await queue.put(item)
+                self.blocked_seconds += time.monotonic() - started
+            else:
+                queue.put_nowait(item)
+            self.max_depth = max(self.max_depth, queue.qsize())
+    
+    def forget(self, handler: Callable):
+        """Stop the workers of a removed handler"""
+        for lane_key in [lane_key for lane_key in self._workers if lane_key[0] == handler]:
+            self._workers.pop(lane_key).cancel()
+            self._queues.pop(lane_key, None)
+    
+    async def drain(self):
+        """Wait until every queued handler call has finished"""
+        await asyncio.gather(*(queue.join() for queue in list(self._queues.values())))
+    
+    async def aclose(self, timeout: float = 5.0):
+        """Drain queued calls (up to a timeout), then stop workers and the thread pool"""
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out draining event handler queues")
+        
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._queues.clear()
+        
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and backpressure counters"""
+        return {
+            "mode": self.mode.value,
+            "queues": len(self._queues),
+            "queued": sum(queue.qsize() for queue in self._queues.values()),
+            "max_depth": self.max_depth,
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+            "blocked_puts": self.blocked_puts,
+            "blocked_seconds": round(self.blocked_seconds, 3),
+        }
+    
+    def _lane_queue(self, handler: Callable, lane: int) -> asyncio.Queue:
+        """Get (or start) the queue and worker of one handler lane"""
+        lane_key = (handler, lane)
+        queue = self._queues.get(lane_key)
+        if queue is None:
+            queue = self._queues[lane_key] = asyncio.Queue(maxsize=self.queue_size)
+            self._workers[lane_key] = asyncio.create_task(self._worker(queue))
+        return queue
+    
+    async def _worker(self, queue: asyncio.Queue):
+        """Run queued handler calls of one lane in order"""
+        while True:
+            event, handler, args, kwargs = await queue.get()
+            try:
+                await self._run(event, handler, args, kwargs)
+            finally:
+                queue.task_done()
+    
+    async def _run(self, event: str, handler: Callable, args: Tuple, kwargs: Dict[str, Any]):
+        """Run a single handler, logging (not raising) its errors"""
+        self.dispatched += 1
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                await handler(*args, **kwargs)
+            elif self.offload_sync:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="smarthq-handler")
+                await asyncio.get_running_loop().run_in_executor(self._executor, partial(handler, *args, **kwargs))
+            else:
+                handler(*args, **kwargs)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error in event handler for {event}: {e}")
+        finally:
+            labelled(self.latency, event, FAST_LATENCY_BUCKETS).observe(time.perf_counter() - started)
+
+
+class OverflowPolicy(Enum):
+    """What the ingest queue does with a frame when it is full"""
+    BLOCK = "block"  # wait for room, pausing the socket reader
+    DROP_OLDEST = "drop_oldest"  # evict the oldest droppable frame (or this one)
+    NEVER_DROP = "never_drop"  # admit beyond capacity rather than delay or lose it
+
+
+# Overflow policy per message kind or service type; anything else blocks
+DEFAULT_OVERFLOW_POLICIES: Dict[str, OverflowPolicy] = {
+    ServiceType.METER.value: OverflowPolicy.DROP_OLDEST,
+    MessageKind.COMMAND.value: OverflowPolicy.NEVER_DROP,
+    MessageKind.WEBSOCKET_API.value: OverflowPolicy.NEVER_DROP,
+    MessageKind.ALERT.value: OverflowPolicy.NEVER_DROP,
+}
+
+# Control frames handled directly by the socket reader, never queued
+INLINE_KINDS = frozenset({
+    MessageKind.WEBSOCKET_PONG.value,
+    MessageKind.WEBSOCKET_CONNECTION.value,
+})
+
+
+class IngestQueue:
+    """Bounded FIFO of decoded frames that applies an overflow policy per frame"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 1)
+        self._items: Deque[Tuple[Dict[str, Any], OverflowPolicy]] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        # Frames queued or being handled; join() waits for it to reach zero
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+        self.max_depth = 0
+        self.dropped = 0
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    async def put(self, data: Dict[str, Any], policy: OverflowPolicy):
+        """Enqueue a frame, honouring its overflow policy when full"""
+        while len(self._items) >= self.capacity:
+            if policy is OverflowPolicy.NEVER_DROP:
+                break
+            if policy is OverflowPolicy.DROP_OLDEST:
+                if not self._evict_droppable():
+                    # Only undroppable frames queued; this one is the oldest droppable
+                    self.dropped += 1
+                    return
+                break
+            self._not_full.clear()
+            await self._not_full.wait()
+        
+        self._items.append((data, policy))
+        self._unfinished += 1
+        self._finished.clear()
+        self.max_depth = max(self.max_depth, len(self._items))
+        self._not_empty.set()
+    
+    async def get(self) -> Dict[str, Any]:
+        """Dequeue the next frame, waiting for one if necessary"""
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        
+        data, _ = self._items.popleft()
+        if len(self._items) < self.capacity:
+            self._not_full.set()
+        return data
+    
+    def task_done(self):
+        """Mark a frame returned by get() as handled"""
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._finished.set()
+    
+    async def join(self):
+        """Wait until every queued frame has been handled or dropped"""
+        await self._finished.wait()
+    
+    def _evict_droppable(self) -> bool:
+        """Drop the oldest DROP_OLDEST frame, if any"""
+        for index, (_, policy) in enumerate(self._items):
+            if policy is OverflowPolicy.DROP_OLDEST:
+                del self._items[index]
+                self.dropped += 1
+                self.task_done()
+                return True
+        return False
+
+
+class CommandStatus(Enum):
+    """Outcome of a tracked command"""
+    ACKNOWLEDGED = "acknowledged"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+
+
+@dataclass(slots=True)
+class DeviceCommand:
+    """A command addressed to a device"""
+    device_id: str
+    command: str
+    data: List[Any] = field(default_factory=list)
+    ack_timeout: int = DEFAULT_ACK_TIMEOUT
+
+
+@dataclass(slots=True)
+class CommandResult:
+    """Outcome of a command, correlated with its request by message id"""
+    command_id: str
+    device_id: str
+    command: str
+    status: CommandStatus
+    latency: Optional[float] = None  # seconds from send to result
+    response: Optional[Dict[str, Any]] = None
+    
+    @property
+    def success(self) -> bool:
+        return self.status is CommandStatus.ACKNOWLEDGED
+
+
+@dataclass(slots=True)
+class PendingCommand:
+    """A sent command awaiting its result"""
+    device_id: str
+    command: str
+    sent_at: float
+    future: asyncio.Future
+    ack_timeout: int = DEFAULT_ACK_TIMEOUT
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+# Result outcomes reported by SmartHQ that mean the command was not applied
+_FAILED_OUTCOMES = frozenset({"failure", "failed", "error", "rejected", "timeout"})
+
+
+def _command_succeeded(data: Dict[str, Any]) -> bool:
+    """Whether a command result message reports success"""
+    if "success" in data:
+        return bool(data["success"])
+    outcome = data.get("outcome") or data.get("status")
+    if isinstance(outcome, str) and outcome.lower() in _FAILED_OUTCOMES:
+        return False
+    code = data.get("code")
+    return not (isinstance(code, int) and code >= 400)
+
+
+class SendPriority(IntEnum):
+    """Outbound frame priority; lower values are written first"""
+    CONTROL = 0  # ping, pubsub configuration
+    COMMAND = 1
+    BULK = 2  # refreshes and other bulk requests
+
+
+@dataclass(slots=True)
+class OutboundFrame:
+    """An encoded frame waiting for the writer task"""
+    frame: str
+    priority: SendPriority
+    command_id: Optional[str] = None  # commands survive reconnects and are retried
+    written: Optional[asyncio.Future] = None  # set once the frame is on the wire
+
+
+class TokenBucket:
+    """Token-bucket rate limiter; a rate of 0 disables limiting"""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+    
+    async def acquire(self):
+        """Take one token, waiting for the bucket to refill if it is empty"""
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            delay = (1 - self._tokens) / self.rate
+            self.throttled += 1
+            self.throttled_seconds += delay
+            await asyncio.sleep(delay)
+
+
+class RttEstimator:
+    """Smoothed ping round-trip time and the pong timeout derived from it (as for TCP's RTO)"""
+    
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.smoothed: Optional[float] = None
+        self.variance = 0.0
+        self.last: Optional[float] = None
+    
+    def observe(self, rtt: float):
+        """Record one round trip"""
+        self.histogram.observe(rtt)
+        self.last = rtt
+        if self.smoothed is None:
+            self.smoothed = rtt
+            self.variance = rtt / 2
+        else:
+            self.variance = 0.75 * self.variance + 0.25 * abs(self.smoothed - rtt)
+            self.smoothed = 0.875 * self.smoothed + 0.125 * rtt
+    
+    def timeout(self) -> float:
+        """Seconds to wait for a pong before counting it as missed"""
+        if self.smoothed is None:
+            return MAX_PONG_TIMEOUT
+        return min(max(self.smoothed + 4 * self.variance, MIN_PONG_TIMEOUT), MAX_PONG_TIMEOUT)
+
+
+def _ordering_key(args: Tuple) -> Optional[str]:
+    """Device ID an event relates to, used to keep per-device ordering"""
+    if not args:
+        return None
+    subject = args[0]
+    if isinstance(subject, (SmartHQDevice, SmartHQService)):
+        return subject.device_id
+    if isinstance(subject, str):
+        return subject
+    if isinstance(subject, dict):
+        return subject.get("deviceId")
+    return None
 
 
 class SmartHQClient:
- 
+    """
     SmartHQ Event Stream API Client
     
     Implements the AsyncAPI specification for real-time appliance control
     and monitoring via WebSocket connections.
+    """
      
     def __init__(
         self,
         username: str,
         password: str,
-        region: str = US
-        websocket_url: str = wss://ws-us-west-2rthq.com",
+        region: str = "US",
+        websocket_url: str = "wss://ws-us-west-2.mysmarthq.com",
         enable_alerts: bool = True,
         enable_services: bool = True,
         enable_presence: bool = True,
         enable_commands: bool = True,
+        changelog_size: int = DEFAULT_CHANGELOG_SIZE,
+        decoder: Optional[Decoder] = None,
+        encoder: Optional[Encoder] = None,
+        coalesce_policies: Optional[Dict[ServiceType, CoalescePolicy]] = None,
+        handler_mode: HandlerMode = HandlerMode.INLINE,
+        handler_lanes: int = 4,
+        handler_queue_size: int = 1000,
+        offload_sync_handlers: bool = False,
+        ingest_workers: int = 1,
+        ingest_queue_size: int = 1000,
+        overflow_policies: Optional[Dict[str, OverflowPolicy]] = None,
+        send_rate: float = 10.0,
+        send_burst: int = 20,
+        command_queue_timeout: float = DEFAULT_COMMAND_QUEUE_TIMEOUT,
+        history: Optional[HistoryStore] = None,
+        history_types: Optional[Set[ServiceType]] = None,
+        energy: Optional[EnergyAggregator] = None,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        missed_pong_limit: int = DEFAULT_MISSED_PONG_LIMIT,
+        reconnect_interval: float = DEFAULT_RECONNECT_INTERVAL,
+        reconcile_on_reconnect: bool = True,
+        capture_path: Optional[str] = None,
     ):
         self.username = username
         self.password = password
@@ -93,56 +961,166 @@ class SmartHQClient:
         self.enable_services = enable_services
         self.enable_presence = enable_presence
         self.enable_commands = enable_commands
+        self.decoder = decoder or default_decoder()
+        self.encoder = encoder or default_encoder()
         
         # Connection state
         self.websocket: Optional[websockets.WebSocketServerProtocol] = None
-        self.connected = false       self.access_token: Optional[str] = None
+        self.connected = False
+        self.access_token: Optional[str] = None
         self.user_id: Optional[str] = None
         
         # Device and service tracking
         self.devices: Dict[str, SmartHQDevice] = {}
         self.services: Dict[str, SmartHQService] = {}
         
+        # Secondary indexes, maintained incrementally by the message handlers
+        self._services_by_device: Dict[str, Set[str]] = {}
+        self._devices_by_type: Dict[str, Set[str]] = {}
+        self._services_by_type: Dict[ServiceType, Set[str]] = {}
+        
+        # Monotonic registry version, bumped on every device/service/presence change.
+        # The epoch distinguishes versions across client instances (e.g. restarts).
+        self.state_epoch = uuid.uuid4().hex[:8]
+        self.state_version = 0
+        
+        # Ring buffer of (version, entity kind, entity id), one entry per version
+        self._changelog: Deque[Tuple[int, str, str]] = deque(maxlen=changelog_size)
+        
         # Event handlers
         self.event_handlers: Dict[str, List[Callable]] = {
-         device_added:          device_updated:          device_removed:          service_updated:           alert_received:
-           presence_changed:         command_result:       connected:,
-         disconnected": [],
+            "device_added": [],
+            "device_updated": [],
+            "device_removed": [],
+            "service_updated": [],
+            "service_removed": [],
+            "alert_received": [],
+            "presence_changed": [],
+            "command_result": [],
+            "connected": [],
+            "disconnected": [],
+        }
+        self.dispatcher = EventDispatcher(
+            mode=handler_mode,
+            lanes=handler_lanes,
+            queue_size=handler_queue_size,
+            offload_sync=offload_sync_handlers,
+        )
+        
+        # Time series of primary values (e.g. celsius, meterValue) per service
+        self.history = history
+        self.history_types = history_types if history_types is not None else DEFAULT_HISTORY_TYPES
+        
+        # Energy readings of kWh/kW meters, for fleet-wide rollups
+        self.energy = energy
+        
+        # Rate limiting of service_updated events
+        self.coalescer = ServiceUpdateCoalescer(
+            coalesce_policies or {},
+            self.services.get,
+            lambda service: self._trigger_event("service_updated", service),
+        )
+        
+        # Inbound message dispatch, keyed by message kind
+        self._message_handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+            MessageKind.WEBSOCKET_PONG.value: self._handle_pong,
+            MessageKind.WEBSOCKET_CONNECTION.value: self._handle_connection_response,
+            MessageKind.COMMAND.value: self._handle_command_message,
+            MessageKind.WEBSOCKET_API.value: self._handle_api_response,
+            MessageKind.PRESENCE.value: self._handle_presence_message,
+            MessageKind.DEVICE.value: self._handle_device_message,
+            MessageKind.ALERT.value: self._handle_alert_message,
+            MessageKind.SERVICE.value: self._handle_service_message,
         }
         
+        # Optional recording of every raw inbound frame, for offline replay
+        self.recorder = FrameRecorder(capture_path) if capture_path else None
+        
+        # Inbound counters and timings, per message kind
+        self.messages_received: Dict[str, int] = {}
+        self.decode_errors = 0
+        self.decode_latency = LatencyHistogram(FAST_LATENCY_BUCKETS)
+        self.handle_latency: Dict[str, LatencyHistogram] = {}
+        
+        # Inbound pipeline: the socket reader feeds one bounded queue per worker;
+        # frames are routed by device so each device is handled in order.
+        # With no workers, frames are handled inline by the reader.
+        self.overflow_policies = overflow_policies if overflow_policies is not None else DEFAULT_OVERFLOW_POLICIES
+        self._ingest_queues: List[IngestQueue] = [IngestQueue(ingest_queue_size) for _ in range(ingest_workers)]
+        self._ingest_tasks: List[asyncio.Task] = []
+        
+        # Sent commands awaiting their result, keyed by message id
+        self._pending_commands: Dict[str, PendingCommand] = {}
+        self.command_latency = LatencyHistogram()
+        self.command_outcomes: Dict[CommandStatus, int] = {status: 0 for status in CommandStatus}
+        self.command_queue_timeout = command_queue_timeout
+        
+        # Outbound pipeline: every frame goes through one writer task, in priority
+        # order and under the rate limit. The queue outlives the connection so
+        # queued commands are sent once reconnected.
+        self._send_queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._send_seq = 0
+        self._send_limiter = TokenBucket(send_rate, send_burst)
+        self._writer_task: Optional[asyncio.Task] = None
+        self.frames_sent = 0
+        self.commands_retried = 0
+        
+        # Liveness: the connection is pinged once idle for heartbeat_interval, and
+        # dropped after missed_pong_limit pings in a row go unanswered
+        self.heartbeat_interval = heartbeat_interval
+        self.missed_pong_limit = max(missed_pong_limit, 1)
+        self.rtt = RttEstimator()
+        self._pending_pings: Dict[str, Tuple[float, asyncio.Future]] = {}
+        self._last_received = time.monotonic()
+        self.missed_pongs = 0
+        self.pings_sent = 0
+        self.pongs_missed = 0
+        self.liveness_failures = 0
+        
+        # Replies awaited for API requests, keyed by message id
+        self._api_requests: Dict[str, asyncio.Future] = {}
+        
+        # Reconnects keep the registry and reconcile it against the cloud
+        self.reconcile_on_reconnect = reconcile_on_reconnect
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self.last_reconcile: Optional[Dict[str, Any]] = None
+        
         # Connection management
+        self.reconnect_interval = reconnect_interval
+        self.reconnects = 0
         self._reconnect_task: Optional[asyncio.Task] = None
         self._heartbeat_task: Optional[asyncio.Task] = None
         self._should_reconnect = True
         self._ssl_context = ssl.create_default_context()
         
     def add_event_handler(self, event: str, handler: Callable):
-     d an event handler""       if event in self.event_handlers:
+        """Add an event handler"""
+        if event in self.event_handlers:
             self.event_handlers[event].append(handler)
         else:
             logger.warning(f"Unknown event type: {event}")
     
     def remove_event_handler(self, event: str, handler: Callable):
-        e an event handler""       if event in self.event_handlers and handler in self.event_handlers[event]:
+        """Remove an event handler"""
+        if event in self.event_handlers and handler in self.event_handlers[event]:
             self.event_handlers[event].remove(handler)
+            if not any(handler in handlers for handlers in self.event_handlers.values()):
+                self.dispatcher.forget(handler)
     
     async def _trigger_event(self, event: str, *args, **kwargs):
-    igger all handlers for an event"""
-        for handler in self.event_handlers.get(event, []):
-            try:
-                if asyncio.iscoroutinefunction(handler):
-                    await handler(*args, **kwargs)
-                else:
-                    handler(*args, **kwargs)
-            except Exception as e:
-                logger.error(f"Error in event handler for {event}: {e}")
+        """Trigger all handlers for an event"""
+        handlers = self.event_handlers.get(event)
+        if handlers:
+            await self.dispatcher.dispatch(event, list(handlers), args, kwargs, key=_ordering_key(args))
     
     async def authenticate(self) -> bool:
-       Authenticate with SmartHQ and get access token
+        """
+        Authenticate with SmartHQ and get access token
         
-        This would typically involve OAuth2 flow with SmartHQs authentication
+        This would typically involve OAuth2 flow with SmartHQ's authentication
         endpoints. For now, we'll assume the access token is provided.
-         # TODO: Implement proper OAuth2 authentication flow
+        """
+        # TODO: Implement proper OAuth2 authentication flow
         # For now, we'll use a placeholder that would be replaced with
         # actual authentication logic
         try:
@@ -156,8 +1134,10 @@ class SmartHQClient:
             return False
     
     async def connect(self) -> bool:
-   Connect to SmartHQ WebSocket" if self.connected:
-            return true          
+        """Connect to SmartHQ WebSocket"""
+        if self.connected:
+            return True
+
         try:
             # Authenticate first
             if not await self.authenticate():
@@ -166,16 +1146,22 @@ class SmartHQClient:
             # Connect to WebSocket
             self.websocket = await websockets.connect(
                 self.websocket_url,
-                ssl=self._ssl_context,
+                ssl=self._ssl_context if self.websocket_url.startswith("wss://") else None,
                 extra_headers={
-                    Authorization": f"Bearer {self.access_token}" if self.access_token else                 }
+                    "Authorization": f"Bearer {self.access_token}" if self.access_token else ""
+                },
+                close_timeout=CLOSE_TIMEOUT,
             )
             
             self.connected = True
+            self._last_received = time.monotonic()
+            self.missed_pongs = 0
             logger.info("Connected to SmartHQ WebSocket")
             
+            self._start_writer()
+            
             # Start message processing
-            asyncio.create_task(self._process_messages())
+            asyncio.create_task(self._process_messages(self.websocket))
             
             # Configure subscriptions
             await self._configure_subscriptions()
@@ -184,235 +1170,1004 @@ class SmartHQClient:
             self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
             
             await self._trigger_event("connected")
-            return true          
+            
+            # Catch up on what changed while we were away (or since the snapshot)
+            if self.reconcile_on_reconnect and self.devices:
+                self._reconcile_task = asyncio.create_task(self.reconcile())
+            return True
+
         except Exception as e:
-            logger.error(fFailed to connect: {e}")
-            self.connected =false            return False
+            logger.error(f"Failed to connect: {e}")
+            self.connected = False
+            return False
     
     async def disconnect(self):
-        connect from SmartHQ WebSocket      self._should_reconnect = False
+        """Disconnect from SmartHQ WebSocket"""
+        self._should_reconnect = False
+        # Cleared first so the closing receive loop doesn't report the connection as lost
+        was_connected = self.connected
+        self.connected = False
         
-        if self._heartbeat_task:
-            self._heartbeat_task.cancel()
-            self._heartbeat_task = None
+        self._stop_heartbeat()
+        self._stop_reconcile()
+        
+        self.coalescer.close()
+        self._stop_ingest_workers()
+        if self.recorder:
+            self.recorder.close()
+        self._stop_writer()
+        self._cancel_pending_commands()
         
         if self.websocket:
             await self.websocket.close()
             self.websocket = None
         
-        self.connected = False
-        await self._trigger_event("disconnected")
-        logger.info(Disconnected from SmartHQ WebSocket")
+        if was_connected:
+            await self._trigger_event("disconnected")
+        await self.dispatcher.aclose()
+        logger.info("Disconnected from SmartHQ WebSocket")
     
     async def _configure_subscriptions(self):
-        vent subscriptions based on settings       config = {
-            kind":websocket#pubsub",
-           action": "pubsub",
-          pubsub True,
-           alerts": self.enable_alerts,
-          services": self.enable_services,
-          presence": self.enable_presence,
-          commands": self.enable_commands,
+        """Configure event subscriptions based on settings"""
+        config = {
+            "kind": "websocket#pubsub",
+            "action": "pubsub",
+            "pubsub": True,
+            "alerts": self.enable_alerts,
+            "services": self.enable_services,
+            "presence": self.enable_presence,
+            "commands": self.enable_commands,
         }
         
         await self._send_message(config)
         logger.info("Configured event subscriptions")
     
-    async def _send_message(self, message: Dict[str, Any]):
-       Senda message to SmartHQ       if not self.websocket or not self.connected:
+    async def _send_message(self, message: Dict[str, Any], priority: SendPriority = SendPriority.CONTROL):
+        """Send a message to SmartHQ, waiting until it has been written"""
+        if not self.websocket or not self.connected or not self._writer_task:
             raise ConnectionError("Not connected to SmartHQ")
         
-        try:
-            await self.websocket.send(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Failed to send message: {e}")
-            raise
+        written = asyncio.get_running_loop().create_future()
+        self._enqueue_frame(OutboundFrame(self.encoder(message), priority, written=written))
+        await written
+    
+    def _enqueue_frame(self, outbound: OutboundFrame, seq: Optional[int] = None):
+        """Queue a frame for the writer; seq preserves the original order on retry"""
+        if seq is None:
+            self._send_seq += 1
+            seq = self._send_seq
+        self._send_queue.put_nowait((outbound.priority, seq, outbound))
+    
+    def _start_writer(self):
+        """Start the writer task for the current connection"""
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+    
+    def _stop_writer(self):
+        """Stop the writer; queued commands are kept, other queued frames fail"""
+        if self._writer_task:
+            self._writer_task.cancel()
+            self._writer_task = None
+        
+        kept = []
+        while not self._send_queue.empty():
+            entry = self._send_queue.get_nowait()
+            outbound = entry[2]
+            if outbound.command_id:
+                kept.append(entry)
+            elif outbound.written and not outbound.written.done():
+                outbound.written.set_exception(ConnectionError("Connection to SmartHQ lost"))
+        for entry in kept:
+            self._send_queue.put_nowait(entry)
+    
+    async def _writer_loop(self):
+        """Write queued frames in priority order, under the rate limit"""
+        while True:
+            priority, seq, outbound = await self._send_queue.get()
+            if outbound.command_id and outbound.command_id not in self._pending_commands:
+                continue  # settled (timed out or cancelled) while queued
+            
+            try:
+                await self._send_limiter.acquire()
+                await self.websocket.send(outbound.frame)
+            except BaseException as e:
+                if outbound.command_id:
+                    # Retried once the connection is back
+                    self.commands_retried += 1
+                    self._enqueue_frame(outbound, seq)
+                elif outbound.written and not outbound.written.done():
+                    outbound.written.set_exception(
+                        e if isinstance(e, Exception) else ConnectionError("Connection to SmartHQ lost")
+                    )
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                logger.error(f"Failed to send message: {e}")
+                return
+            
+            self.frames_sent += 1
+            if outbound.written and not outbound.written.done():
+                outbound.written.set_result(None)
+            if outbound.command_id:
+                self._command_written(outbound.command_id)
+    
+    def send_stats(self) -> Dict[str, Any]:
+        """Outbound queue depth, rate limiting and retry counters"""
+        return {
+            "queued": self._send_queue.qsize(),
+            "sent": self.frames_sent,
+            "throttled": self._send_limiter.throttled,
+            "throttled_seconds": round(self._send_limiter.throttled_seconds, 3),
+            "commands_retried": self.commands_retried,
+        }
     
-    async def _process_messages(self):
-ocess incoming WebSocket messages"""
+    async def _process_messages(self, websocket):
+        """Process incoming WebSocket messages"""
+        self._start_ingest_workers()
         try:
-            async for message in self.websocket:
+            async for message in websocket:
+                self._last_received = time.monotonic()
+                if self.recorder:
+                    self.recorder.record(message, self._last_received)
                 try:
-                    data = json.loads(message)
-                    await self._handle_message(data)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Invalid JSON message: {e})            except Exception as e:
+                    started = time.perf_counter()
+                    data = self.decoder(message)
+                    self.decode_latency.observe(time.perf_counter() - started)
+                    await self._ingest(data)
+                except DECODE_ERRORS as e:
+                    self.decode_errors += 1
+                    logger.error(f"Invalid JSON message: {e}")
+                except Exception as e:
                     logger.error(f"Error processing message: {e}")
+            # A clean close ends the iteration without raising
+            logger.info("WebSocket connection closed")
         except websockets.exceptions.ConnectionClosed:
             logger.info("WebSocket connection closed")
-            self.connected =false
-            await self._trigger_event("disconnected")
-            
-            if self._should_reconnect:
-                await self._schedule_reconnect()
         except Exception as e:
             logger.error(f"Error in message processing: {e}")
-            self.connected = False
+        await self._connection_lost(websocket)
     
-    async def _handle_message(self, data: Dict[str, Any]):le different types of messages       kind = data.get("kind", "")
-        
-        if kind == MessageKind.WEBSOCKET_PONG.value:
-            await self._handle_pong(data)
-        elif kind == MessageKind.WEBSOCKET_CONNECTION.value:
-            await self._handle_connection_response(data)
-        elif kind == MessageKind.COMMAND.value:
-            await self._handle_command_message(data)
-        elif kind == MessageKind.PRESENCE.value:
-            await self._handle_presence_message(data)
-        elif kind == MessageKind.DEVICE.value:
-            await self._handle_device_message(data)
-        elif kind == MessageKind.ALERT.value:
-            await self._handle_alert_message(data)
-        elif kind == MessageKind.SERVICE.value:
-            await self._handle_service_message(data)
-        else:
+    async def _connection_lost(self, websocket):
+        """Tear down a dead connection and start reconnecting, once per connection"""
+        if websocket is not self.websocket or not self.connected:
+            return  # already handled, or a newer connection has replaced it
+        
+        self.connected = False
+        self._stop_writer()
+        self._stop_heartbeat()
+        self._stop_reconcile()
+        self.websocket = None
+        try:
+            await websocket.close()
+        except Exception as e:
+            logger.debug(f"Error closing dead connection: {e}")
+        
+        await self._trigger_event("disconnected")
+        if self._should_reconnect:
+            await self._schedule_reconnect()
+    
+    async def _ingest(self, data: Dict[str, Any]):
+        """Hand a decoded frame to the ingest pipeline"""
+        kind = data.get("kind")
+        kind = kind if kind in self._message_handlers else "unknown"
+        self.messages_received[kind] = self.messages_received.get(kind, 0) + 1
+        
+        if not self._ingest_queues or kind in INLINE_KINDS:
+            await self._handle_message(data)
+            return
+        
+        queue = self._ingest_queues[hash(data.get("deviceId")) % len(self._ingest_queues)]
+        policy = (
+            self.overflow_policies.get(data.get("serviceType"))
+            or self.overflow_policies.get(data.get("kind"))
+            or OverflowPolicy.BLOCK
+        )
+        await queue.put(data, policy)
+    
+    def _start_ingest_workers(self):
+        """Start one worker per ingest queue, unless already running"""
+        if self._ingest_tasks:
+            return
+        self._ingest_tasks = [asyncio.create_task(self._ingest_worker(queue)) for queue in self._ingest_queues]
+    
+    def _stop_ingest_workers(self):
+        """Stop the ingest workers"""
+        for task in self._ingest_tasks:
+            task.cancel()
+        self._ingest_tasks = []
+    
+    async def _ingest_worker(self, queue: IngestQueue):
+        """Handle queued frames in order"""
+        while True:
+            data = await queue.get()
+            try:
+                await self._handle_message(data)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+            finally:
+                queue.task_done()
+    
+    async def drain_ingest(self):
+        """Wait until every frame in the ingest queues has been handled (or dropped)"""
+        await asyncio.gather(*(queue.join() for queue in self._ingest_queues))
+    
+    def ingest_stats(self) -> Dict[str, Any]:
+        """Ingest queue depth and overflow counters"""
+        return {
+            "workers": len(self._ingest_queues),
+            "capacity": sum(queue.capacity for queue in self._ingest_queues),
+            "depth": [len(queue) for queue in self._ingest_queues],
+            "max_depth": max((queue.max_depth for queue in self._ingest_queues), default=0),
+            "dropped": sum(queue.dropped for queue in self._ingest_queues),
+        }
+    
+    async def _handle_message(self, data: Dict[str, Any]):
+        """Handle different types of messages"""
+        kind = data.get("kind", "")
+        
+        handler = self._message_handlers.get(kind)
+        if handler is None:
             logger.debug(f"Unknown message kind: {kind}")
+            return
+        started = time.perf_counter()
+        try:
+            await handler(data)
+        finally:
+            labelled(self.handle_latency, kind, FAST_LATENCY_BUCKETS).observe(time.perf_counter() - started)
     
     async def _handle_pong(self, data: Dict[str, Any]):
-    ndle pong response      logger.debug(f"Received pong: {data.get('id', 'unknown')}")
+        """Handle pong response, resolving the ping it answers"""
+        pending = self._pending_pings.pop(data.get("id"), None)
+        if pending is None:
+            logger.debug(f"Received unexpected pong: {data.get('id', 'unknown')}")
+            return
+        
+        sent_at, pong = pending
+        rtt = time.monotonic() - sent_at
+        self.rtt.observe(rtt)
+        if not pong.done():
+            pong.set_result(rtt)
+        logger.debug(f"Received pong {data['id']} after {rtt * 1000:.1f} ms")
     
-    async def _handle_connection_response(self, data: Dict[str, Any]):Handle connection response       logger.info("Received connection response")
+    async def _handle_connection_response(self, data: Dict[str, Any]):
+        """Handle connection response"""
+        logger.info("Received connection response")
         # Extract user_id and other connection details
-        self.user_id = data.get(userId")
+        self.user_id = data.get("userId")
     
     async def _handle_command_message(self, data: Dict[str, Any]):
-       dle command result message"""
+        """Handle command result message"""
+        command_id = data.get("id") or data.get("correlationId")
+        if command_id:
+            status = CommandStatus.ACKNOWLEDGED if _command_succeeded(data) else CommandStatus.FAILED
+            self._resolve_command(command_id, status, data)
         await self._trigger_event("command_result", data)
     
+    async def _handle_api_response(self, data: Dict[str, Any]):
+        """Handle the API reply to a request; only rejections settle a command"""
+        command_id = data.get("id")
+        request = self._api_requests.pop(command_id, None)
+        if request is not None:
+            if not request.done():
+                request.set_result(data)
+        elif command_id in self._pending_commands and not _command_succeeded(data):
+            self._resolve_command(command_id, CommandStatus.FAILED, data)
+        else:
+            logger.debug(f"Received API response: {command_id}")
+    
     async def _handle_presence_message(self, data: Dict[str, Any]):
-        e presence message
+        """Handle presence message"""
         device_id = data.get("deviceId")
         presence = data.get("presence", {})
         
-        if device_id in self.devices:
-            self.devices[device_id].online = presence.get("online", false)
-            self.devices[device_id].last_seen = datetime.fromisoformat(
-                presence.get("lastSeen", ").replace("Z", "+000     )
+        device = self.devices.get(device_id)
+        if device is None:
+            return
+        
+        # Only the fields present are applied; the reconcile listing carries no lastSeen
+        online = presence.get("online", device.online)
+        last_seen = parse_timestamp(presence["lastSeen"]) if "lastSeen" in presence else device.last_seen
+        changed = device.online != online or device.last_seen != last_seen
+        if not changed and not device.stale:
+            return  # repeated presence, e.g. re-sent after a reconnect
+        
+        device.online = online
+        device.last_seen = last_seen
+        device.stale = False
+        self._bump_version("device", device_id)
+        if changed:
             await self._trigger_event("presence_changed", device_id, presence)
     
     async def _handle_device_message(self, data: Dict[str, Any]):
-      dle device message
+        """Handle device message"""
         device_id = data.get("deviceId")
         device_type = data.get("deviceType")
         name = data.get("name", device_id)
+        if data.get("lastSyncTime"):
+            self._note_sync(device_id, data["lastSyncTime"])
         
         if device_id not in self.devices:
             # New device
             device = SmartHQDevice(
                 device_id=device_id,
-                device_type=device_type,
-                name=name
+                device_type=sys.intern(device_type) if device_type else device_type,
+                name=name,
+                service_ids=self._services_by_device.setdefault(device_id, set()),
+                last_sync=data.get("lastSyncTime"),
             )
             self.devices[device_id] = device
-            await self._trigger_event("device_added, device)
+            self._index_device(device)
+            self._bump_version("device", device_id)
+            await self._trigger_event("device_added", device)
         else:
             # Update existing device
-            self.devices[device_id].device_type = device_type
-            self.devices[device_id].name = name
-            await self._trigger_event("device_updated", self.devices[device_id])
+            device = self.devices[device_id]
+            changed = device.device_type != device_type or device.name != name
+            if not changed and not device.stale:
+                return  # repeated device message, e.g. re-sent after a reconnect
+            
+            self._unindex_device(device)
+            device.device_type = sys.intern(device_type) if device_type else device_type
+            device.name = name
+            device.stale = False
+            self._index_device(device)
+            self._bump_version("device", device_id)
+            if changed:
+                await self._trigger_event("device_updated", device)
+    
+    def _note_sync(self, device_id: str, last_sync: str):
+        """Advance a device's last_sync to the newest lastSyncTime seen for it"""
+        device = self.devices.get(device_id)
+        # The cloud's ISO timestamps share one format, so they order as strings
+        if device is not None and (device.last_sync is None or last_sync > device.last_sync):
+            device.last_sync = last_sync
     
     async def _handle_alert_message(self, data: Dict[str, Any]):
-     ndle alert message"""
+        """Handle alert message"""
         await self._trigger_event("alert_received", data)
     
     async def _handle_service_message(self, data: Dict[str, Any]):
-       le service message"        service_id = data.get("serviceId)      service_type = data.get("serviceType")
+        """Handle service message"""
+        service_id = data.get("serviceId")
+        service_type = data.get("serviceType")
         device_id = data.get("deviceId")
         
         # Create or update service
-        service = SmartHQService(
-            service_id=service_id,
-            service_type=ServiceType(service_type),
-            domain_type=data.get("domainType"),
-            device_id=device_id,
-            state=data.get("state", {}),
-            config=data.get("config", {}),
-            supported_commands=data.get(supportedCommands", []),
-            last_sync_time=datetime.fromisoformat(data.get(lastSyncTime", ").replace("Z", "+00:0,
-            last_state_time=datetime.fromisoformat(data.get("lastStateTime", ").replace("Z", +00       )
+        previous = self.services.get(service_id)
+        service = self._build_service(data, previous)
+        if data.get("lastSyncTime"):
+            self._note_sync(device_id, data["lastSyncTime"])
+        if previous and not previous.stale and _same_service(previous, service):
+            previous.last_sync_raw = service.last_sync_raw
+            return  # repeated update, e.g. re-sent after a reconnect
         
+        if previous:
+            self._unindex_service(previous)
         self.services[service_id] = service
+        self._index_service(service)
+        
+        self._bump_version("service", service_id)
+        if self.history is not None and service.service_type in self.history_types:
+            value = service.typed_state.primary_value()
+            if value is not None:
+                self.history.record(service_id, value)
+        if self.energy is not None and service.service_type is ServiceType.METER:
+            state = service.typed_state
+            self.energy.record(
+                service_id, service.device_id, meter_unit(service.config),
+                state.meter_value, state.meter_value_delta,
+                period=state.update_frequency_seconds,
+            )
+        await self.coalescer.submit(service)
+    
+    def _build_service(self, data: Dict[str, Any], previous: Optional[SmartHQService] = None) -> SmartHQService:
+        """Build a service from a pubsub#service message"""
+        service_type = ServiceType(data.get("serviceType"))
+        domain_type = data.get("domainType")
+        config = data.get("config", {})
+        if previous and previous.config == config:
+            # Config is effectively static; keep sharing the interned copy
+            config = previous.config
+        else:
+            config = _intern_config(config)
         
-        # Update device services
-        if device_id in self.devices:
-            self.devices[device_id].services[service_id] = data
+        return SmartHQService(
+            service_id=data.get("serviceId"),
+            service_type=service_type,
+            domain_type=sys.intern(domain_type) if domain_type else domain_type,
+            device_id=data.get("deviceId"),
+            typed_state=parse_service_state(service_type, data.get("state", {})),
+            config=config,
+            supported_commands=tuple(sys.intern(command) for command in data.get("supportedCommands", [])),
+            last_sync_raw=data.get("lastSyncTime"),
+            last_state_raw=data.get("lastStateTime")
+        )
+    
+    def restore(self, devices: Iterable[Dict[str, Any]], services: Iterable[Dict[str, Any]]):
+        """
+        Seed the registry from snapshot messages (see to_message) before connecting
+        
+        Restored entries are marked stale until the cloud sends them again.
+        No events are fired.
+        """
+        for data in devices:
+            device_id = data.get("deviceId")
+            if device_id in self.devices:
+                continue
+            device_type = data.get("deviceType")
+            device = SmartHQDevice(
+                device_id=device_id,
+                device_type=sys.intern(device_type) if device_type else device_type,
+                name=data.get("name", device_id),
+                service_ids=self._services_by_device.setdefault(device_id, set()),
+                online=data.get("online", False),
+                last_seen=parse_timestamp(data.get("lastSeen")),
+                stale=True,
+                last_sync=data.get("lastSyncTime"),
+            )
+            self.devices[device_id] = device
+            self._index_device(device)
+            self._bump_version("device", device_id)
+        
+        for data in services:
+            service_id = data.get("serviceId")
+            if service_id in self.services or data.get("deviceId") not in self.devices:
+                continue
+            try:
+                service = self._build_service(data)
+            except ValueError as e:
+                logger.warning(f"Skipping snapshot service {service_id}: {e}")
+                continue
+            service.stale = True
+            self.services[service_id] = service
+            self._index_service(service)
+            self._bump_version("service", service_id)
+        
+        logger.info(f"Restored {len(self.devices)} devices and {len(self.services)} services from snapshot")
+    
+    async def reconcile(self) -> Optional[Dict[str, Any]]:
+        """
+        Bring the registry in line with the cloud after a reconnect
+        
+        Lists the account's devices and fetches the services of only those
+        whose lastSyncTime moved (or that are new), then applies the
+        differences through the regular message handlers, so events fire
+        only for what actually changed. Devices restored from a snapshot are
+        compared by their saved lastSyncTime, so a warm start fetches only
+        what changed while the add-on was down. Devices no longer listed are
+        removed. Returns counters for the run, or None if the device list
+        could not be fetched.
+        """
+        started = time.monotonic()
+        listing = await self._api_request("GET", DEVICE_LIST_PATH)
+        if listing is None:
+            logger.warning("Could not fetch the device list; keeping the registry as is")
+            return None
+        entries = listing.get("devices")
+        if not isinstance(entries, list):
+            # Removing every device not listed is only safe against a real list
+            logger.warning("Device list reply has no devices list; keeping the registry as is")
+            return None
+        
+        remote = {
+            entry["deviceId"]: entry for entry in entries if isinstance(entry, dict) and entry.get("deviceId")
+        }
+        version = self.state_version
+        removed = [device_id for device_id in self.devices if device_id not in remote]
+        for device_id in removed:
+            await self._remove_device(device_id)
+        
+        outdated = []
+        for device_id, entry in remote.items():
+            device = self.devices.get(device_id)
+            if device is None or device.last_sync != entry.get("lastSyncTime"):
+                outdated.append(device_id)
+            await self._handle_device_message({
+                "deviceId": device_id,
+                "deviceType": entry.get("deviceType"),
+                "name": entry.get("name", device.name if device else device_id),
+            })
+            if "presence" in entry:
+                await self._handle_presence_message({"deviceId": device_id, "presence": entry["presence"]})
+        
+        details = await asyncio.gather(
+            *(self._api_request("GET", DEVICE_PATH.format(device_id=device_id)) for device_id in outdated)
+        )
+        fetched = 0
+        for device_id, detail in zip(outdated, details):
+            if detail is None or device_id not in self.devices:
+                continue  # retried on the next reconnect
+            await self._reconcile_services(device_id, detail.get("services", []))
+            self.devices[device_id].last_sync = remote[device_id].get("lastSyncTime")
+            fetched += 1
+        
+        changes = self.get_changes_since(version)
+        self.last_reconcile = {
+            "devices": len(remote),
+            "fetched": fetched,
+            "removed": len(removed),
+            "devices_changed": len(changes[0]) if changes else None,
+            "services_changed": len(changes[1]) if changes else None,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        logger.info(f"Reconciled registry with SmartHQ: {self.last_reconcile}")
+        return self.last_reconcile
+    
+    async def _reconcile_services(self, device_id: str, services: List[Dict[str, Any]]):
+        """Apply the cloud's current services of a device, removing those it no longer has"""
+        current = set()
+        for data in services:
+            service_id = data.get("serviceId")
+            if not service_id:
+                continue
+            current.add(service_id)
+            try:
+                await self._handle_service_message({**data, "deviceId": device_id})
+            except ValueError as e:
+                logger.warning(f"Skipping service {service_id} of {device_id}: {e}")
+        
+        for service_id in list(self._services_by_device.get(device_id, ())):
+            if service_id not in current:
+                await self._remove_service(service_id)
+    
+    async def _api_request(self, method: str, path: str) -> Optional[Dict[str, Any]]:
+        """Send a digital twin API request over the WebSocket and return the reply body, or None on failure"""
+        request_id = str(uuid.uuid4())
+        reply = asyncio.get_running_loop().create_future()
+        self._api_requests[request_id] = reply
+        try:
+            await self._send_message({
+                "kind": "websocket#api",
+                "action": "api",
+                "host": "api.mysmarthq.com",
+                "method": method,
+                "path": path,
+                "id": request_id,
+            }, SendPriority.BULK)
+            data = await asyncio.wait_for(reply, API_REQUEST_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            logger.warning(f"API request {method} {path} failed: {e!r}")
+            return None
+        finally:
+            self._api_requests.pop(request_id, None)
         
-        await self._trigger_event(service_updated", service)
+        if not _command_succeeded(data):
+            logger.warning(f"API request {method} {path} was rejected: {data.get('code')}")
+            return None
+        body = data.get("body")
+        if isinstance(body, (str, bytes)):
+            try:
+                body = self.decoder(body)
+            except DECODE_ERRORS as e:
+                logger.warning(f"Invalid body in reply to {method} {path}: {e}")
+                return None
+        return body if isinstance(body, dict) else {}
+    
+    def _stop_reconcile(self):
+        """Stop reconciling; it starts over once reconnected"""
+        task = self._reconcile_task
+        self._reconcile_task = None
+        if task and task is not asyncio.current_task():
+            task.cancel()
+    
+    async def _remove_service(self, service_id: str):
+        """Remove a service from the registry and its indexes"""
+        service = self.services.pop(service_id, None)
+        if not service:
+            return
+        
+        self._unindex_service(service)
+        self.coalescer.discard(service_id)
+        if self.history is not None:
+            self.history.discard(service_id)
+        if self.energy is not None:
+            self.energy.discard(service_id)
+        
+        self._bump_version("service", service_id)
+        await self._trigger_event("service_removed", service)
+    
+    async def _remove_device(self, device_id: str):
+        """Remove a device and all of its services from the registry"""
+        for service_id in list(self._services_by_device.get(device_id, ())):
+            await self._remove_service(service_id)
+        
+        device = self.devices.pop(device_id, None)
+        self._services_by_device.pop(device_id, None)
+        if not device:
+            return
+        
+        self._unindex_device(device)
+        self._bump_version("device", device_id)
+        await self._trigger_event("device_removed", device)
+    
+    def _index_device(self, device: SmartHQDevice):
+        """Add a device to the secondary indexes"""
+        self._devices_by_type.setdefault(device.device_type, set()).add(device.device_id)
+    
+    def _unindex_device(self, device: SmartHQDevice):
+        """Remove a device from the secondary indexes"""
+        _discard_from_index(self._devices_by_type, device.device_type, device.device_id)
+    
+    def _index_service(self, service: SmartHQService):
+        """Add a service to the secondary indexes"""
+        self._services_by_device.setdefault(service.device_id, set()).add(service.service_id)
+        self._services_by_type.setdefault(service.service_type, set()).add(service.service_id)
+    
+    def _unindex_service(self, service: SmartHQService):
+        """Remove a service from the secondary indexes"""
+        # Known devices share their bucket as SmartHQDevice.service_ids, so keep it
+        bucket = self._services_by_device.get(service.device_id)
+        if bucket is not None:
+            bucket.discard(service.service_id)
+            if not bucket and service.device_id not in self.devices:
+                del self._services_by_device[service.device_id]
+        _discard_from_index(self._services_by_type, service.service_type, service.service_id)
+    
+    def _bump_version(self, entity_kind: str, entity_id: str) -> int:
+        """Advance the registry version and record which entity changed"""
+        self.state_version += 1
+        self._changelog.append((self.state_version, entity_kind, entity_id))
+        return self.state_version
+    
+    def get_changes_since(self, version: int) -> Optional[Tuple[Set[str], Set[str]]]:
+        """
+        Get the device and service IDs changed after a registry version
+        
+        Returns None when the changelog no longer reaches back to the given
+        version (or it is from the future), in which case callers need a
+        full snapshot instead.
+        """
+        if version > self.state_version:
+            return None
+        
+        device_ids: Set[str] = set()
+        service_ids: Set[str] = set()
+        if version == self.state_version:
+            return device_ids, service_ids
+        
+        if not self._changelog or self._changelog[0][0] > version + 1:
+            return None
+        
+        for entry_version, entity_kind, entity_id in reversed(self._changelog):
+            if entry_version <= version:
+                break
+            if entity_kind == "device":
+                device_ids.add(entity_id)
+            else:
+                service_ids.add(entity_id)
+        return device_ids, service_ids
+    
+    @property
+    def state_etag(self) -> str:
+        """Entity tag identifying the current registry version"""
+        return f'"{self.state_epoch}-{self.state_version}"'
     
     async def _heartbeat_loop(self):
-      periodic heartbeat pings"""
-        while self.connected:
+        """
+        Probe the connection whenever it has been idle for heartbeat_interval
+        
+        Any inbound frame counts as a sign of life, so a busy connection is
+        never pinged. Once a ping goes unanswered the next one follows
+        immediately, and after missed_pong_limit misses in a row the
+        connection is dropped and re-established.
+        """
+        websocket = self.websocket
+        while self.connected and websocket is self.websocket:
             try:
-                await asyncio.sleep(60)  # Send ping every 60 seconds
-                if self.connected:
-                    ping_message = {
-                        kind:websocket#ping                 id": str(uuid.uuid4()),
-                       action                   }
-                    await self._send_message(ping_message)
+                idle = time.monotonic() - self._last_received
+                if idle < self.heartbeat_interval:
+                    await asyncio.sleep(self.heartbeat_interval - idle)
+                    continue
+                
+                if await self._ping():
+                    self.missed_pongs = 0
+                    continue
+                
+                self.missed_pongs += 1
+                self.pongs_missed += 1
+                logger.warning(f"No pong from SmartHQ ({self.missed_pongs}/{self.missed_pong_limit})")
+                if self.missed_pongs >= self.missed_pong_limit:
+                    logger.warning("SmartHQ connection is unresponsive, reconnecting")
+                    self.liveness_failures += 1
+                    await self._connection_lost(websocket)
+                    break
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error in heartbeat loop: {e}")
+                await asyncio.sleep(MIN_PONG_TIMEOUT)
+    
+    async def _ping(self) -> bool:
+        """Send a ping and wait for its pong, or for any other frame proving the connection alive"""
+        ping_id = str(uuid.uuid4())
+        sent_at = time.monotonic()
+        pong = asyncio.get_running_loop().create_future()
+        self._pending_pings[ping_id] = (sent_at, pong)
+        try:
+            ping_message = {
+                "kind": "websocket#ping",
+                "id": ping_id,
+                "action": "ping"
+            }
+            await asyncio.wait_for(self._send_message(ping_message), self.rtt.timeout())
+            self.pings_sent += 1
+            await asyncio.wait_for(pong, self.rtt.timeout())
+            return True
+        except asyncio.TimeoutError:
+            return self._last_received > sent_at
+        finally:
+            self._pending_pings.pop(ping_id, None)
+    
+    def _stop_heartbeat(self):
+        """Stop the heartbeat task (unless it is the caller) and forget outstanding pings"""
+        task = self._heartbeat_task
+        self._heartbeat_task = None
+        if task and task is not asyncio.current_task():
+            task.cancel()
+        for _, pong in self._pending_pings.values():
+            if not pong.done():
+                pong.cancel()
+        self._pending_pings.clear()
+    
+    def liveness_stats(self) -> Dict[str, Any]:
+        """Heartbeat settings, ping round-trip times and liveness counters"""
+        return {
+            "heartbeat_interval": self.heartbeat_interval,
+            "idle_seconds": round(time.monotonic() - self._last_received, 3),
+            "pong_timeout": round(self.rtt.timeout(), 3),
+            "rtt_ms": round(self.rtt.last * 1000, 3) if self.rtt.last is not None else None,
+            "smoothed_rtt_ms": round(self.rtt.smoothed * 1000, 3) if self.rtt.smoothed is not None else None,
+            "rtt": self.rtt.histogram.snapshot(),
+            "pings_sent": self.pings_sent,
+            "pongs_missed": self.pongs_missed,
+            "liveness_failures": self.liveness_failures,
+            "reconnects": self.reconnects,
+            "last_reconcile": self.last_reconcile,
+        }
     
     async def _schedule_reconnect(self):
-      ule a reconnection attempt"
+        """Schedule a reconnection attempt"""
         if self._reconnect_task and not self._reconnect_task.done():
             return
         
         self._reconnect_task = asyncio.create_task(self._reconnect_loop())
     
     async def _reconnect_loop(self):
-   tempt to reconnect with exponential backoff"
-        delay =5art with5econds
-        max_delay = 300 minutes
+        """Reconnect at once, then with exponential backoff from reconnect_interval"""
+        delay = 0.0
         
         while self._should_reconnect and not self.connected:
             try:
-                logger.info(f"Attempting to reconnect in {delay} seconds...)             await asyncio.sleep(delay)
+                if delay:
+                    logger.info(f"Attempting to reconnect in {delay} seconds...")
+                    await asyncio.sleep(delay)
                 
                 if await self.connect():
+                    self.reconnects += 1
                     logger.info("Successfully reconnected")
                     break
                 
-                delay = min(delay * 2, max_delay)
+                delay = min(delay * 2, MAX_RECONNECT_INTERVAL) if delay else self.reconnect_interval
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Reconnection attempt failed: {e})             delay = min(delay * 2, max_delay)
+                logger.error(f"Reconnection attempt failed: {e}")
+                delay = min(delay * 2, MAX_RECONNECT_INTERVAL) if delay else self.reconnect_interval
     
-    async def send_command(self, device_id: str, command: str, data: List[Any] = None):
-       Send a command to a device       if not self.connected:
+    async def send_command(
+        self,
+        device_id: str,
+        command: str,
+        data: List[Any] = None,
+        ack_timeout: int = DEFAULT_ACK_TIMEOUT,
+    ) -> str:
+        """Send a command to a device and return its message id
+        
+        The command is tracked until its result arrives or ack_timeout
+        (plus a grace period) expires; use wait_for_command to await it.
+        """
+        command_id, _ = (await self._submit_commands([DeviceCommand(device_id, command, data or [], ack_timeout)]))[0]
+        return command_id
+    
+    async def send_commands(self, commands: List[DeviceCommand]) -> List[str]:
+        """Send several commands in one burst and return their message ids
+        
+        All target devices are validated before anything is queued. Commands
+        still queued when the connection drops are sent after reconnecting.
+        """
+        return [command_id for command_id, _ in await self._submit_commands(commands)]
+    
+    async def wait_for_command(self, command_id: str) -> CommandResult:
+        """Wait for the result of a command sent with send_command"""
+        pending = self._pending_commands.get(command_id)
+        if pending is None:
+            raise KeyError(command_id)
+        return await asyncio.shield(pending.future)
+    
+    async def execute_command(
+        self,
+        device_id: str,
+        command: str,
+        data: List[Any] = None,
+        ack_timeout: int = DEFAULT_ACK_TIMEOUT,
+    ) -> CommandResult:
+        """Send a command and wait for its result"""
+        return (await self.execute_commands([DeviceCommand(device_id, command, data or [], ack_timeout)]))[0]
+    
+    async def execute_commands(self, commands: List[DeviceCommand]) -> List[CommandResult]:
+        """Send several commands in one burst and wait for all their results concurrently"""
+        submitted = await self._submit_commands(commands)
+        return list(await asyncio.gather(*(asyncio.shield(future) for _, future in submitted)))
+    
+    async def _submit_commands(self, commands: List[DeviceCommand]) -> List[Tuple[str, asyncio.Future]]:
+        """Validate, track and send commands, returning (message id, result future) pairs"""
+        if not self.connected:
             raise ConnectionError("Not connected to SmartHQ")
         
-        command_message = {
-            kind":websocket#api",
-           actionapi",
-           host": api.mysmarthq.com",
-            methodPOST",
-           path: f"/v1/appliance/{device_id}/control/{command},
-          id": str(uuid.uuid4()),
-    body[object Object]
-                kind": appliance#control,
-            userId": self.user_id,
-            applianceId": device_id,
-                command": command,
-             data": data or [],
-                ackTimeout0
-         delay": 0
+        unknown = sorted({command.device_id for command in commands if command.device_id not in self.devices})
+        if unknown:
+            raise ValueError(f"Unknown devices: {', '.join(unknown)}")
+        
+        # Frames are encoded and queued together so the writer sends them back to back
+        loop = asyncio.get_running_loop()
+        submitted: List[Tuple[str, asyncio.Future]] = []
+        for command in commands:
+            command_id = str(uuid.uuid4())
+            pending = PendingCommand(
+                command.device_id, command.command, time.monotonic(), loop.create_future(), command.ack_timeout
+            )
+            # Until written, the command may only wait so long in the queue
+            pending.timer = loop.call_later(
+                self.command_queue_timeout, self._resolve_command, command_id, CommandStatus.TIMEOUT
+            )
+            self._pending_commands[command_id] = pending
+            submitted.append((command_id, pending.future))
+            self._enqueue_frame(OutboundFrame(
+                self.encoder(self._command_message(command_id, command)),
+                SendPriority.COMMAND,
+                command_id=command_id,
+            ))
+        return submitted
+    
+    def _command_written(self, command_id: str):
+        """Start the acknowledgement timeout once a command is on the wire"""
+        pending = self._pending_commands.get(command_id)
+        if pending is None:
+            return
+        if pending.timer:
+            pending.timer.cancel()
+        pending.timer = asyncio.get_running_loop().call_later(
+            pending.ack_timeout + ACK_GRACE_PERIOD, self._resolve_command, command_id, CommandStatus.TIMEOUT
+        )
+        logger.info(f"Sent command {pending.command} to device {pending.device_id}")
+    
+    def _command_message(self, command_id: str, command: DeviceCommand) -> Dict[str, Any]:
+        """Build the API request frame for a command"""
+        return {
+            "kind": "websocket#api",
+            "action": "api",
+            "host": "api.mysmarthq.com",
+            "method": "POST",
+            "path": f"/v1/appliance/{command.device_id}/control/{command.command}",
+            "id": command_id,
+            "body": {
+                "kind": "appliance#control",
+                "userId": self.user_id,
+                "applianceId": command.device_id,
+                "command": command.command,
+                "data": command.data,
+                "ackTimeout": command.ack_timeout,
+                "delay": 0
             }
         }
+    
+    def _resolve_command(
+        self,
+        command_id: str,
+        status: CommandStatus,
+        response: Optional[Dict[str, Any]] = None,
+    ):
+        """Settle a pending command, recording its outcome and latency"""
+        pending = self._pending_commands.pop(command_id, None)
+        if pending is None:
+            return
+        if pending.timer:
+            pending.timer.cancel()
+        
+        latency = None
+        if status in (CommandStatus.ACKNOWLEDGED, CommandStatus.FAILED):
+            latency = time.monotonic() - pending.sent_at
+            self.command_latency.observe(latency)
+        else:
+            logger.warning(f"Command {pending.command} to device {pending.device_id}: {status.value}")
+        self.command_outcomes[status] += 1
+        
+        if not pending.future.done():
+            pending.future.set_result(CommandResult(
+                command_id, pending.device_id, pending.command, status, latency, response
+            ))
+    
+    def _cancel_pending_commands(self):
+        """Settle every pending command as cancelled"""
+        for command_id in list(self._pending_commands):
+            self._resolve_command(command_id, CommandStatus.CANCELLED)
+    
+    def write_metrics(self, writer: MetricsWriter, labels: Dict[str, str]):
+        """Add this client's counters, gauges and histograms to a Prometheus exposition"""
+        writer.gauge("connected", "Whether the SmartHQ WebSocket is connected", self.connected, labels)
+        writer.gauge("devices", "Known devices", len(self.devices), labels)
+        writer.gauge("services", "Known services", len(self.services), labels)
+        writer.counter("reconnects", "Successful reconnections", self.reconnects, labels)
+        writer.counter("liveness_failures", "Connections dropped for missing pongs", self.liveness_failures, labels)
+        writer.counter("pongs_missed", "Pings that went unanswered", self.pongs_missed, labels)
+        writer.histogram("heartbeat_rtt_seconds", "Ping round-trip time", self.rtt.histogram, labels)
+        
+        for kind, count in self.messages_received.items():
+            writer.counter("messages_received", "Inbound frames, per message kind", count, {**labels, "kind": kind})
+        writer.counter("decode_errors", "Inbound frames that could not be decoded", self.decode_errors, labels)
+        writer.histogram("decode_seconds", "Time to decode one inbound frame", self.decode_latency, labels)
+        for kind, histogram in self.handle_latency.items():
+            writer.histogram("handle_seconds", "Time to handle one inbound frame, per message kind", histogram, {**labels, "kind": kind})
+        writer.gauge("ingest_queue_depth", "Frames waiting in the ingest queues", sum(len(queue) for queue in self._ingest_queues), labels)
+        writer.counter("ingest_dropped", "Frames dropped by full ingest queues", sum(queue.dropped for queue in self._ingest_queues), labels)
+        writer.counter("updates_coalesced", "Service updates merged by the coalescer", self.coalescer.coalesced, labels)
         
-        await self._send_message(command_message)
-        logger.info(f"Sent command {command} to device {device_id}")
+        for event, histogram in self.dispatcher.latency.items():
+            writer.histogram("event_handler_seconds", "Event handler run time, per event", histogram, {**labels, "event": event})
+        writer.counter("event_handler_failures", "Event handler calls that raised", self.dispatcher.failed, labels)
+        writer.gauge("event_queue_depth", "Handler calls waiting in the dispatcher lanes", self.dispatcher.stats()["queued"], labels)
+        
+        writer.gauge("send_queue_depth", "Outbound frames waiting for the writer", self._send_queue.qsize(), labels)
+        writer.counter("frames_sent", "Outbound frames written", self.frames_sent, labels)
+        writer.counter("send_throttled_seconds", "Time the writer waited on the rate limit", self._send_limiter.throttled_seconds, labels)
+        writer.gauge("commands_pending", "Commands awaiting their result", len(self._pending_commands), labels)
+        for status, count in self.command_outcomes.items():
+            writer.counter("commands", "Settled commands, per outcome", count, {**labels, "status": status.value})
+        writer.histogram("command_rtt_seconds", "Time from sending a command to its result", self.command_latency, labels)
+    
+    def command_stats(self) -> Dict[str, Any]:
+        """Pending commands, outcome counters and round-trip latency"""
+        return {
+            "pending": len(self._pending_commands),
+            **{status.value: count for status, count in self.command_outcomes.items()},
+            "latency": self.command_latency.snapshot(),
+        }
     
     def get_device(self, device_id: str) -> Optional[SmartHQDevice]:
-        Get a device by ID       return self.devices.get(device_id)
+        """Get a device by ID"""
+        return self.devices.get(device_id)
     
     def get_service(self, service_id: str) -> Optional[SmartHQService]:
-      et a service by ID       return self.services.get(service_id)
+        """Get a service by ID"""
+        return self.services.get(service_id)
+    
+    def get_device_services(self, device_id: str) -> List[SmartHQService]:
+        """Get all services belonging to a device"""
+        return [self.services[service_id] for service_id in self._services_by_device.get(device_id, ())]
     
     def get_devices_by_type(self, device_type: str) -> List[SmartHQDevice]:
-        Get all devices of a specific type    return [device for device in self.devices.values() if device.device_type == device_type]
+        """Get all devices of a specific type"""
+        return [self.devices[device_id] for device_id in self._devices_by_type.get(device_type, ())]
     
     def get_services_by_type(self, service_type: ServiceType) -> List[SmartHQService]:
-et all services of a specific type   return [service for service in self.services.values() if service.service_type == service_type] 
\ No newline at end of file
+        """Get all services of a specific type"""
+        return [self.services[service_id] for service_id in self._services_by_type.get(service_type, ())]
+
+
+def _same_service(previous: SmartHQService, service: SmartHQService) -> bool:
+    """Whether a rebuilt service carries nothing new over the one it replaces"""
+    return (
+        previous.typed_state == service.typed_state
+        and previous.config is service.config  # _build_service keeps the instance when unchanged
+        and previous.supported_commands == service.supported_commands
+        and previous.domain_type == service.domain_type
+        and parse_timestamp(previous.last_state_raw) == parse_timestamp(service.last_state_raw)
+    )
+
+
+def _discard_from_index(index: Dict[Any, Set[str]], key: Any, entity_id: str):
+    """Remove an ID from an index bucket, dropping the bucket once empty"""
+    bucket = index.get(key)
+    if bucket is not None:
+        bucket.discard(entity_id)
+        if not bucket:
+            del index[key]
@@ -0,0 +1,145 @@
+"""
+On-disk registry snapshots for the SmartHQ add-on
+
+Persists each client's devices and services to a SQLite database (under
+the add-on's /config mapping) so a restarted add-on can serve its last
+known state before the cloud has re-sent everything.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from smarthq_client import SmartHQClient
+
+logger = logging.getLogger(__name__)
+
+# Rows to upsert as (account, kind, entity ID, encoded message) and to delete as (account, kind, entity ID)
+Upserts = List[Tuple[str, str, str, bytes]]
+Deletes = List[Tuple[str, str, str]]
+
+
+class SnapshotStore:
+    """SQLite-backed snapshot of every account's registry, written incrementally"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        # (client epoch, client version) last written, per account
+        self._cursors: Dict[str, Tuple[str, int]] = {}
+        self._lock = asyncio.Lock()
+
+    def open(self):
+        """Open (creating if needed) the snapshot database"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written from an executor thread, one write at a time
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            " account TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " entity_id TEXT NOT NULL,"
+            " message BLOB NOT NULL,"
+            " PRIMARY KEY (account, kind, entity_id))"
+        )
+        self._db.commit()
+
+    def close(self):
+        """Close the snapshot database"""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def load(self, account: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Read the device and service messages saved for an account"""
+        devices: List[Dict[str, Any]] = []
+        services: List[Dict[str, Any]] = []
+        rows = self._db.execute(
+            "SELECT kind, message FROM entities WHERE account = ?", (account,)
+        )
+        for kind, message in rows:
+            try:
+                (devices if kind == "device" else services).append(orjson.loads(message))
+            except orjson.JSONDecodeError:
+                logger.warning(f"Skipping corrupt snapshot entry for {account}")
+        return devices, services
+
+    def restore(self, account: str, client: SmartHQClient):
+        """Seed a client from the saved snapshot of its account"""
+        devices, services = self.load(account)
+        if devices:
+            client.restore(devices, services)
+        # What was just restored is already on disk
+        self._cursors[account] = (client.state_epoch, client.state_version)
+
+    async def save(self, account: str, client: SmartHQClient):
+        """Write the entries of an account changed since its last save"""
+        async with self._lock:
+            upserts, deletes, replace = self._collect(account, client)
+            if not upserts and not deletes and not replace:
+                return
+            cursor = (client.state_epoch, client.state_version)
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write, account, upserts, deletes, replace
+            )
+            self._cursors[account] = cursor
+            logger.debug(f"Saved snapshot for {account}: {len(upserts)} updated, {len(deletes)} removed")
+
+    def _collect(self, account: str, client: SmartHQClient) -> Tuple[Upserts, Deletes, bool]:
+        """Encode the changed entries; a full rewrite when the changelog cannot say what changed"""
+        cursor = self._cursors.get(account)
+        if cursor == (client.state_epoch, client.state_version):
+            return [], [], False
+
+        changes = None
+        if cursor and cursor[0] == client.state_epoch:
+            changes = client.get_changes_since(cursor[1])
+
+        if changes is None:
+            upserts = [
+                (account, "device", device_id, orjson.dumps(device.to_message()))
+                for device_id, device in client.devices.items()
+            ]
+            upserts += [
+                (account, "service", service_id, orjson.dumps(service.to_message()))
+                for service_id, service in client.services.items()
+            ]
+            return upserts, [], True
+
+        upserts: Upserts = []
+        deletes: Deletes = []
+        device_ids, service_ids = changes
+        for device_id in device_ids:
+            device = client.get_device(device_id)
+            if device:
+                upserts.append((account, "device", device_id, orjson.dumps(device.to_message())))
+            else:
+                deletes.append((account, "device", device_id))
+        for service_id in service_ids:
+            service = client.get_service(service_id)
+            if service:
+                upserts.append((account, "service", service_id, orjson.dumps(service.to_message())))
+            else:
+                deletes.append((account, "service", service_id))
+        return upserts, deletes, False
+
+    def _write(self, account: str, upserts: Upserts, deletes: Deletes, replace: bool):
+        """Apply one batch of changes in a single transaction"""
+        with self._db:
+            if replace:
+                self._db.execute("DELETE FROM entities WHERE account = ?", (account,))
+            self._db.executemany(
+                "DELETE FROM entities WHERE account = ? AND kind = ? AND entity_id = ?", deletes
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entities (account, kind, entity_id, message) VALUES (?, ?, ?, ?)",
+                upserts,
+            )
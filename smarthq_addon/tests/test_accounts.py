@@ -0,0 +1,34 @@
+import pytest
+
+from accounts import AccountRegistry
+from smarthq_client import SmartHQClient
+
+
+def make_client() -> SmartHQClient:
+    return SmartHQClient("user", "password")
+
+
+def test_split_round_trips_qualified_ids():
+    registry = AccountRegistry({"home": make_client(), "cabin": make_client()})
+    assert registry.split(registry.qualify("cabin", "AA:BB")) == ("cabin", "AA:BB")
+
+
+@pytest.mark.parametrize("name", ["", "home::cabin", "::"])
+def test_invalid_account_names_are_rejected_on_construction(name):
+    with pytest.raises(ValueError):
+        AccountRegistry({name: make_client()})
+
+
+@pytest.mark.parametrize("name", ["", "home::cabin"])
+def test_invalid_account_names_are_rejected_when_added(name):
+    registry = AccountRegistry({})
+    with pytest.raises(ValueError):
+        registry.add_client(name, make_client())
+    assert registry.clients == {}
+
+
+def test_duplicate_account_is_rejected():
+    registry = AccountRegistry({})
+    registry.add_client("home", make_client())
+    with pytest.raises(ValueError):
+        registry.add_client("home", make_client())
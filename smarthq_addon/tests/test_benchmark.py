@@ -0,0 +1,29 @@
+from benchmark import compare
+
+
+def report(**results):
+    return {"parameters": {"devices": 10}, "results": results}
+
+
+def test_higher_throughput_is_not_a_regression():
+    baseline = report(rest_requests_per_sec=100.0, ingest_msgs_per_sec=1000.0, initial_sync_frames_per_sec=50.0)
+    current = report(rest_requests_per_sec=200.0, ingest_msgs_per_sec=2000.0, initial_sync_frames_per_sec=80.0)
+    assert compare(baseline, current, threshold=10.0) == []
+
+
+def test_lower_throughput_is_a_regression():
+    baseline = report(rest_requests_per_sec=200.0, ingest_msgs_per_sec=1000.0)
+    current = report(rest_requests_per_sec=100.0, ingest_msgs_per_sec=1000.0)
+    assert compare(baseline, current, threshold=10.0) == ["rest_requests_per_sec"]
+
+
+def test_latency_and_memory_regress_upwards():
+    baseline = report(rest_p99_ms=10.0, rss_mb=100.0, visibility={"count": 5, "p50_ms": 2.0})
+    current = report(rest_p99_ms=20.0, rss_mb=90.0, visibility={"count": 50, "p50_ms": 1.0})
+    assert compare(baseline, current, threshold=10.0) == ["rest_p99_ms"]
+
+
+def test_changes_within_threshold_are_ignored():
+    baseline = report(rest_p99_ms=10.0, rest_requests_per_sec=100.0)
+    current = report(rest_p99_ms=10.5, rest_requests_per_sec=95.0)
+    assert compare(baseline, current, threshold=10.0) == []
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from capture import FrameRecorder, capture_info, read_capture, replay
+from smarthq_client import SmartHQClient
+
+
+def frames():
+    yield json.dumps({"kind": "device", "deviceId": "d1", "deviceType": "oven"})
+    for index in range(3):
+        yield json.dumps({
+            "kind": "pubsub#service", "serviceId": f"s{index}", "deviceId": "d1",
+            "serviceType": "cloud.smarthq.service.temperature", "domainType": "x",
+            "state": {"celsius": 170 + index}, "config": {},
+        }).encode()
+
+
+def record_capture(path) -> list:
+    recorder = FrameRecorder(str(path))
+    recorded = [(100.0 + index * 0.25, frame) for index, frame in enumerate(frames())]
+    for timestamp, frame in recorded:
+        recorder.record(frame, timestamp)
+    recorder.close()
+    return recorded
+
+
+def test_capture_reads_back_frames_and_timestamps(tmp_path):
+    path = tmp_path / "storm.cap"
+    recorded = record_capture(path)
+    assert list(read_capture(str(path))) == recorded
+
+    info = capture_info(str(path))
+    assert info["frames"] == 4
+    assert info["duration_seconds"] == 0.75
+
+
+def test_truncated_last_record_is_skipped(tmp_path):
+    path = tmp_path / "storm.cap"
+    recorded = record_capture(path)
+    with open(path, "r+b") as capture:
+        capture.truncate(path.stat().st_size - 3)
+    assert list(read_capture(str(path))) == recorded[:-1]
+
+
+def test_replay_rebuilds_the_recorded_state(tmp_path):
+    path = tmp_path / "storm.cap"
+    record_capture(path)
+    # A later session appended to the same file, starting with a malformed frame
+    recorder = FrameRecorder(str(path))
+    recorder.record("{not json", 101.0)
+    recorder.close()
+
+    async def run():
+        client = SmartHQClient("replay", "replay")
+        result = await replay(client, str(path), speed=0)
+        await client.dispatcher.aclose()
+        return client, result
+
+    client, result = asyncio.run(run())
+    assert result["frames"] == 5
+    assert result["decode_errors"] == 1
+    assert result["handler_errors"] == 0
+    assert set(client.devices) == {"d1"}
+    assert set(client.services) == {"s0", "s1", "s2"}
+    assert client.services["s2"].state == {"celsius": 172}
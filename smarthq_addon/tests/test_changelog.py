@@ -0,0 +1,53 @@
+import asyncio
+
+from accounts import AccountRegistry
+from smarthq_client import SmartHQClient
+
+
+async def add_services(client: SmartHQClient, *service_ids: str):
+    for service_id in service_ids:
+        await client._handle_message({
+            "kind": "pubsub#service", "serviceId": service_id, "deviceId": "d1",
+            "serviceType": "cloud.smarthq.service.temperature", "domainType": "x",
+            "state": {"celsius": 180}, "config": {},
+        })
+
+
+def make_client(services, changelog_size: int) -> SmartHQClient:
+    client = SmartHQClient("user", "password", changelog_size=changelog_size)
+
+    async def run():
+        await client._handle_message({"kind": "device", "deviceId": "d1", "deviceType": "oven"})
+        await add_services(client, *services)
+        await client.dispatcher.aclose()
+
+    asyncio.run(run())
+    return client
+
+
+def test_changes_within_the_changelog_are_listed():
+    client = make_client(["s1", "s2", "s3", "s4"], changelog_size=3)
+    assert client.get_changes_since(client.state_version - 2) == (set(), {"s3", "s4"})
+    assert client.get_changes_since(client.state_version) == (set(), set())
+
+
+def test_evicted_or_future_versions_need_a_full_snapshot():
+    client = make_client(["s1", "s2", "s3", "s4"], changelog_size=3)
+    # The device (version 1) and s1 have been evicted
+    assert client.get_changes_since(0) is None
+    assert client.get_changes_since(1) is None
+    assert client.get_changes_since(client.state_version + 1) is None
+
+
+def test_registry_rebuilds_when_a_client_changelog_moved_on():
+    client = make_client(["s1"], changelog_size=2)
+    registry = AccountRegistry({"home": client}, changelog_size=2)
+    registry.refresh()
+    epoch, version = registry.state_epoch, registry.state_version
+
+    asyncio.run(add_services(client, "s2", "s3", "s4"))
+    registry.refresh()
+    assert registry.state_epoch != epoch
+    assert set(registry.services) == {"home::s1", "home::s2", "home::s3", "home::s4"}
+    # Clients of the REST API holding the old version get a full snapshot
+    assert registry.get_changes_since(version) is None
@@ -0,0 +1,85 @@
+import asyncio
+
+from smarthq_client import CoalescePolicy, ServiceType, SmartHQClient
+
+WINDOW = 0.2
+
+
+def make_client(**policy) -> SmartHQClient:
+    return SmartHQClient("user", "password", coalesce_policies={
+        ServiceType.TEMPERATURE: CoalescePolicy(window=WINDOW, **policy),
+    })
+
+
+def temperature(celsius: float, service_id: str = "s1", service_type: str = "temperature") -> dict:
+    return {
+        "kind": "pubsub#service", "serviceId": service_id, "deviceId": "d1",
+        "serviceType": f"cloud.smarthq.service.{service_type}", "domainType": "x",
+        "state": {"celsius": celsius}, "config": {},
+    }
+
+
+async def delivered_values(client: SmartHQClient, frames, settle: float = 0.0) -> list:
+    """Feed frames back to back and return the celsius of every service_updated event"""
+    values = []
+    client.add_event_handler("service_updated", lambda service: values.append(service.typed_state.celsius))
+    for frame in frames:
+        await client._handle_message(frame)
+    await asyncio.sleep(settle)
+    await client.dispatcher.drain()
+    client.coalescer.close()
+    await client.dispatcher.aclose()
+    return values
+
+
+def test_burst_delivers_first_and_latest_update():
+    frames = [temperature(celsius) for celsius in (180, 181, 182, 183)]
+    values = asyncio.run(delivered_values(make_client(), frames, settle=WINDOW * 2))
+    assert values == [180, 183]
+
+
+def test_held_update_waits_for_the_window():
+    async def run():
+        client = make_client()
+        values = []
+        client.add_event_handler("service_updated", lambda service: values.append(service.typed_state.celsius))
+        await client._handle_message(temperature(180))
+        await client._handle_message(temperature(181))
+        before = list(values)
+        await asyncio.sleep(WINDOW * 2)
+        client.coalescer.close()
+        await client.dispatcher.aclose()
+        return before, values, client.coalescer.coalesced
+
+    before, after, coalesced = asyncio.run(run())
+    assert before == [180]
+    assert after == [180, 181]
+    assert coalesced == 1
+
+
+def test_update_beyond_threshold_bypasses_the_window():
+    frames = [temperature(celsius) for celsius in (180, 181, 190)]
+    values = asyncio.run(delivered_values(make_client(threshold=5), frames))
+    # 181 is still held when 190 jumps the window; it is superseded, not delivered later
+    assert values == [180, 190]
+
+
+def test_windows_are_per_service():
+    frames = [temperature(180, "s1"), temperature(20, "s2"), temperature(181, "s1"), temperature(21, "s2")]
+    values = asyncio.run(delivered_values(make_client(), frames))
+    assert values == [180, 20]
+
+
+def test_types_without_a_policy_are_not_coalesced():
+    frames = [temperature(celsius, service_type="toggle") for celsius in (20, 21, 22)]
+    client = make_client()
+
+    async def run():
+        events = []
+        client.add_event_handler("service_updated", lambda service: events.append(service.service_id))
+        for frame in frames:
+            await client._handle_message(frame)
+        await client.dispatcher.aclose()
+        return events
+
+    assert len(asyncio.run(run())) == 3
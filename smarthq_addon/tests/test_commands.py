@@ -0,0 +1,85 @@
+import asyncio
+
+import smarthq_client
+from simulator import SmartHQSimulator
+from smarthq_client import CommandStatus, SmartHQClient
+
+
+async def connected(simulator: SmartHQSimulator, **kwargs) -> SmartHQClient:
+    await simulator.start()
+    client = SmartHQClient("user", "password", websocket_url=simulator.url, **kwargs)
+    await client.connect()
+    for _ in range(100):
+        if client.devices:
+            break
+        await asyncio.sleep(0.01)
+    return client
+
+
+def run_with_simulator(scenario, ack_delay: float = 0.01, **kwargs):
+    async def run():
+        simulator = SmartHQSimulator(devices=1, rate=0, port=0, ack_delay=ack_delay)
+        client = await connected(simulator, **kwargs)
+        try:
+            return await scenario(client, next(iter(client.devices)), simulator)
+        finally:
+            await client.disconnect()
+            await simulator.stop()
+
+    return asyncio.run(run())
+
+
+def test_acknowledged_command_resolves_with_latency():
+    async def scenario(client, device_id, simulator):
+        result = await client.execute_command(device_id, "set", [1])
+        return result, len(client._pending_commands)
+
+    result, pending = run_with_simulator(scenario)
+    assert result.status is CommandStatus.ACKNOWLEDGED
+    assert result.latency > 0
+    assert pending == 0
+
+
+def test_failed_result_resolves_the_command():
+    async def scenario(client, device_id, simulator):
+        command_id = await client.send_command(device_id, "set", [1])
+        waiter = asyncio.create_task(client.wait_for_command(command_id))
+        await asyncio.sleep(0)
+        await client._handle_message({"kind": "command", "id": command_id, "outcome": "failure"})
+        return await waiter
+
+    assert run_with_simulator(scenario, ack_delay=5).status is CommandStatus.FAILED
+
+
+def test_unacknowledged_command_times_out(monkeypatch):
+    monkeypatch.setattr(smarthq_client, "ACK_GRACE_PERIOD", 0.1)
+
+    async def scenario(client, device_id, simulator):
+        return await client.execute_command(device_id, "set", [1], ack_timeout=0)
+
+    result = run_with_simulator(scenario, ack_delay=5)
+    assert result.status is CommandStatus.TIMEOUT
+    assert result.latency is None
+
+
+def test_command_stuck_in_the_send_queue_times_out():
+    async def scenario(client, device_id, simulator):
+        result = await client.execute_command(device_id, "set", [1])
+        await asyncio.sleep(0.1)
+        return result, simulator.commands_received
+
+    # The subscription frame takes the only token; the command would wait ~10 s for the next
+    result, received = run_with_simulator(scenario, send_rate=0.1, send_burst=1, command_queue_timeout=0.1)
+    assert result.status is CommandStatus.TIMEOUT
+    assert received == 0
+
+
+def test_disconnect_cancels_pending_commands():
+    async def scenario(client, device_id, simulator):
+        command_id = await client.send_command(device_id, "set", [1])
+        waiter = asyncio.create_task(client.wait_for_command(command_id))
+        await asyncio.sleep(0)
+        await client.disconnect()
+        return await waiter
+
+    assert run_with_simulator(scenario, ack_delay=5).status is CommandStatus.CANCELLED
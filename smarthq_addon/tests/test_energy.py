@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+
+from energy import MIN_POWER_WINDOW, SECONDS_PER_HOUR, EnergyAggregator
+
+
+def test_cumulative_meter_power_waits_for_a_full_window():
+    aggregator = EnergyAggregator(ring_size=64)
+    aggregator.record("s1", "d1", "kWh", 100.0, timestamp=0.0)
+    # Sub-second readings: 0.2 kWh in 0.5 s would read as 1440 kW
+    aggregator.record("s1", "d1", "kWh", 100.2, timestamp=0.5)
+    assert math.isnan(aggregator.power[0])
+
+    aggregator.record("s1", "d1", "kWh", 100.5, timestamp=MIN_POWER_WINDOW)
+    assert aggregator.power[0] == np.float64(0.5 * SECONDS_PER_HOUR / MIN_POWER_WINDOW)
+
+
+def test_cumulative_meter_power_honours_reporting_period():
+    aggregator = EnergyAggregator(ring_size=64)
+    aggregator.record("s1", "d1", "kWh", 0.0, timestamp=0.0, period=300)
+    aggregator.record("s1", "d1", "kWh", 0.1, timestamp=120.0, period=300)
+    assert math.isnan(aggregator.power[0])
+    aggregator.record("s1", "d1", "kWh", 0.2, timestamp=360.0, period=300)
+    assert math.isclose(aggregator.power[0], 0.2 * SECONDS_PER_HOUR / 360.0)
+
+
+def test_energy_totals_are_unaffected_by_the_power_window():
+    aggregator = EnergyAggregator(ring_size=64)
+    for second, value in enumerate([1.0, 1.1, 1.3, 1.6]):
+        aggregator.record("s1", "d1", "kWh", value, timestamp=float(second))
+    assert math.isclose(aggregator.totals_by_row(0.0, 10.0)[0], 0.6)
+
+
+def test_power_meter_reports_its_reading():
+    aggregator = EnergyAggregator(ring_size=64)
+    aggregator.record("s1", "d1", "kW", 1.5, timestamp=0.0)
+    assert aggregator.power[0] == 1.5
+
+
+def test_cumulative_value_wins_over_delta():
+    aggregator = EnergyAggregator(ring_size=64)
+    aggregator.record("s1", "d1", "kWh", 100.0, delta=0.0, timestamp=0.0)
+    # The 100.5 reading (delta 0.5) was dropped; this delta only covers the last step
+    aggregator.record("s1", "d1", "kWh", 101.0, delta=0.5, timestamp=2.0)
+    assert math.isclose(aggregator.totals_by_row(0.0, 10.0)[0], 1.0)
+
+
+def test_delta_covers_a_meter_reset():
+    aggregator = EnergyAggregator(ring_size=64)
+    aggregator.record("s1", "d1", "kWh", 100.0, timestamp=0.0)
+    aggregator.record("s1", "d1", "kWh", 0.2, delta=0.2, timestamp=1.0)
+    assert math.isclose(aggregator.totals_by_row(0.0, 10.0)[0], 0.2)
+
+
+def test_retained_since_follows_the_oldest_wrapped_ring():
+    aggregator = EnergyAggregator(ring_size=4)
+    aggregator.record("slow", "d1", "kWh", 0.0, timestamp=0.0)
+    for second in range(3):
+        aggregator.record("fast", "d2", "kWh", float(second), timestamp=float(second))
+    assert aggregator.retained_since() == -math.inf
+
+    for second in range(3, 6):
+        aggregator.record("fast", "d2", "kWh", float(second), timestamp=float(second))
+    # Readings at 0 and 1 were overwritten
+    assert aggregator.retained_since() == 2.0
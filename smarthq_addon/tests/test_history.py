@@ -0,0 +1,68 @@
+import pytest
+
+from history import HistoryStore, RetentionTier
+
+DAY = 86400
+START = 1_700_000_000 - 1_700_000_000 % DAY
+INTERVAL = 30
+END = START + 8 * DAY
+
+
+@pytest.fixture(scope="module")
+def store() -> HistoryStore:
+    """Eight days of a sample every 30 seconds, valued by its offset from START"""
+    store = HistoryStore()
+    for timestamp in range(START, END, INTERVAL):
+        store.record("s1", timestamp - START, timestamp=timestamp)
+    return store
+
+
+def selected_step(store: HistoryStore, start: float, step: float) -> float:
+    return store._services["s1"].select(start, step).step
+
+
+def test_recent_fine_queries_use_raw_samples(store):
+    assert selected_step(store, END - 3600, 1) == 0
+    buckets = store.query("s1", END - 600, END, 1)
+    assert len(buckets) == 600 // INTERVAL
+    assert all(bucket["count"] == 1 for bucket in buckets)
+    assert buckets[-1]["last"] == END - INTERVAL - START
+
+
+def test_days_old_queries_use_minute_buckets(store):
+    assert selected_step(store, END - 3 * DAY, 60) == 60
+    buckets = store.query("s1", END - DAY, END, 300)
+    assert len(buckets) == DAY // 300
+    assert all(bucket["count"] == 300 // INTERVAL for bucket in buckets)
+
+
+def test_coarse_queries_use_hourly_buckets(store):
+    # The coarsest tier fine enough for the step wins, even where finer ones reach back
+    assert selected_step(store, END - 3 * DAY, 3600) == 3600
+    buckets = store.query("s1", START, END, DAY)
+    assert [bucket["start"] for bucket in buckets] == list(range(START, END, DAY))
+    assert all(bucket["count"] == DAY // INTERVAL for bucket in buckets)
+    assert buckets[0]["min"] == 0
+    assert buckets[0]["max"] == DAY - INTERVAL
+
+
+def test_falls_back_to_the_furthest_reaching_fine_tier(store):
+    # Minute buckets only reach back 7 days; hourly ones are too coarse for the step
+    assert selected_step(store, START, 60) == 60
+
+
+def test_buckets_aggregate_across_tier_buckets():
+    store = HistoryStore([RetentionTier(step=0, retention=100), RetentionTier(step=10, retention=10000)])
+    for timestamp in range(2000):
+        store.record("s1", timestamp, timestamp=timestamp)
+    buckets = store.query("s1", 1500, 1700, 60)
+    middle = next(bucket for bucket in buckets if bucket["start"] == 1560)
+    assert middle == {"start": 1560, "count": 60, "min": 1560, "max": 1619, "last": 1619, "mean": 1589.5}
+
+
+def test_unknown_and_discarded_services_have_no_history(store):
+    assert store.query("missing", START, END, 60) == []
+    other = HistoryStore()
+    other.record("s2", 1.0)
+    other.discard("s2")
+    assert "s2" not in other
@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("pytest_homeassistant_custom_component")
+
+from homeassistant.helpers import entity_registry as er
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.smarthq_addon.const import DOMAIN
+
+ADDON_URL = "http://addon.test:8080"
+
+DEVICE = {"device_id": "d1", "device_type": "cloud.smarthq.device.refrigerator", "name": "Fridge", "online": True}
+
+
+def service(service_id, service_type, state):
+    return {
+        "service_id": service_id,
+        "service_type": f"cloud.smarthq.service.{service_type}",
+        "domain_type": "cloud.smarthq.domain.power",
+        "device_id": "d1",
+        "state": state,
+        "config": {},
+        "supported_commands": ["set"],
+    }
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(enable_custom_integrations):
+    yield
+
+
+@pytest.fixture
+async def entry(hass, aioclient_mock):
+    aioclient_mock.get(f"{ADDON_URL}/changes", status=404)
+    aioclient_mock.get(f"{ADDON_URL}/devices", json=[DEVICE])
+    aioclient_mock.get(f"{ADDON_URL}/services", json=[
+        service("fridge", "temperature", {"celsius": 4}),
+        service("freezer", "temperature", {"celsius": -18}),
+        service("light", "toggle", {"on": True}),
+    ])
+    entry = MockConfigEntry(domain=DOMAIN, data={"addon_url": ADDON_URL})
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    yield entry
+    assert await hass.config_entries.async_unload(entry.entry_id)
+    await hass.async_block_till_done()
+
+
+def entity_ids(hass, entry):
+    return sorted(
+        entity.entity_id for entity in er.async_entries_for_config_entry(er.async_get(hass), entry.entry_id)
+    )
+
+
+async def test_platforms_load_and_add_entities(hass, entry):
+    assert entity_ids(hass, entry) == [
+        "sensor.fridge_temperature",
+        "sensor.fridge_temperature_2",
+        "switch.fridge_power",
+    ]
+    assert hass.states.get("switch.fridge_power").state == "on"
+    temperatures = {hass.states.get(entity_id).state for entity_id in ("sensor.fridge_temperature", "sensor.fridge_temperature_2")}
+    assert temperatures == {"4.0", "-18.0"}
+
+
+async def test_entities_follow_services_added_and_removed(hass, entry):
+    coordinator = hass.data[DOMAIN][entry.entry_id].coordinator
+
+    coordinator._apply_stream_message({"event": "service_updated", "service": {
+        **service("energy", "meter", {"meterValue": 1.5}), "unit": "kWh",
+    }})
+    await hass.async_block_till_done()
+    assert "sensor.fridge_meter" in entity_ids(hass, entry)
+    assert hass.states.get("sensor.fridge_meter").state == "1.5"
+
+    assert "switch.fridge_power" in entity_ids(hass, entry)
+    coordinator._apply_stream_message({"event": "service_removed", "service_id": "light"})
+    await hass.async_block_till_done()
+    assert "switch.fridge_power" not in entity_ids(hass, entry)
+    assert hass.states.get("switch.fridge_power") is None
+
+
+async def test_unchanged_updates_do_not_write_state(hass, entry):
+    coordinator = hass.data[DOMAIN][entry.entry_id].coordinator
+    before = hass.states.get("sensor.fridge_temperature").last_updated
+
+    coordinator._apply_stream_message({"event": "service_updated", "service": service("light", "toggle", {"on": True})})
+    await hass.async_block_till_done()
+    assert hass.states.get("sensor.fridge_temperature").last_updated == before
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from smarthq_client import IngestQueue, OverflowPolicy, ServiceType, SmartHQClient
+
+
+def frame(name: str) -> dict:
+    return {"kind": "pubsub#service", "serviceId": name}
+
+
+async def contents(queue: IngestQueue) -> list:
+    return [(await queue.get())["serviceId"] for _ in range(len(queue))]
+
+
+def test_block_waits_for_room():
+    async def run():
+        queue = IngestQueue(1)
+        await queue.put(frame("a"), OverflowPolicy.BLOCK)
+        put = asyncio.create_task(queue.put(frame("b"), OverflowPolicy.BLOCK))
+        await asyncio.sleep(0.05)
+        blocked = not put.done()
+        first = (await queue.get())["serviceId"]
+        await asyncio.wait_for(put, 1)
+        return blocked, first, await contents(queue), queue.dropped
+
+    blocked, first, rest, dropped = asyncio.run(run())
+    assert blocked
+    assert (first, rest, dropped) == ("a", ["b"], 0)
+
+
+def test_never_drop_admits_beyond_capacity():
+    async def run():
+        queue = IngestQueue(1)
+        await queue.put(frame("a"), OverflowPolicy.BLOCK)
+        await asyncio.wait_for(queue.put(frame("b"), OverflowPolicy.NEVER_DROP), 1)
+        return queue.max_depth, await contents(queue), queue.dropped
+
+    assert asyncio.run(run()) == (2, ["a", "b"], 0)
+
+
+def test_drop_oldest_evicts_the_oldest_droppable_frame():
+    async def run():
+        queue = IngestQueue(3)
+        await queue.put(frame("command"), OverflowPolicy.NEVER_DROP)
+        await queue.put(frame("meter-1"), OverflowPolicy.DROP_OLDEST)
+        await queue.put(frame("meter-2"), OverflowPolicy.DROP_OLDEST)
+        await asyncio.wait_for(queue.put(frame("meter-3"), OverflowPolicy.DROP_OLDEST), 1)
+        return await contents(queue), queue.dropped
+
+    assert asyncio.run(run()) == (["command", "meter-2", "meter-3"], 1)
+
+
+def test_drop_oldest_drops_the_new_frame_when_nothing_else_may_go():
+    async def run():
+        queue = IngestQueue(2)
+        await queue.put(frame("a"), OverflowPolicy.BLOCK)
+        await queue.put(frame("b"), OverflowPolicy.NEVER_DROP)
+        await asyncio.wait_for(queue.put(frame("meter"), OverflowPolicy.DROP_OLDEST), 1)
+        return await contents(queue), queue.dropped
+
+    assert asyncio.run(run()) == (["a", "b"], 1)
+
+
+@pytest.mark.parametrize("kind, service_type, outcome", [
+    ("pubsub#service", ServiceType.METER.value, "dropped"),
+    ("command", None, "admitted"),
+    ("pubsub#service", ServiceType.TEMPERATURE.value, "blocked"),
+])
+def test_client_applies_the_default_policies(kind, service_type, outcome):
+    async def run():
+        client = SmartHQClient("user", "password", ingest_workers=1, ingest_queue_size=1)
+        queue = client._ingest_queues[0]
+        await client._ingest(frame("full") | {"deviceId": "d1", "serviceType": ServiceType.TEMPERATURE.value})
+        try:
+            await asyncio.wait_for(client._ingest({"kind": kind, "serviceType": service_type, "deviceId": "d1"}), 0.2)
+        except asyncio.TimeoutError:
+            return "blocked"
+        return "dropped" if queue.dropped else "admitted" if len(queue) == 2 else None
+
+    assert asyncio.run(run()) == outcome
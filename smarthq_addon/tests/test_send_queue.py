@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+
+from smarthq_client import OutboundFrame, SendPriority, SmartHQClient, TokenBucket
+
+
+class RecordingSocket:
+    """Stands in for the WebSocket; the first `failures` sends raise as a dropped connection would"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.sent = []
+
+    async def send(self, frame: str):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection lost")
+        self.sent.append(json.loads(frame)["id"])
+
+    async def close(self):
+        pass
+
+
+def attach(client: SmartHQClient, socket: RecordingSocket):
+    client.websocket = socket
+    client.connected = True
+    client._start_writer()
+
+
+def test_token_bucket_allows_a_burst_then_throttles():
+    async def run():
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(2):
+            await bucket.acquire()
+        return burst, time.monotonic() - started, bucket.throttled
+
+    burst, total, throttled = asyncio.run(run())
+    assert burst < 0.02
+    assert total >= 2 / 50 * 0.9
+    assert throttled == 2
+
+
+def test_token_bucket_rate_zero_never_waits():
+    async def run():
+        bucket = TokenBucket(rate=0, burst=1)
+        for _ in range(100):
+            await bucket.acquire()
+        return bucket.throttled
+
+    assert asyncio.run(run()) == 0
+
+
+def test_writer_sends_in_priority_order():
+    async def run():
+        client = SmartHQClient("user", "password", send_rate=0)
+        for name, priority in (
+            ("bulk-1", SendPriority.BULK), ("command", SendPriority.COMMAND), ("ping-1", SendPriority.CONTROL),
+            ("bulk-2", SendPriority.BULK), ("ping-2", SendPriority.CONTROL),
+        ):
+            client._enqueue_frame(OutboundFrame(client.encoder({"id": name}), priority))
+        socket = RecordingSocket()
+        attach(client, socket)
+        await asyncio.sleep(0.05)
+        client._stop_writer()
+        return socket.sent
+
+    assert asyncio.run(run()) == ["ping-1", "ping-2", "command", "bulk-1", "bulk-2"]
+
+
+def test_command_is_retried_after_reconnecting():
+    async def run():
+        client = SmartHQClient("user", "password", send_rate=0)
+        await client._handle_message({"kind": "device", "deviceId": "d1", "deviceType": "oven"})
+        attach(client, RecordingSocket(failures=1))
+        command_id = await client.send_command("d1", "set", [1])
+        await asyncio.sleep(0.05)
+        # The connection drops: queued commands are kept, other frames fail
+        client._stop_writer()
+        retried = client.commands_retried
+
+        socket = RecordingSocket()
+        attach(client, socket)
+        await asyncio.sleep(0.05)
+        pending = command_id in client._pending_commands
+        client._cancel_pending_commands()
+        client._stop_writer()
+        await client.dispatcher.aclose()
+        return command_id, retried, socket.sent, pending
+
+    command_id, retried, sent, pending = asyncio.run(run())
+    assert retried == 1
+    assert sent == [command_id]
+    # Written, so now awaiting its acknowledgement
+    assert pending
+
+
+def test_queued_frames_other_than_commands_fail_on_disconnect():
+    async def run():
+        client = SmartHQClient("user", "password", send_rate=0)
+        written = asyncio.get_running_loop().create_future()
+        client._enqueue_frame(OutboundFrame(client.encoder({"id": "refresh"}), SendPriority.BULK, written=written))
+        client._stop_writer()
+        return written.exception()
+
+    assert isinstance(asyncio.run(run()), ConnectionError)
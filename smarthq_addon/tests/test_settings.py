@@ -0,0 +1,36 @@
+import json
+import os
+
+import pytest
+
+from main import Settings, load_addon_options
+
+
+def test_addon_options_become_settings(tmp_path):
+    path = tmp_path / "options.json"
+    path.write_text(json.dumps({
+        "accounts": [{"name": "home", "username": "u", "password": "p"}],
+        "coalesce_policies": [{"service_type": "cloud.smarthq.service.meter", "window": 10.0, "threshold": 0.5}],
+        "history_tiers": [{"step": 0, "retention": 3600}],
+        "send_rate": 5.0,
+    }))
+    settings = Settings(**load_addon_options(str(path)))
+    assert settings.accounts[0].name == "home"
+    assert settings.accounts[0].region == "US"
+    assert settings.coalesce_policies == {"cloud.smarthq.service.meter": {"window": 10.0, "threshold": 0.5}}
+    assert settings.history_tiers == [{"step": 0, "retention": 3600}]
+    assert settings.send_rate == 5.0
+
+
+def test_missing_options_file_keeps_defaults(tmp_path):
+    assert load_addon_options(str(tmp_path / "options.json")) == {}
+
+
+def test_config_yaml_declares_every_option():
+    yaml = pytest.importorskip("yaml")
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    assert config["options"].keys() == config["schema"].keys()
+    assert set(config["options"]) == set(Settings.model_fields) - {"host", "port"}
+    # The defaults load as they are
+    Settings(**{**config["options"], "coalesce_policies": {}})
@@ -0,0 +1,172 @@
+import asyncio
+import collections
+
+from simulator import SmartHQSimulator
+from smarthq_client import SmartHQClient
+
+
+def make_client(**kwargs) -> SmartHQClient:
+    return SmartHQClient("user", "password", **kwargs)
+
+
+def record_events(client: SmartHQClient, *events: str) -> collections.Counter:
+    counts = collections.Counter()
+    for event in events:
+        client.add_event_handler(event, lambda *args, event=event: counts.update([event]))
+    return counts
+
+
+def test_presence_without_last_seen_keeps_it():
+    async def run():
+        client = make_client()
+        events = record_events(client, "presence_changed")
+        await client._handle_message({"kind": "device", "deviceId": "d1", "deviceType": "oven"})
+        await client._handle_message({
+            "kind": "presence", "deviceId": "d1",
+            "presence": {"online": True, "lastSeen": "2024-01-01T00:00:00Z"},
+        })
+        last_seen = client.devices["d1"].last_seen
+        # Shaped like a GET /v2/device listing entry
+        await client._handle_presence_message({"deviceId": "d1", "presence": {"online": True}})
+        await client.dispatcher.aclose()
+        return client.devices["d1"], last_seen, events
+
+    device, last_seen, events = asyncio.run(run())
+    assert last_seen is not None
+    assert device.last_seen == last_seen
+    assert events["presence_changed"] == 1
+
+
+def test_service_messages_advance_device_last_sync():
+    async def run():
+        client = make_client()
+        await client._handle_message({"kind": "device", "deviceId": "d1", "deviceType": "oven"})
+        for celsius, synced in ((180, "2024-01-02T00:00:00Z"), (190, "2024-01-01T00:00:00Z")):
+            await client._handle_message({
+                "kind": "pubsub#service", "serviceId": f"s{celsius}", "deviceId": "d1",
+                "serviceType": "cloud.smarthq.service.temperature", "domainType": "x",
+                "state": {"celsius": celsius}, "config": {}, "lastSyncTime": synced,
+            })
+        await client.dispatcher.aclose()
+        return client.devices["d1"]
+
+    assert asyncio.run(run()).last_sync == "2024-01-02T00:00:00Z"
+
+
+def test_first_reconnect_fetches_no_unchanged_devices():
+    async def run():
+        simulator = SmartHQSimulator(devices=6, rate=0, port=0)
+        await simulator.start()
+        client = make_client(websocket_url=simulator.url, reconnect_interval=0.1)
+        try:
+            await client.connect()
+            await asyncio.sleep(0.3)
+            events = record_events(client, "device_updated")
+            await simulator.drop_connections()
+            for _ in range(50):
+                await asyncio.sleep(0.05)
+                if client.last_reconcile:
+                    break
+            return client.last_reconcile, events
+        finally:
+            await client.disconnect()
+            await simulator.stop()
+
+    reconcile, events = asyncio.run(run())
+    assert reconcile["devices"] == 6
+    assert reconcile["fetched"] == 0
+    assert events["device_updated"] == 0
+
+
+def test_disconnect_reports_disconnected_once():
+    async def run():
+        simulator = SmartHQSimulator(devices=2, rate=0, port=0)
+        await simulator.start()
+        client = make_client(websocket_url=simulator.url)
+        events = record_events(client, "disconnected")
+        try:
+            await client.connect()
+            await asyncio.sleep(0.2)
+            await client.disconnect()
+            await asyncio.sleep(0.1)
+        finally:
+            await simulator.stop()
+        return events
+
+    assert asyncio.run(run())["disconnected"] == 1
+
+
+def fake_api(client: SmartHQClient, listing) -> list:
+    """Answer digital twin API requests with `listing` for the device list, recording the paths"""
+    paths = []
+
+    async def api_request(method, path):
+        paths.append(path)
+        return listing if path == "/v2/device" else {"services": []}
+
+    client._api_request = api_request
+    return paths
+
+
+def test_reconcile_keeps_registry_without_a_devices_list():
+    async def run(listing):
+        client = make_client()
+        events = record_events(client, "device_removed")
+        await client._handle_message({"kind": "device", "deviceId": "d1", "deviceType": "oven"})
+        fake_api(client, listing)
+        result = await client.reconcile()
+        await client.dispatcher.aclose()
+        return result, set(client.devices), events
+
+    # Another listing shape, and a non-object body (which _api_request returns as {})
+    for listing in ({"items": [{"deviceId": "d2"}]}, {}):
+        result, devices, events = asyncio.run(run(listing))
+        assert result is None
+        assert devices == {"d1"}
+        assert events["device_removed"] == 0
+
+
+def test_warm_start_reconcile_fetches_only_changed_devices():
+    async def run():
+        client = make_client()
+        client.restore([
+            {"deviceId": "d1", "deviceType": "oven", "lastSyncTime": "2024-01-01T00:00:00Z"},
+            {"deviceId": "d2", "deviceType": "oven", "lastSyncTime": "2024-01-01T00:00:00Z"},
+        ], [])
+        paths = fake_api(client, {"devices": [
+            {"deviceId": "d1", "deviceType": "oven", "lastSyncTime": "2024-01-01T00:00:00Z"},
+            {"deviceId": "d2", "deviceType": "oven", "lastSyncTime": "2024-01-02T00:00:00Z"},
+        ]})
+        result = await client.reconcile()
+        await client.dispatcher.aclose()
+        return result, paths
+
+    result, paths = asyncio.run(run())
+    assert result["fetched"] == 1
+    assert paths == ["/v2/device", "/v2/device/d2"]
+
+
+def service_frame(service_id: str, device_id: str = "d1", celsius: int = 180) -> dict:
+    return {
+        "kind": "pubsub#service", "serviceId": service_id, "deviceId": device_id,
+        "serviceType": "cloud.smarthq.service.temperature", "domainType": "x",
+        "state": {"celsius": celsius}, "config": {},
+    }
+
+
+def test_drain_ingest_waits_until_frames_are_handled():
+    async def run():
+        client = make_client(ingest_workers=2)
+        client._start_ingest_workers()
+        for index in range(50):
+            await client._ingest(service_frame(f"s{index}", device_id=f"d{index % 5}"))
+        queued = sum(client.ingest_stats()["depth"])
+        await client.drain_ingest()
+        handled = len(client.services)
+        client._stop_ingest_workers()
+        await client.dispatcher.aclose()
+        return queued, handled
+
+    queued, handled = asyncio.run(run())
+    assert queued > 0
+    assert handled == 50